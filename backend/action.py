@@ -1,14 +1,45 @@
 import os
+import threading
+from contextlib import contextmanager
 from backend.file_info import FileInfo
+import backend.trace as trace
+import backend.copy_engine as copy_engine
+import backend.device_cache as device_cache
+from backend.destination_index import get_index, CONFLICT_POLICIES
 from pathlib import Path
 import send2trash
-import shutil
-import time
+
+# The callback of the action running on each thread, if any (see on_destination)
+destination_callbacks = threading.local()
+
+# Context manager that makes the actions run on this thread call callback(path, taken) once their conflict policy has
+# picked the path they write to, and before they write to it. taken tells whether the path held a file already, which
+# is only the case under "overwrite". Jobs use it to journal the real target of each action.
+@contextmanager
+def on_destination(callback):
+    previous = getattr(destination_callbacks, "callback", None)
+    destination_callbacks.callback = callback
+    try:
+        yield
+    finally:
+        destination_callbacks.callback = previous
 
 class Action:
-    def __init__(self, type, final_folder = None, new_name = None):
+    # Metadata copied along with a file's contents by the copy action (see copy_engine.PRESERVE_OPTIONS)
+    copy_preserve = "mode"
+    # How a move to another device checks the copy before removing the source (see device_cache.VERIFY_OPTIONS)
+    move_verify = "size"
+    # What move, copy and rename do when the target name is taken, unless an action sets its own on_conflict
+    # (see destination_index.CONFLICT_POLICIES)
+    conflict_policy = "skip"
+
+    def __init__(self, type, final_folder = None, new_name = None, on_conflict = None):
         self.type = type
         self.new_name = new_name
+
+        if on_conflict is not None and on_conflict not in CONFLICT_POLICIES:
+            raise ValueError(f"Invalid conflict policy {on_conflict}, must be one of {', '.join(CONFLICT_POLICIES)}")
+        self.on_conflict = on_conflict
         
         if final_folder is None:
             self.final_folder = final_folder
@@ -34,6 +65,8 @@ class Action:
     
     # Helper function to get the final path of the file
     def get_target_path(self, file):
+        if self.type == "move" and self.new_name:
+            return os.path.join(self.final_folder, self.new_name)
         if self.type in ["move", "copy"]:
             return os.path.join(self.final_folder, file.name + file.extension)
         elif self.type == "rename":
@@ -44,7 +77,8 @@ class Action:
     
     def get_reverse_action(self, file: FileInfo) -> 'Action':
         if self.type == "move":
-            print(f"REVERSE: Reverse destination for file at path {file.path} is {os.path.dirname(file.path)}")
+            if trace.debug_enabled:
+                trace.debug("action", f"Reverse destination for file at path {file.path} is {os.path.dirname(file.path)}")
             return Action("move", final_folder=os.path.dirname(file.path))
         elif self.type == "copy":
             return Action("recycle")
@@ -59,31 +93,59 @@ class Action:
             raise ValueError(f"No reverse defined for action type {self.type}")
         
 
-    # Function to move a given file to the final folder
+    def get_conflict_policy(self):
+        return self.on_conflict or Action.conflict_policy
+
+    # Helper function to run an operation that writes a file to destination, applying the conflict policy first.
+    # operation(path, overwrite) does the work. Returns the path written, or None if the file was skipped.
+    def write_destination(self, file, destination, operation):
+        index = get_index()
+        policy = self.get_conflict_policy()
+        overwrite = policy == "overwrite"
+        taken = overwrite and index.exists(destination)
+        destination = index.resolve(file.path, destination, policy)
+        if destination is None:
+            return None  # Skip the file
+
+        callback = getattr(destination_callbacks, "callback", None)
+        try:
+            if callback is not None:
+                callback(destination, taken)
+            operation(destination, overwrite)
+        except BaseException:
+            if not overwrite:
+                index.remove(destination)
+            raise
+        index.add(destination)
+        return destination
+
+    # Function to move a given file to the final folder, under new_name if one is set. Same-device moves are a single
+    # rename; moves to another device are copied, verified and then removed. Returns the new path, or None if skipped.
     def move_file(self, file):
         Action.verify(file)
 
-        destination = os.path.join(self.final_folder, os.path.basename(file.path))
+        destination = os.path.join(self.final_folder, self.new_name or os.path.basename(file.path))
 
         try:
-            if os.path.exists(destination):
-                return  # Skip the file
-            shutil.move(file.path, destination)
+            new_path = self.write_destination(file, destination, lambda path, overwrite: device_cache.move_file(
+                file.path, path, verify=Action.move_verify, overwrite=overwrite))
         except Exception as e:
-            print(f"Failed to move file '{file.path}' to '{destination}': {e}")
+            trace.error("action", f"Failed to move file '{file.path}' to '{destination}': {e}", path=file.path, destination=destination)
+            return None
 
-    
-    # Function to copy a given file to the final folder
+        if new_path is not None:
+            get_index().remove(file.path)
+        return new_path
+
+    # Function to copy a given file to the final folder. Returns the path of the copy, or None if the file was skipped.
     def copy_file(self, file):
         Action.verify(file)
 
-        if os.path.exists(os.path.join(self.final_folder, file.path)):
-            # TODO: Implement overwriting logic
-            raise NotImplementedError("Overwrite logic has not been implemented")
-        
-        shutil.copy(file.path, self.final_folder)
+        destination = os.path.join(self.final_folder, os.path.basename(file.path))
+        return self.write_destination(file, destination, lambda path, overwrite: copy_engine.copy_file(
+            file.path, path, Action.copy_preserve))
 
-    # Function to rename a given file
+    # Function to rename a given file. Returns the new path, or None if the file was skipped.
     def rename_file(self, file):
         Action.verify(file)
 
@@ -91,12 +153,12 @@ class Action:
             raise ValueError("No argument provided for rename operation")
 
         new_path = file.path.replace(file.name, self.new_name)
+        new_path = self.write_destination(file, new_path, lambda path, overwrite: (os.replace if overwrite else os.rename)(
+            file.path, path))
 
-        if os.path.exists(new_path):
-            # TODO: Implement overwriting logic
-            raise NotImplementedError("Overwrite logic has not been implemented")
-
-        os.rename(file.path, new_path)
+        if new_path is not None:
+            get_index().remove(file.path)
+        return new_path
         
     # Function to recycle a given file
     def recycle_file(self, file):
@@ -104,46 +166,53 @@ class Action:
 
         clean_path = Path(file.path).resolve()
         send2trash.send2trash(str(clean_path))
+        get_index().remove(file.path)
+        return self.get_target_path(file)
     
-    # Function to log the action
-    def log_action(self, file, logger):
-        old_path = file.path
-        new_path = self.get_target_path(file)
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-
-        log_entry = f"[{timestamp}] {self.type.upper()} | From: {old_path} -> To: {new_path}\n"
-        logger.write(log_entry)
-        logger.flush()
+    # Function to log the action on a LogWriter, which formats and writes it in the background.
+    # new_path is where the file ended up, if it differs from get_target_path.
+    def log_action(self, file, logger, new_path=None):
+        logger.log(self.type, file.path, new_path or self.get_target_path(file))
             
-    # Primary function to execute the action based on given arguments
+    # Primary function to execute the action based on given arguments. Returns the file's new path,
+    # or None if the file was skipped, in which case the file is left unchanged.
     def execute(self, file, logger=None):
         if self.type in self.functions:
-            print(f"ACTION: Executing action of type {self.type}")
-            result = self.functions[self.type](file)
+            if trace.debug_enabled:
+                trace.debug("action", f"Executing action of type {self.type}", path=file.path)
+            new_path = self.functions[self.type](file)
+            if new_path is None:
+                return None
             if logger:
-                self.log_action(file, logger)
-            file.path = self.get_target_path(file)
+                self.log_action(file, logger, new_path)
+            file.path = new_path
             file.name = os.path.basename(file.path)
-            return result
+            return new_path
         else:
             raise ValueError(f"Invalid key: {self.type}")
     
     def __repr__(self):
         return (f"Action(type={self.type!r}, final_folder={self.final_folder!r}, "
-                f"new_name={self.new_name!r})")
+                f"new_name={self.new_name!r}, on_conflict={self.on_conflict!r})")
     
     def to_dict(self):
         return {
             "type": self.type,
             "final_folder": self.final_folder,
-            "new_name": self.new_name
+            "new_name": self.new_name,
+            "on_conflict": self.on_conflict
         }
 
+    # check_folder=False loads an action whose final folder no longer exists, e.g. from a recovered job's journal
     @classmethod
-    def from_dict(cls, data):
-        return cls(
+    def from_dict(cls, data, check_folder=True):
+        action = cls(
             type=data["type"],
-            final_folder=data.get("final_folder"),
-            new_name=data.get("new_name")
+            final_folder=data.get("final_folder") if check_folder else None,
+            new_name=data.get("new_name"),
+            on_conflict=data.get("on_conflict")
         )
+        if not check_folder:
+            action.final_folder = data.get("final_folder")
+        return action
     
\ No newline at end of file
@@ -0,0 +1,129 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import backend.trace as trace
+from backend.action import on_destination
+from backend.device_cache import get_cache
+
+class ActionExecutor:
+    """
+    Runs matched rules' actions on a thread pool so several file operations are in flight at once.
+
+    Each task is limited by a semaphore per device (st_dev) it touches, its source folder and its
+    destination folder, so one slow disk cannot be flooded while others sit idle. Semaphores are
+    always acquired in device order, so two tasks can never wait on each other. Tasks that touch
+    the same source or target path run in the order they were submitted, so a file's chained
+    actions stay ordered and two files moving to the same name behave as they would serially.
+    results() returns the undo records in submission order, exactly as the serial job builds them.
+    """
+    default_workers = 8
+
+    def __init__(self, workers=None, per_device=4, logger=None, devices=None):
+        self.workers = workers or ActionExecutor.default_workers
+        self.per_device = per_device
+        self.logger = logger        # LogWriter, which can be used from any thread
+        self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ActionExecutor")
+
+        self.futures = []           # Futures in submission order
+        self.errors = []            # Exceptions raised by tasks, in submission order
+        self.pending_paths = {}     # Normalized path -> future of the last task that touches it
+        self.devices = devices or get_cache()   # Folder devices, shared with the move actions
+        self.semaphores = {}        # st_dev -> semaphore
+        self.lock = threading.Lock()
+
+    # Helper function to return the device of a folder; unknown devices share one limit
+    def get_device(self, folder_path):
+        return self.devices.get_device(folder_path)
+
+    # Helper function to return the semaphore limiting operations on a device
+    def get_semaphore(self, device):
+        with self.lock:
+            semaphore = self.semaphores.get(device)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_device)
+                self.semaphores[device] = semaphore
+            return semaphore
+
+    # Helper function to return the folders an action reads from and writes to
+    @staticmethod
+    def get_folders(action, file):
+        source_folder = os.path.dirname(file.path)
+        if action.type in ("move", "copy") and action.final_folder is not None:
+            return {source_folder, action.final_folder}
+        return {source_folder}
+
+    # Queue a matched rule's action on a file. Returns a future for the file's undo records. destination_callback, if
+    # given, is told the path the action writes to before it writes there (see action.on_destination).
+    def submit(self, ruleset, rule, file, destination_callback=None):
+        paths = {os.path.normpath(file.path)}
+        if rule.action.type != "recycle":
+            paths.add(os.path.normpath(rule.action.get_target_path(file)))
+        folders = ActionExecutor.get_folders(rule.action, file)
+
+        with self.lock:
+            waits = [self.pending_paths[path] for path in paths if path in self.pending_paths]
+            future = self.pool.submit(self.run_task, ruleset, rule, file, folders, waits, destination_callback)
+            for path in paths:
+                self.pending_paths[path] = future
+            self.futures.append(future)
+        return future
+
+    # Helper function run on a worker thread: wait for earlier tasks on the same paths, then run the action
+    # while holding the semaphores of the devices involved
+    def run_task(self, ruleset, rule, file, folders, waits, destination_callback=None):
+        # Earlier tasks were queued first, so they are already running or finished and this cannot deadlock
+        if waits:
+            wait(waits)
+
+        devices = sorted({self.get_device(folder) for folder in folders})
+        semaphores = [self.get_semaphore(device) for device in devices]
+        for semaphore in semaphores:
+            semaphore.acquire()
+        try:
+            with on_destination(destination_callback):
+                return ruleset.apply_rule(rule, file, self.logger)
+        except FileNotFoundError as e:
+            trace.warning("action_executor", f"Skipping {file.path} - {e}", path=file.path)
+            return []
+        finally:
+            for semaphore in reversed(semaphores):
+                semaphore.release()
+
+    # Wait for every submitted task and return the undo records of those that succeeded, in submission order.
+    # Exceptions raised by tasks are kept in self.errors, so the caller can record the finished actions
+    # for undo before raising.
+    def results(self):
+        wait(self.futures)
+        records = []
+        for future in self.futures:
+            if future.cancelled():
+                continue
+            error = future.exception()
+            if error is not None:
+                trace.error("action_executor", f"Action failed - {error}")
+                self.errors.append(error)
+            else:
+                records.extend(future.result())
+        self.futures = []
+        self.pending_paths = {}
+        return records
+
+    # Cancel the tasks that have not started yet, e.g. when a job is cancelled. Tasks already running finish.
+    def cancel_pending(self):
+        with self.lock:
+            cancelled = sum(future.cancel() for future in self.futures)
+        if cancelled:
+            trace.info("action_executor", f"Cancelled {cancelled} pending actions", cancelled=cancelled)
+        return cancelled
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"ActionExecutor(workers={self.workers}, per_device={self.per_device}, pending={len(self.futures)})"
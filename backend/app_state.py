@@ -1,5 +1,26 @@
+import os
+
 class AppState:
     def __init__(self):
         self.rulesets = {}
         self.target_directory = None
-        self.selected_folder = None
\ No newline at end of file
+        self.selected_folder = None
+        self.streaming = False # Sort files as they are scanned instead of scanning the whole tree first
+        self.batch = False # Match files with the NumPy batch evaluator over a FileTable; ignored when streaming
+        self.scan_index = None # Optional ScanIndex used instead of a full rescan of the target directory
+        self.rule_stats = None # Optional RuleStats collected by sorting jobs to order match_all conditions
+        self.action_workers = 1 # Threads sorting jobs run actions on; 1 runs them one at a time
+        self.journal_dir = None # Directory sorting jobs keep their write-ahead journals in; None disables journaling
+
+# Return the per-user directory QwikSort keeps its data in, creating it if needed
+def get_app_data_dir():
+    if os.name == "nt":
+        base_dir = os.environ.get("APPDATA") or os.path.expanduser("~")
+        path = os.path.join(base_dir, "QwikSort")
+    else:
+        base_dir = os.environ.get("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share")
+        path = os.path.join(base_dir, "qwiksort")
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
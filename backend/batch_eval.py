@@ -0,0 +1,163 @@
+"""
+Evaluates rulesets against a whole FileTable at once using NumPy boolean masks.
+
+Size and date conditions are a single array comparison over the table's int64 columns, so sweeps
+over very large scans run at array speed instead of one Python call per file. Name, extension and
+path conditions are supported as well: extensions are tested once per distinct extension, and
+names and paths once per row. NumPy is an optional dependency; it is only needed when this module is used.
+"""
+import os
+import operator
+from backend.condition import Condition
+from backend.rule_compiler import normalize_value, compile_value_test
+from backend.duplicates import get_finder
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Operators that can be applied to whole arrays
+ARRAY_OPERATORS = {
+    ">": operator.gt,
+    "<": operator.lt,
+    ">=": operator.ge,
+    "<=": operator.le,
+    "==": operator.eq,
+    "!=": operator.ne
+}
+
+class BatchEvaluator:
+    """
+    Matches every row of a FileTable against a dictionary of rulesets.
+
+    The rules that can win are flattened into `rules`, a list of (ruleset, rule) pairs: each
+    rule of a match-one ruleset, and the final rule of a match_all ruleset. evaluate() returns,
+    for each row, the index into `rules` of the rule whose action should run, or -1 if no
+    ruleset matches. Ruleset order and first-match semantics are the same as in sorting_job.
+    With a RuleStats, each condition's evaluations and passes are counted over the rows it decides.
+    """
+    def __init__(self, rulesets, stats=None):
+        if np is None:
+            raise ImportError("BatchEvaluator requires NumPy (pip install numpy)")
+
+        self.rules = []     # Winning rules, as (ruleset, rule) pairs
+        self.groups = []    # Per ruleset: (match_all, conditions, indices into self.rules)
+        self.stats = stats
+
+        for _, ruleset in rulesets.items():
+            rules = list(ruleset.sorting_rules)
+            if not rules:
+                continue
+
+            conditions = [rule.condition for rule in rules]
+            for condition in conditions:
+                BatchEvaluator.validate(condition)
+
+            if ruleset.match_all:
+                self.groups.append((True, conditions, [len(self.rules)]))
+                self.rules.append((ruleset, rules[-1]))
+            else:
+                indices = list(range(len(self.rules), len(self.rules) + len(rules)))
+                self.groups.append((False, conditions, indices))
+                self.rules.extend((ruleset, rule) for rule in rules)
+
+    # Helper function to raise ValueError for conditions that cannot be evaluated
+    @staticmethod
+    def validate(condition):
+        normalize_value(condition)
+        if condition.type not in Condition.string_types + ("duplicate",) and condition.operation not in ARRAY_OPERATORS:
+            raise ValueError(f"Operator {condition.operation} cannot be used with condition type \"{condition.type}\"")
+
+    # Helper function to convert a nanosecond column to microseconds, matching the precision of datetime
+    @staticmethod
+    def to_microseconds(column):
+        return (np.frombuffer(column, dtype=np.int64) + 500) // 1000
+
+    # Return a boolean mask of the rows of the table that satisfy a condition.
+    # columns caches the converted table columns between calls.
+    @staticmethod
+    def condition_mask(condition, table, columns=None):
+        if columns is None:
+            columns = {}
+        value = normalize_value(condition)
+
+        if condition.type == "size":
+            if "size" not in columns:
+                columns["size"] = np.frombuffer(table.sizes, dtype=np.int64)
+            return ARRAY_OPERATORS[condition.operation](columns["size"], value)
+
+        if condition.type in ("dateCreated", "dateModified"):
+            if condition.type not in columns:
+                column = table.created_ns if condition.type == "dateCreated" else table.modified_ns
+                columns[condition.type] = BatchEvaluator.to_microseconds(column)
+            return ARRAY_OPERATORS[condition.operation](columns[condition.type], round(value.timestamp() * 1_000_000))
+
+        if condition.type == "duplicate":
+            # Only rows with the same size as a file in the folder can be duplicates; the rest are never read
+            finder = get_finder()
+            sizes = np.frombuffer(table.sizes, dtype=np.int64)
+            bucket_sizes = np.fromiter(finder.get_size_buckets(os.path.normpath(value)).keys(), dtype=np.int64)
+            rows = np.flatnonzero(np.isin(sizes, bucket_sizes))
+            files = [table.file_info(row) for row in rows]
+            duplicates = finder.find_duplicates(files, value)
+            mask = np.zeros(len(table), dtype=bool)
+            mask[rows] = [os.path.normpath(file.path) in duplicates for file in files]
+            return mask if condition.operation == "==" else ~mask
+
+        test = compile_value_test(condition)
+
+        if condition.type == "extension":
+            # Test each distinct extension once, then index the result by each row's extension id
+            if "extension_ids" not in columns:
+                columns["extension_ids"] = np.frombuffer(table.extension_ids, dtype=np.int64)
+            lookup = np.fromiter((test(extension) for extension in table.extensions), dtype=bool, count=len(table.extensions))
+            return lookup[columns["extension_ids"]]
+
+        # Names and paths are tested once per row
+        if condition.type not in columns:
+            read = table.name if condition.type == "name" else table.path
+            columns[condition.type] = [read(index) for index in range(len(table))]
+        return np.fromiter((test(value) for value in columns[condition.type]), dtype=bool, count=len(table))
+
+    # Return an int64 array with the index into self.rules of the winning rule for each row, or -1 for no match
+    def evaluate(self, table):
+        count = len(table)
+        winners = np.full(count, -1, dtype=np.int64)
+        columns = {}
+
+        for match_all, conditions, indices in self.groups:
+            unmatched = winners == -1
+            if not unmatched.any():
+                break
+
+            if match_all:
+                # Every condition is evaluated over the same rows, so their pass rates do not depend on their order
+                evaluated = int(unmatched.sum())
+                mask = unmatched
+                for condition in conditions:
+                    passed = unmatched & BatchEvaluator.condition_mask(condition, table, columns)
+                    if self.stats is not None:
+                        self.stats.add_counts(condition, evaluated, int(passed.sum()))
+                    mask = mask & passed
+                winners[mask] = indices[0]
+            else:
+                for condition, index in zip(conditions, indices):
+                    evaluated = int(unmatched.sum()) if self.stats is not None else 0
+                    mask = unmatched & BatchEvaluator.condition_mask(condition, table, columns)
+                    if self.stats is not None:
+                        self.stats.add_counts(condition, evaluated, int(mask.sum()))
+                    winners[mask] = index
+                    unmatched &= ~mask
+
+        return winners
+
+    # Generator that yields (row, ruleset, rule) for every row of the table that matched, in table order
+    def iter_matches(self, table):
+        winners = self.evaluate(table)
+        for row in np.flatnonzero(winners >= 0):
+            ruleset, rule = self.rules[winners[row]]
+            yield int(row), ruleset, rule
+
+    def __repr__(self):
+        return f"BatchEvaluator(rulesets={len(self.groups)}, rules={len(self.rules)})"
@@ -1,6 +1,11 @@
 from datetime import datetime
 from backend.file_info import *
+import backend.trace as trace
+from backend.duplicates import get_finder
 import operator
+import fnmatch
+import functools
+import re
 
 class Condition:
     operators = {
@@ -11,19 +16,32 @@ class Condition:
         "==": operator.eq, 
         "!=": operator.ne,
         "includes": lambda a, b: b.lower() in a.lower(),
-        "excludes": lambda a, b: b.lower() not in a.lower()
+        "excludes": lambda a, b: b.lower() not in a.lower(),
+        # Pattern operators take the compiled pattern from Condition.get_pattern as their right operand
+        "regex": lambda a, b: b.search(a) is not None,
+        "notRegex": lambda a, b: b.search(a) is None,
+        "glob": lambda a, b: b.match(a) is not None,
+        "notGlob": lambda a, b: b.match(a) is None
     }
 
+    # Operators whose value is a regular expression or glob pattern, and the types they can be used with
+    pattern_operators = ("regex", "notRegex", "glob", "notGlob")
+    string_types = ("name", "extension", "path")
+
     def __init__(self, type, operation, value):
         self.type = type
         self.operation = operation
         self.value = value
+        self._pattern = None
+        self._pattern_key = None
         self.functions = {
             "name": self.check_name,
             "extension": self.check_extension,
+            "path": self.check_path,
             "size": self.check_size,
             "dateCreated": self.check_creation,
-            "dateModified": self.check_modified
+            "dateModified": self.check_modified,
+            "duplicate": self.check_duplicate
         }
 
     # Helper function to verify if a file is of type FileInfo
@@ -38,7 +56,8 @@ class Condition:
         if op not in Condition.operators:
             raise ValueError(f"Invalid operator {op}")
         
-        print(f"Evaluating: {left!r} {op} {right!r}")
+        if trace.debug_enabled:
+            trace.debug("condition", f"Evaluating: {left!r} {op} {right!r}")
 
         # Convert to strings
         if isinstance(left, str) and isinstance(right, str):
@@ -46,6 +65,33 @@ class Condition:
 
         return Condition.operators[op](left, right)
     
+    # Helper function to compile a regular expression or glob pattern. Compiled patterns are shared
+    # through a bounded cache, so many rules using the same pattern only compile it once.
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def compile_pattern(operation, pattern):
+        source = fnmatch.translate(pattern) if operation in ("glob", "notGlob") else pattern
+        try:
+            return re.compile(source, re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"Invalid pattern {pattern!r} - {e}")
+
+    # Return the compiled pattern for a regex or glob condition. It is kept on the condition,
+    # and compiled again only if the operation or value changes.
+    def get_pattern(self):
+        key = (self.operation, self.value)
+        if self._pattern_key != key:
+            self._pattern = Condition.compile_pattern(self.operation, self.value)
+            self._pattern_key = key
+        return self._pattern
+
+    # Helper function to compare a string attribute of a file. Pattern operators get the compiled pattern,
+    # which is case-insensitive instead of lowercased, since lowercasing would change escapes like \D.
+    def evaluate_string(self, left):
+        if self.operation in Condition.pattern_operators:
+            return Condition.evaluate(left, self.operation, self.get_pattern())
+        return Condition.evaluate(left, self.operation, self.value)
+
     # Function to return the class operation to a string
     def operation_to_string(self):
         operation_map = {
@@ -56,7 +102,11 @@ class Condition:
             "==": "is equal to",
             "!=": "is not equal to",
             "includes": "contains",
-            "excludes": "does not contain"
+            "excludes": "does not contain",
+            "regex": "matches regex",
+            "notRegex": "does not match regex",
+            "glob": "matches pattern",
+            "notGlob": "does not match pattern"
         }
         return operation_map.get(self.operation, f"Unknown operation: {self.operation}")
     
@@ -67,7 +117,7 @@ class Condition:
         if not isinstance(self.value, str):
             raise ValueError("Condition check of type \"name\" must take value type string")
 
-        return Condition.evaluate(file.name, self.operation, self.value)
+        return self.evaluate_string(file.name)
     
     # Function to compare value to file extension
     def check_extension(self, file):
@@ -76,7 +126,16 @@ class Condition:
         if not isinstance(self.value, str):
             raise ValueError("Condition check of type \"extension\" must take value type string")
 
-        return Condition.evaluate(file.extension, self.operation, self.value)
+        return self.evaluate_string(file.extension)
+
+    # Function to compare value to the full file path
+    def check_path(self, file):
+        Condition.verify(file)
+
+        if not isinstance(self.value, str):
+            raise ValueError("Condition check of type \"path\" must take value type string")
+
+        return self.evaluate_string(file.path)
 
     # Function to compare value to file size
     def check_size(self, file):
@@ -108,9 +167,23 @@ class Condition:
         
         return Condition.evaluate(file.dateModified, self.operation, self.value)
 
+    # Function to check whether the file has the same contents as a file in the value folder.
+    # "==" passes for duplicates and "!=" for files with no duplicate.
+    def check_duplicate(self, file):
+        Condition.verify(file)
+
+        if not isinstance(self.value, str):
+            raise ValueError("Condition check of type \"duplicate\" must take value type string")
+        if self.operation not in ("==", "!="):
+            raise ValueError(f"Operator {self.operation} cannot be used with condition type \"duplicate\"")
+
+        return Condition.evaluate(get_finder().is_duplicate(file, self.value), self.operation, True)
+
     # Primary function to check if a file meets the condition
     def check(self, file):
         if self.type in self.functions:
+            if self.operation in Condition.pattern_operators and self.type not in Condition.string_types:
+                raise ValueError(f"Operator {self.operation} can only be used with condition types {', '.join(Condition.string_types)}")
             return self.functions[self.type](file)
         else:
             raise ValueError(f"Invalid key: {self.type}")
@@ -0,0 +1,164 @@
+"""
+Copies file contents with the cheapest mechanism the platform and filesystem support.
+
+In order of preference:
+    reflink          FICLONE ioctl; the copy shares blocks with the source on copy-on-write
+                     filesystems (Btrfs, XFS, bcachefs), so no data is copied at all
+    copy_file_range  in-kernel copy; filesystems may offload it (e.g. NFS server-side copy)
+    sendfile         in-kernel copy between file descriptors
+    buffered         read/write through a large userspace buffer; works everywhere
+
+Each mechanism that is unsupported for a given pair of files falls through to the next one.
+copy_file returns the name of the mechanism that was used. The copy is written to a temporary file
+next to the destination and only renamed into place once it is complete, so a failed copy never
+touches a file that is already at the destination.
+"""
+import os
+import errno
+import shutil
+import backend.trace as trace
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# _IOW(0x94, 9, int), see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+# Buffer size of the buffered fallback, and the most bytes requested per in-kernel copy call
+BUFFER_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE = 1024 * 1024 * 1024
+
+# Suffix of the temporary file a copy is written to before it is renamed into place
+TEMP_SUFFIX = ".qwiksort-tmp"
+
+# What is copied from the source besides its contents:
+#   "none"      nothing
+#   "mode"      permission bits, as shutil.copy does
+#   "metadata"  permission bits, access and modification times and flags, as shutil.copy2 does
+PRESERVE_OPTIONS = ("none", "mode", "metadata")
+
+# Errors that mean a mechanism is not available for these files, rather than that the copy failed
+UNSUPPORTED_ERRORS = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EBADF, errno.EOPNOTSUPP,
+    errno.ENOTTY, errno.ETXTBSY, errno.EPERM, getattr(errno, "ENOTSUP", errno.EOPNOTSUPP),
+    getattr(errno, "ENOTSOCK", errno.EINVAL)
+}
+
+# Helper function to clone the whole file with a reflink. Returns False if it is not supported.
+def try_reflink(src_fd, dst_fd, size):
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return True
+    except OSError as e:
+        if e.errno in UNSUPPORTED_ERRORS:
+            return False
+        raise
+
+# Helper function to copy with copy_file_range. Returns False if it is not supported.
+def try_copy_file_range(src_fd, dst_fd, size):
+    if not hasattr(os, "copy_file_range"):
+        return False
+    offset = 0
+    try:
+        while offset < size:
+            copied = os.copy_file_range(src_fd, dst_fd, min(CHUNK_SIZE, size - offset), offset, offset)
+            if copied == 0:
+                break
+            offset += copied
+        return True
+    except OSError as e:
+        if offset == 0 and e.errno in UNSUPPORTED_ERRORS:
+            return False
+        raise
+
+# Helper function to copy with sendfile. Returns False if it is not supported.
+def try_sendfile(src_fd, dst_fd, size):
+    if not hasattr(os, "sendfile"):
+        return False
+    offset = 0
+    try:
+        while offset < size:
+            sent = os.sendfile(dst_fd, src_fd, offset, min(CHUNK_SIZE, size - offset))
+            if sent == 0:
+                break
+            offset += sent
+        return True
+    except OSError as e:
+        if offset == 0 and e.errno in UNSUPPORTED_ERRORS:
+            return False
+        raise
+
+# Helper function to copy through a large userspace buffer; always supported
+def copy_buffered(src_fd, dst_fd, size):
+    os.lseek(src_fd, 0, os.SEEK_SET)
+    os.lseek(dst_fd, 0, os.SEEK_SET)
+    buffer = bytearray(min(BUFFER_SIZE, max(size, 1)))
+    view = memoryview(buffer)
+    with open(src_fd, "rb", buffering=0, closefd=False) as src:
+        while True:
+            read = src.readinto(buffer)
+            if not read:
+                break
+            written = 0
+            while written < read:
+                written += os.write(dst_fd, view[written:read])
+    return True
+
+METHODS = [
+    ("reflink", try_reflink),
+    ("copy_file_range", try_copy_file_range),
+    ("sendfile", try_sendfile),
+    ("buffered", copy_buffered)
+]
+
+# Copy the contents of one open file to another and return the name of the mechanism used
+def copy_contents(src_fd, dst_fd, size):
+    for name, method in METHODS:
+        if method(src_fd, dst_fd, size):
+            return name
+
+# Return the temporary path a copy to destination is written to. It is a hidden file in the same folder, so it can be
+# renamed into place, and its name is fixed, so a copy cut short by the process dying can be found and removed.
+def get_temp_path(destination):
+    folder, name = os.path.split(destination)
+    return os.path.join(folder, f".{name}{TEMP_SUFFIX}")
+
+# Copy a file and return the name of the mechanism used. If destination is a directory, the file is
+# copied into it under the same name, as with shutil.copy. preserve is one of PRESERVE_OPTIONS.
+# The copy is written to get_temp_path(destination), checked with check(path) if given, and only then replaces
+# destination. If any step fails, the temporary file is removed and a file already at destination is left untouched.
+def copy_file(source, destination, preserve="mode", check=None):
+    if preserve not in PRESERVE_OPTIONS:
+        raise ValueError(f"Invalid preserve option {preserve}, must be one of {', '.join(PRESERVE_OPTIONS)}")
+
+    if os.path.isdir(destination):
+        destination = os.path.join(destination, os.path.basename(source))
+
+    temp_path = get_temp_path(destination)
+    try:
+        with open(source, "rb") as src:
+            size = os.fstat(src.fileno()).st_size
+            with open(temp_path, "wb") as dst:
+                method = copy_contents(src.fileno(), dst.fileno(), size)
+
+        if preserve == "mode":
+            shutil.copymode(source, temp_path)
+        elif preserve == "metadata":
+            shutil.copystat(source, temp_path)
+        if check is not None:
+            check(temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    if trace.debug_enabled:
+        trace.debug("copy_engine", f"Copied {source} to {destination} using {method}", method=method, size=size)
+    return method
@@ -0,0 +1,144 @@
+import os
+import threading
+import backend.trace as trace
+from backend.duplicates import hash_file
+
+# What an action does when its target path is already taken:
+#   "skip"            leave the file where it is
+#   "overwrite"       replace the existing file
+#   "suffix"          use the first free name of the form "name (1).ext", "name (2).ext", ...
+#   "skip_identical"  skip if the existing file has the same size and contents, otherwise use a suffix
+CONFLICT_POLICIES = ("skip", "overwrite", "suffix", "skip_identical")
+
+class DestinationIndex:
+    """
+    The names in each folder a job writes to, so collisions are found without a stat per file.
+
+    Each folder is listed with one scandir the first time it is looked up, and the listing is then
+    kept up to date as the job's actions add and remove files. resolve() reserves the path it returns,
+    so two actions running at once can never pick the same name. The index assumes the job is the
+    only writer to these folders while it runs; jobs clear it when they start.
+    """
+    def __init__(self):
+        self.folders = {}   # Normalized folder path -> set of normalized names
+        self.lock = threading.RLock()
+
+    # Helper function to split a path into the keys the index uses. Names are compared as the
+    # platform compares them, so "A.txt" and "a.txt" collide on Windows.
+    @staticmethod
+    def get_key(path):
+        folder, name = os.path.split(os.path.normpath(path))
+        return os.path.normcase(folder), os.path.normcase(name)
+
+    # Helper function to return the names in a folder, listing it the first time
+    def get_names(self, folder):
+        names = self.folders.get(folder)
+        if names is None:
+            try:
+                with os.scandir(folder) as entries:
+                    names = {os.path.normcase(entry.name) for entry in entries}
+            except (PermissionError, FileNotFoundError) as e:
+                trace.warning("destination_index", f"Error accessing {folder} - {e}", path=folder)
+                names = set()
+            self.folders[folder] = names
+        return names
+
+    # Return True if a path is taken
+    def exists(self, path):
+        folder, name = DestinationIndex.get_key(path)
+        with self.lock:
+            return name in self.get_names(folder)
+
+    # Record that a file now exists at a path
+    def add(self, path):
+        folder, name = DestinationIndex.get_key(path)
+        with self.lock:
+            names = self.folders.get(folder)
+            if names is not None:
+                names.add(name)
+
+    # Record that a path is free again
+    def remove(self, path):
+        folder, name = DestinationIndex.get_key(path)
+        with self.lock:
+            names = self.folders.get(folder)
+            if names is not None:
+                names.discard(name)
+
+    # Helper function to return the first free path of the form "name (n).ext"
+    def get_free_path(self, path):
+        root, extension = os.path.splitext(path)
+        counter = 1
+        while True:
+            candidate = f"{root} ({counter}){extension}"
+            if not self.exists(candidate):
+                return candidate
+            counter += 1
+
+    # Helper function to check whether two files have the same size and contents
+    @staticmethod
+    def is_identical(path, other_path):
+        try:
+            if os.stat(path).st_size != os.stat(other_path).st_size:
+                return False
+            return hash_file(path) == hash_file(other_path)
+        except OSError:
+            return False
+
+    # Return the path an action moving or copying source to target should write to under a conflict policy,
+    # or None if the action should be skipped. The returned path is reserved; remove() it if the action fails.
+    def resolve(self, source, target, policy="skip"):
+        if policy not in CONFLICT_POLICIES:
+            raise ValueError(f"Invalid conflict policy {policy}, must be one of {', '.join(CONFLICT_POLICIES)}")
+        if DestinationIndex.get_key(source) == DestinationIndex.get_key(target):
+            # The file is already where the action would put it
+            return None
+
+        with self.lock:
+            if not self.exists(target):
+                self.add(target)
+                return target
+
+            if policy == "overwrite":
+                return target
+            if policy == "skip":
+                if trace.debug_enabled:
+                    trace.debug("destination_index", f"Skipping {source} - {target} already exists", path=source, target=target)
+                return None
+            if policy == "suffix":
+                return self.reserve_free_path(target)
+
+        # Hash both files without the lock, so other actions can resolve their targets in the meantime
+        identical = DestinationIndex.is_identical(source, target)
+
+        with self.lock:
+            # The target may have been removed while the files were compared
+            if not self.exists(target):
+                self.add(target)
+                return target
+            if identical:
+                if trace.debug_enabled:
+                    trace.debug("destination_index", f"Skipping {source} - identical to {target}", path=source, target=target)
+                return None
+            return self.reserve_free_path(target)
+
+    # Helper function to reserve and return the first free path of the form "name (n).ext"
+    def reserve_free_path(self, path):
+        with self.lock:
+            path = self.get_free_path(path)
+            self.add(path)
+            return path
+
+    # Forget every listing, e.g. at the start of a job
+    def clear(self):
+        with self.lock:
+            self.folders = {}
+
+    def __repr__(self):
+        return f"DestinationIndex(folders={len(self.folders)})"
+
+# Shared index used by actions; jobs clear it when they start
+shared_index = DestinationIndex()
+
+def get_index():
+    return shared_index
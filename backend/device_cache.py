@@ -0,0 +1,170 @@
+import os
+import errno
+import threading
+import backend.trace as trace
+import backend.copy_engine as copy_engine
+from backend.duplicates import hash_file
+
+# How a cross-device move checks the copy before the source is removed:
+#   "size"  the copy has the same size as the source
+#   "hash"  the copy has the same size and contents (BLAKE2b) as the source
+VERIFY_OPTIONS = ("size", "hash")
+
+class DeviceCache:
+    """
+    Caches the device (st_dev) of each folder, so a job can tell which moves are same-device renames
+    and which are cross-device copies without a stat per file.
+
+    Folders that cannot be stat'ed share the device -1, which is never treated as the same device
+    as anything, so moves involving them always take the safe copy path.
+    """
+    def __init__(self):
+        self.devices = {}   # Folder path -> st_dev
+        self.lock = threading.Lock()
+
+    # Return the device of a folder, caching it per folder
+    def get_device(self, folder_path):
+        device = self.devices.get(folder_path)
+        if device is None:
+            try:
+                device = os.stat(folder_path).st_dev
+            except OSError:
+                device = -1
+            with self.lock:
+                self.devices[folder_path] = device
+        return device
+
+    # Stat every folder up front, e.g. all source and destination folders of a job
+    def resolve(self, folder_paths):
+        for folder_path in folder_paths:
+            self.get_device(folder_path)
+
+    # Return the (source device, destination device) pair of moving a file into a folder
+    def get_device_pair(self, path, folder_path):
+        return self.get_device(os.path.dirname(path)), self.get_device(folder_path)
+
+    # Return True if a file can be moved into a folder with a rename
+    def is_same_device(self, path, folder_path):
+        source_device, destination_device = self.get_device_pair(path, folder_path)
+        return source_device == destination_device and source_device != -1
+
+    # Forget every cached device, e.g. at the start of a job in case a drive was remounted
+    def clear(self):
+        with self.lock:
+            self.devices = {}
+
+    def __repr__(self):
+        return f"DeviceCache(folders={len(self.devices)})"
+
+# Shared cache used by move actions; sorting jobs clear and resolve it before they run
+shared_cache = DeviceCache()
+
+def get_cache():
+    return shared_cache
+
+# Helper function to copy a file to another device, check the copy and only then remove the source.
+# The copy is checked before it is renamed into place, so a copy that fails or does not match never replaces a file
+# at destination, and the source is left untouched.
+def move_across(source, destination, verify="size"):
+    def check(copy_path):
+        if os.stat(copy_path).st_size != os.stat(source).st_size:
+            raise OSError(errno.EIO, f"Copy of {source} has the wrong size", destination)
+        if verify == "hash" and hash_file(source) != hash_file(copy_path):
+            raise OSError(errno.EIO, f"Copy of {source} does not match the source", destination)
+
+    method = copy_engine.copy_file(source, destination, preserve="metadata", check=check)
+    os.remove(source)
+    return method
+
+# Move a file to a destination path and return how it was moved: "rename" for a same-device move,
+# otherwise the copy mechanism used (see copy_engine). verify is one of VERIFY_OPTIONS. Set overwrite to
+# replace a file that already exists at destination on every platform.
+def move_file(source, destination, devices=None, verify="size", overwrite=False):
+    if verify not in VERIFY_OPTIONS:
+        raise ValueError(f"Invalid verify option {verify}, must be one of {', '.join(VERIFY_OPTIONS)}")
+
+    devices = devices or shared_cache
+    if devices.is_same_device(source, os.path.dirname(destination)):
+        try:
+            (os.replace if overwrite else os.rename)(source, destination)
+            return "rename"
+        except OSError as e:
+            # The cached device is out of date, e.g. a drive was mounted over the folder
+            if e.errno != errno.EXDEV:
+                raise
+            devices.clear()
+
+    method = move_across(source, destination, verify)
+    if trace.debug_enabled:
+        trace.debug("device_cache", f"Moved {source} to {destination} across devices using {method}", method=method)
+    return method
+
+class CrossDeviceQueue:
+    """
+    Holds back a job's moves to another device so they run after the same-device actions, grouped by
+    (source device, destination device), instead of interleaving fast renames with slow copies.
+
+    A held move that shares its source or target path with a later action is released just before
+    that action, so actions that touch the same path still run in the order they were matched.
+    """
+    def __init__(self, devices=None):
+        self.devices = devices or shared_cache
+        self.groups = {}    # (source device, destination device) -> {task id: (ruleset, rule, file)}
+        self.paths = {}     # Normalized path -> (device pair, task id) of the held move that touches it
+        self.next_id = 0
+
+    # Helper function to return the normalized paths an action reads and writes
+    @staticmethod
+    def get_paths(rule, file):
+        paths = {os.path.normpath(file.path)}
+        if rule.action.type != "recycle":
+            paths.add(os.path.normpath(rule.action.get_target_path(file)))
+        return paths
+
+    # Helper function to remove and return the held moves that touch any of the given paths, in matched order
+    def take_conflicts(self, paths):
+        found = {self.paths[path] for path in paths if path in self.paths}
+        tasks = []
+        for pair, task_id in sorted(found, key=lambda item: item[1]):
+            ruleset, rule, file = self.groups[pair].pop(task_id)
+            for path in CrossDeviceQueue.get_paths(rule, file):
+                self.paths.pop(path, None)
+            tasks.append((ruleset, rule, file))
+        return tasks
+
+    # Add a matched action and return the (ruleset, rule, file) tasks that should run now, in order.
+    # Moves to another device are held back and returned by drain().
+    def schedule(self, ruleset, rule, file):
+        paths = CrossDeviceQueue.get_paths(rule, file)
+        tasks = self.take_conflicts(paths)
+        action = rule.action
+        if tasks or action.type != "move" or action.final_folder is None or \
+                self.devices.is_same_device(file.path, action.final_folder):
+            tasks.append((ruleset, rule, file))
+            return tasks
+
+        pair = self.devices.get_device_pair(file.path, action.final_folder)
+        task_id = self.next_id
+        self.next_id += 1
+        self.groups.setdefault(pair, {})[task_id] = (ruleset, rule, file)
+        for path in paths:
+            self.paths[path] = (pair, task_id)
+        return tasks
+
+    # Return every held move, one device pair at a time, and empty the queue
+    def drain(self):
+        tasks = []
+        for pair, group in self.groups.items():
+            if group and trace.info_enabled:
+                trace.info("device_cache", f"Moving {len(group)} files from device {pair[0]} to device {pair[1]}",
+                           source_device=pair[0], destination_device=pair[1], files=len(group))
+            tasks.extend(group.values())
+        self.groups = {}
+        self.paths = {}
+        return tasks
+
+    def __len__(self):
+        return sum(len(group) for group in self.groups.values())
+
+    def __repr__(self):
+        return f"CrossDeviceQueue(held={len(self)}, device_pairs={len(self.groups)})"
@@ -0,0 +1,274 @@
+import os
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from backend.app_state import get_app_data_dir
+import backend.trace as trace
+
+# Size of the blocks read for a partial hash, and of each read for a full hash
+BLOCK_SIZE = 64 * 1024
+READ_SIZE = 1024 * 1024
+
+# Hash the contents of a file. A partial hash only reads the first and last block, which is enough
+# to tell most same-size files apart. Module-level so it can run in a worker process.
+def hash_file(path, full=True):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        if full:
+            for chunk in iter(lambda: f.read(READ_SIZE), b""):
+                digest.update(chunk)
+        else:
+            digest.update(f.read(BLOCK_SIZE))
+            if os.fstat(f.fileno()).st_size > 2 * BLOCK_SIZE:
+                f.seek(-BLOCK_SIZE, os.SEEK_END)
+                digest.update(f.read(BLOCK_SIZE))
+    return digest.hexdigest()
+
+# Helper function for the process pool: hash a (path, full) pair, returning None if the file cannot be read
+def hash_task(task):
+    path, full = task
+    try:
+        return hash_file(path, full)
+    except OSError:
+        return None
+
+class HashCache:
+    """
+    Persistent SQLite cache of file digests, keyed by path and hash kind ("partial" or "full").
+
+    A cached digest is only used if the file's size and mtime still match the ones it was
+    computed for, so repeated runs only hash files that changed.
+    """
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(get_app_data_dir(), "hash_cache.db")
+
+        self.db_path = db_path
+        # The cache is shared by the sorting job and the watcher thread
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (path, kind)
+            )
+        """)
+
+    # Return the cached digest for a file, or None if it is missing or out of date
+    def get(self, path, kind, size, mtime_ns):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT digest FROM hashes WHERE path = ? AND kind = ? AND size = ? AND mtime_ns = ?",
+                (path, kind, size, mtime_ns)
+            ).fetchone()
+        return row[0] if row else None
+
+    # Store (path, kind, size, mtime_ns, digest) rows in one transaction
+    def put_many(self, rows):
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)", rows)
+
+    def close(self):
+        self.connection.close()
+
+    def __repr__(self):
+        return f"HashCache(db_path='{self.db_path}')"
+
+class DuplicateFinder:
+    """
+    Finds files whose contents are identical to a file in a given folder.
+
+    Candidates are narrowed in stages so most files are never read: first by size, then by a
+    partial hash of their first and last block, and only then by a full hash. Hashes are computed
+    in a process pool when there are enough of them, and cached in memory and in a HashCache.
+    """
+    # Below this many files to hash, hashing in-process is faster than using worker processes
+    min_parallel = 4
+
+    def __init__(self, cache=None, workers=None):
+        self.cache = cache
+        self.workers = workers
+        self.executor = None
+        self.memory = {}    # (path, kind) -> (size, mtime_ns, digest)
+        self.folders = {}   # Folder path -> (folder mtime_ns, {size: [file paths]})
+        self.lock = threading.Lock()
+
+    # Helper function to group the files directly inside a folder by size. The grouping is reused
+    # until the folder's mtime changes, e.g. when a sorting job moves a file into it.
+    def get_size_buckets(self, folder_path):
+        try:
+            folder_mtime = os.stat(folder_path).st_mtime_ns
+        except (PermissionError, FileNotFoundError) as e:
+            trace.warning("duplicates", f"Error accessing {folder_path} - {e}", path=folder_path)
+            return {}
+
+        cached = self.folders.get(folder_path)
+        if cached is not None and cached[0] == folder_mtime:
+            return cached[1]
+
+        buckets = {}
+        try:
+            with os.scandir(folder_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            buckets.setdefault(entry.stat().st_size, []).append(os.path.normpath(entry.path))
+                    except (PermissionError, FileNotFoundError):
+                        continue
+        except (PermissionError, FileNotFoundError) as e:
+            trace.warning("duplicates", f"Error accessing {folder_path} - {e}", path=folder_path)
+
+        self.folders[folder_path] = (folder_mtime, buckets)
+        return buckets
+
+    # Helper function to run hash tasks, in worker processes if there are enough of them
+    def run_tasks(self, tasks):
+        if len(tasks) < self.min_parallel:
+            return [hash_task(task) for task in tasks]
+
+        if self.executor is None:
+            try:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            except (OSError, NotImplementedError) as e:
+                trace.warning("duplicates", f"Process pool unavailable, hashing in-process - {e}")
+                self.min_parallel = float("inf")
+                return [hash_task(task) for task in tasks]
+
+        return list(self.executor.map(hash_task, tasks, chunksize=16))
+
+    # Return {path: digest} for the given paths. kind is "partial" or "full".
+    # Files that cannot be read are left out.
+    def get_digests(self, paths, kind):
+        digests = {}
+        missing = []
+
+        for path in paths:
+            try:
+                file_stat = os.stat(path)
+            except (PermissionError, FileNotFoundError):
+                continue
+            key = (file_stat.st_size, file_stat.st_mtime_ns)
+
+            cached = self.memory.get((path, kind))
+            if cached is not None and cached[:2] == key:
+                digests[path] = cached[2]
+                continue
+
+            digest = self.cache.get(path, kind, *key) if self.cache else None
+            if digest is not None:
+                self.memory[(path, kind)] = (*key, digest)
+                digests[path] = digest
+            else:
+                missing.append((path, key))
+
+        if missing:
+            results = self.run_tasks([(path, kind == "full") for path, _ in missing])
+            rows = []
+            for (path, key), digest in zip(missing, results):
+                if digest is None:
+                    continue
+                self.memory[(path, kind)] = (*key, digest)
+                digests[path] = digest
+                rows.append((path, kind, *key, digest))
+            if self.cache and rows:
+                self.cache.put_many(rows)
+
+        return digests
+
+    # Return the set of paths of the given FileInfo objects that duplicate a file directly inside folder_path
+    def find_duplicates(self, files, folder_path):
+        with self.lock:
+            buckets = self.get_size_buckets(os.path.normpath(folder_path))
+            if not buckets:
+                return set()
+
+            # Stage 1: only files with the same size as a file in the folder can be duplicates
+            candidates = {}
+            for file in files:
+                path = os.path.normpath(file.path)
+                try:
+                    size = file.size
+                except (PermissionError, FileNotFoundError):
+                    continue
+                others = [other for other in buckets.get(size, ()) if other != path]
+                if others:
+                    candidates[path] = (size, others)
+            if not candidates:
+                return set()
+
+            # Stage 2: partial hashes of the candidates and the folder files they could match
+            paths = set(candidates)
+            for _, others in candidates.values():
+                paths.update(others)
+            partial = self.get_digests(sorted(paths), "partial")
+
+            needs_full = {}
+            duplicates = set()
+            for path, (size, others) in candidates.items():
+                if path not in partial:
+                    continue
+                matches = [other for other in others if partial.get(other) == partial[path]]
+                if not matches:
+                    continue
+                if size <= BLOCK_SIZE:
+                    # The partial hash already covered the whole file
+                    duplicates.add(path)
+                else:
+                    needs_full[path] = matches
+
+            # Stage 3: full hashes, only for files whose partial hash matched
+            if needs_full:
+                paths = set(needs_full)
+                for matches in needs_full.values():
+                    paths.update(matches)
+                full = self.get_digests(sorted(paths), "full")
+                for path, matches in needs_full.items():
+                    if path in full and any(full.get(other) == full[path] for other in matches):
+                        duplicates.add(path)
+
+            return duplicates
+
+    # Return True if the file has the same contents as a file directly inside folder_path
+    def is_duplicate(self, file, folder_path):
+        return os.path.normpath(file.path) in self.find_duplicates([file], folder_path)
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.cache is not None:
+            self.cache.close()
+
+    def __repr__(self):
+        return f"DuplicateFinder(folders={len(self.folders)}, cached_digests={len(self.memory)})"
+
+# Shared finder used by duplicate conditions, created on first use
+shared_finder = None
+shared_finder_lock = threading.Lock()
+
+def get_finder():
+    global shared_finder
+    with shared_finder_lock:
+        if shared_finder is None:
+            shared_finder = DuplicateFinder(HashCache())
+        return shared_finder
+
+# Hash the files of a job up front for every duplicate condition in the rulesets, so the hashing runs
+# in one batch across worker processes instead of one file at a time as conditions are checked
+def prefetch_duplicates(rulesets, files):
+    folders = []
+    for _, ruleset in rulesets.items():
+        for rule in ruleset.sorting_rules:
+            condition = rule.condition
+            if condition.type == "duplicate" and isinstance(condition.value, str) and condition.value not in folders:
+                folders.append(condition.value)
+
+    if folders:
+        finder = get_finder()
+        for folder_path in folders:
+            finder.find_duplicates(files, folder_path)
@@ -7,25 +7,25 @@ class FileInfo:
         self.name = name
         self.extension = extension
         self.path = path
-        self.size = size
-        self.dateCreated = dateCreated
-        self.dateModified = dateModified
+        self._size = size
+        self._dateCreated = dateCreated
+        self._dateModified = dateModified
+        self._entry = None
+        self._stat = None
 
     # Helper function to retrieve metadata for a file and return a dictionary
     @staticmethod
     def get_metadata(filePath):
         filename, fileextension = os.path.splitext(os.path.basename(filePath))
-        filesize = os.path.getsize(filePath)
-        fileDateModified = datetime.fromtimestamp(os.path.getmtime(filePath))
-        fileDateCreated = datetime.fromtimestamp(os.path.getctime(filePath))
+        file_stat = os.stat(filePath)
 
         return dict(
             path = filePath, 
             name = filename, 
             extension = fileextension, 
-            size = filesize, 
-            dateModified = fileDateModified, 
-            dateCreated = fileDateCreated
+            size = file_stat.st_size, 
+            dateModified = datetime.fromtimestamp(file_stat.st_mtime), 
+            dateCreated = datetime.fromtimestamp(file_stat.st_ctime)
         )
 
     # Construct a FileInfo object from the path of the file
@@ -40,6 +40,64 @@ class FileInfo:
             file_metadata["dateCreated"], 
             file_metadata["dateModified"]
         )
-    
+
+    # Construct a FileInfo object from an os.DirEntry without touching the disk.
+    # Size and dates are read from a single (cached) stat the first time they are needed.
+    @classmethod
+    def from_entry(cls, entry):
+        filename, fileextension = os.path.splitext(entry.name)
+        file = cls(filename, fileextension, entry.path, None, None, None)
+        file._entry = entry
+        return file
+
+    # Helper function to return the stat result of the file, calling stat at most once
+    def get_stat(self):
+        if self._stat is None:
+            if self._entry is not None:
+                self._stat = self._entry.stat()
+            else:
+                self._stat = os.stat(self.path)
+            self._entry = None
+        return self._stat
+
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = self.get_stat().st_size
+        return self._size
+
+    @size.setter
+    def size(self, value):
+        self._size = value
+
+    @property
+    def dateCreated(self):
+        if self._dateCreated is None:
+            self._dateCreated = datetime.fromtimestamp(self.get_stat().st_ctime)
+        return self._dateCreated
+
+    @dateCreated.setter
+    def dateCreated(self, value):
+        self._dateCreated = value
+
+    @property
+    def dateModified(self):
+        if self._dateModified is None:
+            self._dateModified = datetime.fromtimestamp(self.get_stat().st_mtime)
+        return self._dateModified
+
+    @dateModified.setter
+    def dateModified(self, value):
+        self._dateModified = value
+
+    # DirEntry objects cannot be copied or pickled, so resolve the stat before the file is
+    # deep-copied (e.g. by save_restore_point) or sent to another process
+    def __getstate__(self):
+        if self._entry is not None:
+            self.get_stat()
+        state = self.__dict__.copy()
+        state["_entry"] = None
+        return state
+
     def __repr__(self):
-        return f"FileInfo(name='{self.name}', size={self.size}B)"
\ No newline at end of file
+        return f"FileInfo(name='{self.name}', size={self.size}B)"
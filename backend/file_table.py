@@ -0,0 +1,181 @@
+import os
+from array import array
+from datetime import datetime
+from backend.file_info import FileInfo
+from backend.folder_info import FolderInfo
+
+class FileTable:
+    """
+    Columnar, array-backed representation of a directory scan.
+
+    Each file is one row across a set of parallel columns instead of a FileInfo object:
+    folder paths and extensions are interned into lookup tables, file names are packed into a
+    single UTF-8 buffer, and sizes and timestamps (in nanoseconds) are stored as int64 arrays.
+    Arrays pickle as raw bytes, so a table is cheap to pass between processes.
+    """
+    def __init__(self, root_path):
+        self.root_path = root_path
+
+        # Folder table: one row per scanned folder, with the index of its parent (-1 for the root)
+        self.folders = []
+        self.folder_parents = array("q")
+        self.folder_lookup = {}
+
+        # Extension table: every distinct extension is stored once
+        self.extensions = []
+        self.extension_lookup = {}
+
+        # File columns
+        self.name_data = bytearray()
+        self.name_offsets = array("q", [0])
+        self.folder_ids = array("q")
+        self.extension_ids = array("q")
+        self.sizes = array("q")
+        self.created_ns = array("q")
+        self.modified_ns = array("q")
+
+    def __len__(self):
+        return len(self.sizes)
+
+    # Add a folder to the folder table and return its index
+    def add_folder(self, path, parent=-1):
+        index = self.folder_lookup.get(path)
+        if index is None:
+            index = len(self.folders)
+            self.folders.append(path)
+            self.folder_parents.append(parent)
+            self.folder_lookup[path] = index
+        return index
+
+    # Helper function to intern an extension and return its index
+    def intern_extension(self, extension):
+        index = self.extension_lookup.get(extension)
+        if index is None:
+            index = len(self.extensions)
+            self.extensions.append(extension)
+            self.extension_lookup[extension] = index
+        return index
+
+    # Add a file row to the table
+    def add_file(self, folder_id, name, extension, size, created_ns, modified_ns):
+        self.name_data += name.encode("utf-8", "surrogateescape")
+        self.name_offsets.append(len(self.name_data))
+        self.folder_ids.append(folder_id)
+        self.extension_ids.append(self.intern_extension(extension))
+        self.sizes.append(size)
+        self.created_ns.append(created_ns)
+        self.modified_ns.append(modified_ns)
+
+    # Return the base name (without extension) of the file at the given row
+    def name(self, index):
+        start, end = self.name_offsets[index], self.name_offsets[index + 1]
+        return self.name_data[start:end].decode("utf-8", "surrogateescape")
+
+    # Return the extension of the file at the given row
+    def extension(self, index):
+        return self.extensions[self.extension_ids[index]]
+
+    # Return the full path of the file at the given row
+    def path(self, index):
+        return os.path.join(self.folders[self.folder_ids[index]], self.name(index) + self.extension(index))
+
+    # Build a FileInfo object for the file at the given row
+    def file_info(self, index):
+        name = self.name(index)
+        extension = self.extension(index)
+        return FileInfo(
+            name,
+            extension,
+            os.path.join(self.folders[self.folder_ids[index]], name + extension),
+            self.sizes[index],
+            datetime.fromtimestamp(self.created_ns[index] / 1e9),
+            datetime.fromtimestamp(self.modified_ns[index] / 1e9)
+        )
+
+    # Generator that yields a FileInfo object for each row, one at a time
+    def iter_files(self):
+        for index in range(len(self)):
+            yield self.file_info(index)
+
+    # Scan a directory straight into a table, without creating FolderInfo or FileInfo objects.
+    # max_depth and prune work as in FolderInfo.from_path.
+    @classmethod
+    def from_path(cls, folder_path, max_depth=None, prune=None):
+        table = cls(folder_path)
+
+        if not os.path.isdir(folder_path):
+            print(f"Folder not found or not a directory: {folder_path}")
+            return table
+
+        stack = [(folder_path, table.add_folder(folder_path), 0)]
+
+        while stack:
+            path, folder_id, depth = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subfolder_id = table.add_folder(entry.path, folder_id)
+                                if FolderInfo.within_depth(depth, max_depth) and (prune is None or not prune(entry.path)):
+                                    stack.append((entry.path, subfolder_id, depth + 1))
+                            elif entry.is_file():
+                                entry_stat = entry.stat()
+                                name, extension = os.path.splitext(entry.name)
+                                table.add_file(folder_id, name, extension, entry_stat.st_size,
+                                               entry_stat.st_ctime_ns, entry_stat.st_mtime_ns)
+                        except (PermissionError, FileNotFoundError) as e:
+                            print(f"Error accessing {entry.path} - {e}")
+            except (PermissionError, FileNotFoundError) as e:
+                print(f"Error accessing {path} - {e}")
+
+        return table
+
+    # Convert an existing FolderInfo tree into a table
+    @classmethod
+    def from_folder_info(cls, folder):
+        if not isinstance(folder, FolderInfo):
+            raise ValueError("FileTable.from_folder_info must take a FolderInfo object")
+
+        table = cls(folder.path)
+        stack = [(folder, -1)]
+
+        while stack:
+            current, parent = stack.pop()
+            folder_id = table.add_folder(current.path, parent)
+            for item in reversed(current.contents):
+                if isinstance(item, FolderInfo):
+                    stack.append((item, folder_id))
+            for item in current.contents:
+                if isinstance(item, FileInfo):
+                    table.add_file(folder_id, item.name, item.extension, item.size,
+                                   FileTable.to_ns(item.dateCreated), FileTable.to_ns(item.dateModified))
+
+        return table
+
+    # Convert the table back into a FolderInfo tree. Within each folder, subfolders come first,
+    # followed by files in table order.
+    def to_folder_info(self):
+        if not self.folders:
+            return FolderInfo(os.path.basename(self.root_path), [], True, self.root_path)
+
+        nodes = []
+        for index, path in enumerate(self.folders):
+            node = FolderInfo(os.path.basename(path), [], index == 0, path)
+            nodes.append(node)
+            parent = self.folder_parents[index]
+            if parent >= 0:
+                nodes[parent].contents.append(node)
+
+        for index in range(len(self)):
+            nodes[self.folder_ids[index]].contents.append(self.file_info(index))
+
+        return nodes[0]
+
+    # Helper function to convert a datetime into a nanosecond timestamp
+    @staticmethod
+    def to_ns(value):
+        return round(value.timestamp() * 1_000_000) * 1000
+
+    def __repr__(self):
+        return f"FileTable(root='{self.root_path}', files={len(self)}, folders={len(self.folders)})"
@@ -1,7 +1,12 @@
 import os
+import copy
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from backend.file_info import FileInfo
 
 class FolderInfo:
+    # Default number of worker threads used by from_path; 1 or less scans serially
+    scan_workers = min(32, (os.cpu_count() or 1) + 4)
+
     def __init__(self, name, contents, is_target, path, ruleset=None):
         self.name = name
         self.contents = contents
@@ -9,17 +14,98 @@ class FolderInfo:
         self.path = path
         self.ruleset = ruleset
 
-    # Create a FolderInfo object from a given path
+    # Create a FolderInfo object from a given path.
+    # max_depth=None scans the whole tree; prune(path) may return True to list a subfolder without descending into it.
     @classmethod
-    def from_path(cls, folder_path, is_target, ruleset=None, depth=0, max_depth=3):
+    def from_path(cls, folder_path, is_target, ruleset=None, depth=0, max_depth=None, workers=None, prune=None):
         folder_name = os.path.basename(folder_path)
         folder_ruleset = ruleset if ruleset is not None else None
-        contents = []
 
         # Check if the folder exists and is a directory
         if not os.path.exists(folder_path) or not os.path.isdir(folder_path):
             print(f"Folder not found or not a directory: {folder_path}")
-            return cls(folder_name, contents, is_target, folder_path, ruleset=folder_ruleset)
+            return cls(folder_name, [], is_target, folder_path, ruleset=folder_ruleset)
+
+        if workers is None:
+            workers = cls.scan_workers
+
+        if workers > 1:
+            return cls.from_path_parallel(folder_path, is_target, ruleset, depth, max_depth, workers, prune)
+
+        root = cls(folder_name, [], is_target, folder_path, ruleset=folder_ruleset)
+        stack = [(root, depth)]
+
+        # Walk the tree with an explicit stack so depth is not limited by the recursion limit
+        while stack:
+            folder, folder_depth = stack.pop()
+            folder.contents, subfolders = cls.scan_directory(folder.path, folder_ruleset)
+
+            # Push subfolders in reverse so they are scanned in order; pruned or too-deep folders are left empty
+            if cls.within_depth(folder_depth, max_depth):
+                for subfolder in reversed(subfolders):
+                    if prune is None or not prune(subfolder.path):
+                        stack.append((subfolder, folder_depth + 1))
+
+        return root
+
+    # Scan the subdirectories of a folder concurrently on a thread pool
+    @classmethod
+    def from_path_parallel(cls, folder_path, is_target, ruleset=None, depth=0, max_depth=None, workers=None, prune=None):
+        if workers is None:
+            workers = cls.scan_workers
+
+        root = cls(os.path.basename(folder_path), [], is_target, folder_path, ruleset=ruleset)
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {executor.submit(cls.scan_directory, folder_path, ruleset): (root, depth)}
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    folder, folder_depth = pending.pop(future)
+                    folder.contents, subfolders = future.result()
+
+                    # Queue subdirectories up to the maximum depth; pruned or too-deep folders are left empty
+                    if cls.within_depth(folder_depth, max_depth):
+                        for subfolder in subfolders:
+                            if prune is None or not prune(subfolder.path):
+                                next_future = executor.submit(cls.scan_directory, subfolder.path, ruleset)
+                                pending[next_future] = (subfolder, folder_depth + 1)
+
+        return root
+
+    # Generator that yields the FileInfo objects under a folder without building a FolderInfo tree.
+    # Each directory is listed fully before its files are yielded, then its subfolders are visited.
+    @classmethod
+    def iter_files(cls, folder_path, max_depth=None, prune=None):
+        stack = [(folder_path, 0)]
+
+        while stack:
+            path, depth = stack.pop()
+            contents, subfolders = cls.scan_directory(path)
+
+            # Push subfolders in reverse so they are visited in scan order
+            if cls.within_depth(depth, max_depth):
+                for subfolder in reversed(subfolders):
+                    if prune is None or not prune(subfolder.path):
+                        stack.append((subfolder.path, depth + 1))
+
+            for item in contents:
+                if isinstance(item, FileInfo):
+                    yield item
+
+    # Helper function to check whether the subfolders of a folder at the given depth should be scanned.
+    # A max_depth of None means there is no limit.
+    @staticmethod
+    def within_depth(depth, max_depth):
+        return max_depth is None or depth < max_depth - 1
+
+    # Helper function to list a single directory without descending into it.
+    # Returns the folder contents (files and empty subfolders, in scan order) and the list of subfolders.
+    @classmethod
+    def scan_directory(cls, folder_path, ruleset=None):
+        contents = []
+        subfolders = []
 
         try:
             with os.scandir(folder_path) as entries:
@@ -27,35 +113,52 @@ class FolderInfo:
                     try:
                         # Handle directories
                         if entry.is_dir(follow_symlinks=False):
-                            if depth < max_depth - 1:  # Allow scanning up to the maximum depth
-                                contents.append(cls.from_path(entry.path, False, ruleset, depth + 1, max_depth))
-                            else:
-                                # At max depth include the folder without scanning further
-                                contents.append(cls(os.path.basename(entry.path), [], False, entry.path, ruleset=folder_ruleset))
+                            subfolder = cls(os.path.basename(entry.path), [], False, entry.path, ruleset=ruleset)
+                            contents.append(subfolder)
+                            subfolders.append(subfolder)
                         # Handle files
                         elif entry.is_file():
-                            try:
-                                contents.append(FileInfo.from_path(entry.path))
-                            except FileNotFoundError as e:
-                                print(f"FileNotFoundError: Skipping {entry.path} - {e}")
+                            contents.append(FileInfo.from_entry(entry))
                     except (PermissionError, FileNotFoundError) as e:
                         print(f"Error accessing {entry.path} - {e}")
         except (PermissionError, FileNotFoundError) as e:
             print(f"Error accessing {folder_path} - {e}")
-            return cls(folder_name, contents, is_target, folder_path, ruleset=folder_ruleset)
 
-        return cls(folder_name, contents, is_target, folder_path, ruleset=folder_ruleset)
+        return contents, subfolders
+
+    # Deep-copy the tree iteratively, since the default deepcopy recurses once per folder level
+    def __deepcopy__(self, memo):
+        root = FolderInfo(self.name, [], self.is_target, self.path, ruleset=copy.deepcopy(self.ruleset, memo))
+        memo[id(self)] = root
+        stack = [(self, root)]
+
+        while stack:
+            folder, folder_copy = stack.pop()
+            for item in folder.contents:
+                if isinstance(item, FolderInfo):
+                    item_copy = FolderInfo(item.name, [], item.is_target, item.path, ruleset=copy.deepcopy(item.ruleset, memo))
+                    memo[id(item)] = item_copy
+                    stack.append((item, item_copy))
+                else:
+                    item_copy = copy.deepcopy(item, memo)
+                folder_copy.contents.append(item_copy)
+
+        return root
 
     # Returns a tree-structured string; useful for debugging
     def to_tree_string(self, level=0):
-        indent = '  ' * level
-        tree = f"{indent}- {self.name}/ (target={self.is_target})\n"
-        for item in self.contents:
+        lines = []
+        stack = [(self, level)]
+        while stack:
+            item, item_level = stack.pop()
+            indent = '  ' * item_level
             if isinstance(item, FolderInfo):
-                tree += item.to_tree_string(level + 1)
+                lines.append(f"{indent}- {item.name}/ (target={item.is_target})\n")
+                for child in reversed(item.contents):
+                    stack.append((child, item_level + 1))
             else:
-                tree += '  ' * (level + 1) + f"- {item.name} ({item.size}B)\n"
-        return tree
+                lines.append(f"{indent}- {item.name} ({item.size}B)\n")
+        return "".join(lines)
 
     def __repr__(self):
-        return f"FolderInfo(name='{self.name}', is_target={self.is_target}, items={len(self.contents)})"
\ No newline at end of file
+        return f"FolderInfo(name='{self.name}', is_target={self.is_target}, items={len(self.contents)})"
@@ -0,0 +1,117 @@
+import time
+import threading
+
+class ProgressEvent:
+    """
+    A snapshot of a sorting job's counters, passed to progress callbacks.
+
+    state is "running" while the job runs, then "finished", "cancelled" or "failed".
+    """
+    def __init__(self, state, scanned, matched, acted, bytes_moved, elapsed):
+        self.state = state
+        self.scanned = scanned
+        self.matched = matched
+        self.acted = acted
+        self.bytes_moved = bytes_moved
+        self.elapsed = elapsed
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "scanned": self.scanned,
+            "matched": self.matched,
+            "acted": self.acted,
+            "bytes_moved": self.bytes_moved,
+            "elapsed": self.elapsed
+        }
+
+    def __repr__(self):
+        return (f"ProgressEvent(state={self.state!r}, scanned={self.scanned}, matched={self.matched}, "
+                f"acted={self.acted}, bytes_moved={self.bytes_moved})")
+
+class JobProgress:
+    """
+    Counts the files a sorting job has scanned, matched and acted on, and the bytes it moved or copied.
+
+    The job updates the counters as it runs; they may be updated from executor threads, so they are
+    guarded by a lock. The callback receives a ProgressEvent at most every report_interval seconds,
+    and always once more when the job ends. Setting the cancel event asks the job to stop after the
+    action in progress; the actions already completed are still recorded for undo.
+    """
+    # Minimum time in seconds between two progress callbacks while the job runs
+    report_interval = 0.1
+
+    def __init__(self, callback=None, cancel=None):
+        self.callback = callback
+        self.cancel_event = cancel or threading.Event()
+        self.state = "running"
+        self.scanned = 0
+        self.matched = 0
+        self.acted = 0
+        self.bytes_moved = 0
+        self.start_time = time.monotonic()
+        self.last_report = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    # Ask the job to stop
+    def cancel(self):
+        self.cancel_event.set()
+
+    # Only count bytes if someone is listening, since it can cost a stat per file
+    @property
+    def counts_bytes(self):
+        return self.callback is not None
+
+    # Return the number of bytes an action will move or copy, for the bytes_moved counter
+    def get_action_bytes(self, action, file):
+        if not self.counts_bytes or action.type not in ("move", "copy"):
+            return 0
+        try:
+            return file.size
+        except OSError:
+            return 0
+
+    def add_scanned(self, count=1):
+        with self.lock:
+            self.scanned += count
+        self.report()
+
+    def add_matched(self, count=1):
+        with self.lock:
+            self.matched += count
+        self.report()
+
+    def add_acted(self, bytes_moved=0):
+        with self.lock:
+            self.acted += 1
+            self.bytes_moved += bytes_moved
+        self.report()
+
+    # Return the current counters as a ProgressEvent
+    def snapshot(self):
+        with self.lock:
+            return ProgressEvent(self.state, self.scanned, self.matched, self.acted, self.bytes_moved,
+                                 time.monotonic() - self.start_time)
+
+    # Pass a snapshot to the callback, at most every report_interval seconds unless forced
+    def report(self, force=False):
+        if self.callback is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_report < self.report_interval:
+            return
+        self.last_report = now
+        self.callback(self.snapshot())
+
+    # Set the final state ("finished", "cancelled" or "failed") and report it
+    def finish(self, state):
+        with self.lock:
+            self.state = state
+        self.report(force=True)
+
+    def __repr__(self):
+        return f"JobProgress(state={self.state!r}, scanned={self.scanned}, matched={self.matched}, acted={self.acted})"
@@ -0,0 +1,358 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+import backend.trace as trace
+import backend.rollback
+import backend.copy_engine as copy_engine
+from backend.app_state import get_app_data_dir
+from backend.file_info import FileInfo
+from backend.sorting_rule import SortingRule
+from backend.ruleset import Ruleset
+from backend.rollback import ActionRecord
+
+# Return the directory unfinished jobs' journals are kept in, creating it if needed
+def get_journal_dir():
+    path = os.path.join(get_app_data_dir(), "journals")
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+class ActionJournal:
+    """
+    An append-only record of a sorting job's actions, written ahead of the actions themselves, so a job
+    whose process dies can be resumed or rolled back the next time the app starts.
+
+    The journal is a JSON Lines file. Its header holds the job's target folder and rulesets, and
+    whether the job skipped their destination folders, so a recovered job can finish matching the
+    files it had not reached the way it started. Each action writes an "intent"
+    line before it runs and a "done" line with the file's new path after it has run. In between, an
+    action that writes a file writes a "target" line with the path its conflict policy picked, before
+    it writes there. The line also notes whether that path was already taken, so recovery can tell a
+    file the action wrote from one that was there before. Every line is handed to the OS as it is
+    written, so it survives the process dying, but lines are only fsynced in batches, every
+    sync_every lines or sync_interval seconds, so a power cut loses at most the last batch. An intent without its done line is resolved from the files on disk when the journal
+    is recovered (see RecoveredJob). A job that ends normally removes its journal once its undo batch
+    is recorded, so any journal left on disk belongs to a job that did not finish.
+    """
+    version = 1
+    # Lines written between two fsyncs at most
+    sync_every = 256
+    # Seconds between two fsyncs at most, while lines are being written
+    sync_interval = 1.0
+
+    def __init__(self, path, description="Sorting Job", target=None, rulesets=None, exclude_destinations=False):
+        self.path = path
+        self.description = description
+        self.file = open(path, "a", encoding="utf-8")
+        self.next_id = 0
+        self.rule_ids = {}      # id(rule) -> rule number in the journal
+        self.rules = []         # Rules written so far, kept alive so their ids stay unique
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.lock = threading.Lock()
+
+        self.file.write(json.dumps({
+            "event": "job",
+            "version": self.version,
+            "description": description,
+            "created": datetime.now().isoformat(),
+            "target": target,
+            "rulesets": {key: ruleset.to_dict() for key, ruleset in rulesets.items()} if rulesets is not None else None,
+            "exclude_destinations": exclude_destinations
+        }) + "\n")
+        self.sync()
+
+    # Start a journal for a new job in journal_dir, or in the app data directory
+    @classmethod
+    def create(cls, description="Sorting Job", journal_dir=None, target=None, rulesets=None, exclude_destinations=False):
+        journal_dir = journal_dir or get_journal_dir()
+        if not os.path.exists(journal_dir):
+            os.makedirs(journal_dir)
+        timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f")
+        return cls(os.path.join(journal_dir, f"journal_{timestamp}.jsonl"), description, target, rulesets,
+                   exclude_destinations)
+
+    # Helper function to write a line, fsyncing once enough lines or time have gone by. Caller holds the lock.
+    def write_line(self, data):
+        self.file.write(json.dumps(data) + "\n")
+        self.file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.sync_every or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    # Helper function to return the number of a rule, writing the rule the first time it is seen. Caller holds the lock.
+    def get_rule_id(self, ruleset, rule):
+        rule_id = self.rule_ids.get(id(rule))
+        if rule_id is None:
+            rule_id = len(self.rules)
+            self.rule_ids[id(rule)] = rule_id
+            self.rules.append(rule)
+            # Rulesets are identified by their folder path, as in the rulesets dictionary
+            self.write_line({"event": "rule", "id": rule_id, "ruleset": ruleset.folder.path, "rule": rule.to_dict()})
+        return rule_id
+
+    # Record that a matched rule's action is about to run on a file. Returns the entry's id for complete() and
+    # get_destination_callback(). The target is where the action would put the file without a conflict.
+    def intend(self, ruleset, rule, file):
+        with self.lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.write_line({
+                "event": "intent",
+                "id": entry_id,
+                "rule": self.get_rule_id(ruleset, rule),
+                "path": file.path,
+                "target": rule.action.get_target_path(file)
+            })
+        return entry_id
+
+    # Record the path an entry's action is about to write to, once its conflict policy has picked it
+    def write_target(self, entry_id, target, taken):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.write_line({"event": "target", "id": entry_id, "target": target, "taken": taken})
+
+    # Return the callback to run an entry's action under (see action.on_destination)
+    def get_destination_callback(self, entry_id):
+        return lambda target, taken: self.write_target(entry_id, target, taken)
+
+    # Record that an action has run, given the undo records it returned. No records means the file was skipped.
+    def complete(self, entry_id, records):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.write_line({"event": "done", "id": entry_id, "result": records[0].result_path if records else None})
+
+    # Write every buffered line to disk
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    # Sync and close the journal, leaving it on disk so the job can be recovered
+    def close(self):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.sync()
+            self.file.close()
+
+    # Close the journal and delete it, once the job's actions are recorded for undo
+    def remove(self):
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return f"ActionJournal(path={self.path!r}, entries={self.next_id})"
+
+class JournalEntry:
+    """
+    One action of a recovered job. result is the file's new path once the action is known to have run,
+    or None if it was skipped or has not run; done tells the two apart.
+    """
+    def __init__(self, entry_id, ruleset, rule, path, target, taken=None):
+        self.id = entry_id
+        self.ruleset = ruleset
+        self.rule = rule
+        self.path = path
+        self.target = target
+        self.taken = taken      # Whether the target existed before the action ran, or None if it had not picked one
+        self.done = False
+        self.result = None
+        self.partial = False    # A copy or move that was cut short and left a file at its target
+
+    def __repr__(self):
+        return f"JournalEntry(path={self.path!r}, action={self.rule.action.type!r}, done={self.done}, result={self.result!r})"
+
+class RecoveredJob:
+    """
+    A job read back from the journal it left behind. Its entries are split into the actions that ran,
+    which can be recorded for undo with get_records(), and the pending ones, which can be run again
+    (see sort_plan.resume_job) or dropped. target and rulesets are those of the job, or None for a
+    job that ran a plan. exclude_destinations tells whether the job skipped the rulesets' destination
+    folders, as a Sort does, so a resumed job scans the same folders.
+    """
+    def __init__(self, path, description="Sorting Job", created=None, entries=None, target=None, rulesets=None,
+                 exclude_destinations=False):
+        self.path = path
+        self.description = description
+        self.created = created
+        self.entries = list(entries or [])
+        self.target = target
+        self.rulesets = rulesets
+        self.exclude_destinations = exclude_destinations
+        self.resolve()
+
+    # Read a journal. A line cut short by the process dying mid-write is ignored.
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.read().split("\n")
+
+        header = None
+        rules = {}
+        entries = {}
+        for number, line in enumerate(lines):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                if number >= len(lines) - 2:
+                    trace.warning("journal", f"Ignoring a partly written line at the end of {path}", path=path)
+                    break
+                raise ValueError(f"Journal {path} is corrupt at line {number + 1}")
+
+            event = data.get("event")
+            if event == "job":
+                if data.get("version") != ActionJournal.version:
+                    raise ValueError(f"Unsupported journal version: {data.get('version')}")
+                header = data
+            elif event == "rule":
+                rules[data["id"]] = (data["ruleset"], SortingRule.from_dict(data["rule"], check_folder=False))
+            elif event == "intent":
+                ruleset, rule = rules[data["rule"]]
+                entries[data["id"]] = JournalEntry(data["id"], ruleset, rule, data["path"], data["target"])
+            elif event == "target" and data["id"] in entries:
+                entries[data["id"]].target = data["target"]
+                entries[data["id"]].taken = data["taken"]
+            elif event == "done" and data["id"] in entries:
+                entries[data["id"]].done = True
+                entries[data["id"]].result = data["result"]
+
+        if header is None:
+            raise ValueError(f"Journal {path} has no header")
+        rulesets = header.get("rulesets")
+        if rulesets is not None:
+            rulesets = {key: Ruleset.from_dict(data, check_folder=False) for key, data in rulesets.items()}
+        return cls(path, header.get("description", "Sorting Job"), datetime.fromisoformat(header["created"]),
+                   entries.values(), header.get("target"), rulesets, header.get("exclude_destinations", False))
+
+    # Helper function to work out from the disk whether an action without a done line ran. Only a target that the
+    # action picked, and that was free before, can have been written by it. Moves and renames ran if the source is
+    # gone and the target exists. A copy ran if its target exists with the source's size; a smaller one was cut
+    # short. A move whose source and target both exist was cut short between copying to another device and removing
+    # the source, so its target is removed like an unfinished copy and the move runs again.
+    def resolve(self):
+        for entry in self.entries:
+            if entry.done:
+                continue
+            action_type = entry.rule.action.type
+            written = entry.taken is False and os.path.exists(entry.target)
+            if os.path.exists(entry.path):
+                if action_type == "move" and written:
+                    entry.partial = True
+                elif action_type == "copy" and written:
+                    try:
+                        entry.partial = os.stat(entry.target).st_size != os.stat(entry.path).st_size
+                    except OSError:
+                        continue
+                    if not entry.partial:
+                        entry.done = True
+                        entry.result = entry.target
+                continue
+            if action_type == "recycle":
+                entry.done = True
+            elif action_type in ("move", "rename") and written:
+                entry.done = True
+                entry.result = entry.target
+            else:
+                trace.warning("journal", f"Cannot tell whether {entry.path} was acted on - it is missing", path=entry.path)
+                entry.done = True
+
+    # Delete the files left by copies and moves that were cut short, so running them again or undoing the job
+    # leaves nothing behind. That includes the temporary file of a copy that had not been renamed into place.
+    def remove_partial(self):
+        for entry in self.entries:
+            if not entry.done and entry.taken is not None and entry.rule.action.type in ("copy", "move"):
+                try:
+                    os.remove(copy_engine.get_temp_path(entry.target))
+                except FileNotFoundError:
+                    pass
+            if not entry.partial:
+                continue
+            try:
+                os.remove(entry.target)
+            except FileNotFoundError:
+                pass
+            entry.partial = False
+
+    # Return the entries whose action ran and can be undone, in the order they ran
+    def get_completed(self):
+        return [entry for entry in self.entries if entry.done and entry.result is not None]
+
+    # Return the entries whose action has not run
+    def get_pending(self):
+        return [entry for entry in self.entries if not entry.done]
+
+    # Return undo records for the actions that ran, as the job would have recorded them
+    def get_records(self):
+        records = []
+        for entry in self.get_completed():
+            action = entry.rule.action
+            if action.type == "recycle":
+                continue
+            name, extension = os.path.splitext(os.path.basename(entry.path))
+            try:
+                reverse_action = action.get_reverse_action(FileInfo(name, extension, entry.path, None, None, None))
+            except (TypeError, ValueError) as e:
+                trace.warning("journal", f"Cannot undo {entry.path} - {e}", path=entry.path)
+                continue
+            if action.type == "move" and os.path.basename(entry.result) != os.path.basename(entry.path):
+                # As in Ruleset.apply_rule, undo restores a name the conflict policy changed
+                reverse_action.new_name = os.path.basename(entry.path)
+
+            file = FileInfo(name, extension, entry.result, None, None, None)
+            file.name = os.path.basename(entry.result)
+            records.append(ActionRecord(forward_action=action, reverse_action=reverse_action, file=file,
+                                        result_path=entry.result))
+        return records
+
+    # Record the completed actions as an undo batch without undoing them, then delete the journal
+    def keep(self):
+        records = self.get_records()
+        if records:
+            backend.rollback.record_batch(records, self.description)
+        self.discard()
+
+    # Undo the completed actions, then delete the journal
+    def roll_back(self):
+        self.remove_partial()
+        records = self.get_records()
+        trace.info("journal", f"Rolling back {len(records)} actions of {self.description}", actions=len(records))
+        if records:
+            backend.rollback.record_batch(records, self.description)
+            backend.rollback.undo_last()
+        self.discard()
+
+    # Delete the journal
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __repr__(self):
+        return (f"RecoveredJob(description={self.description!r}, completed={len(self.get_completed())}, "
+                f"pending={len(self.get_pending())})")
+
+# Return the jobs that left a journal behind, oldest first. Unreadable journals are reported and skipped.
+def find_unfinished(journal_dir=None):
+    journal_dir = journal_dir or get_journal_dir()
+    jobs = []
+    for name in sorted(os.listdir(journal_dir)):
+        if not (name.startswith("journal_") and name.endswith(".jsonl")):
+            continue
+        path = os.path.join(journal_dir, name)
+        try:
+            jobs.append(RecoveredJob.load(path))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            trace.warning("journal", f"Ignoring unreadable journal {path} - {e}", path=path)
+    return jobs
@@ -0,0 +1,295 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+from datetime import datetime
+import backend.trace as trace
+
+# How log entries are written:
+#   "text"   one "[time] TYPE | From: old -> To: new" line per action
+#   "jsonl"  one JSON object per action, with the keys time, action, from and to
+LOG_FORMATS = ("text", "jsonl")
+
+# How durable a written entry is:
+#   "buffered"  batches are written to the file's buffer, which is flushed when it fills up or the log is closed
+#   "flush"     each batch is flushed to the OS once written, so the process dying loses at most one batch
+#   "fsync"     each batch is also fsynced, so a power cut loses at most one batch
+DURABILITY_LEVELS = ("buffered", "flush", "fsync")
+
+LOG_PREFIX = "sorting_log_"
+LOG_EXTENSIONS = {"text": ".txt", "jsonl": ".jsonl"}
+
+# Mark asking the writer thread to stop once everything before it is written
+STOP = object()
+
+# Encoding of the log files. Characters it cannot encode, such as the surrogate escapes of an undecodable file name,
+# are written as backslash escapes.
+LOG_ENCODING = "utf-8"
+LOG_ERRORS = "backslashreplace"
+
+class LogWriter:
+    """
+    Writes a job's action log on a background thread, so actions never wait on the log file.
+
+    log() only appends the entry to a bounded queue, without taking a lock or waking the writer.
+    Every flush_interval seconds the writer thread takes every entry waiting, formats them and
+    writes them in one call, then flushes or fsyncs the batch as the durability level asks. If the
+    queue is full, log() waits, so a slow disk slows the job down instead of growing memory.
+    Timestamps are formatted once per second rather than once per entry.
+
+    The log is a series of files named sorting_log_<start time> in log_dir. A new file is started
+    once the current one is larger than max_bytes or older than max_age seconds, and only the newest
+    `backups` files are kept, if set. Each writer has a file of its own: a file another open writer
+    is using, e.g. the watcher's while a job runs, is never appended to or removed. close() writes
+    every queued entry before it returns.
+    """
+    # Paths of the files open writers are using, so two writers never share one
+    open_paths = set()
+    open_paths_lock = threading.Lock()
+
+    # Formats and durability used by create_log_file, which sorting jobs and the watcher log with
+    default_format = "text"
+    default_durability = "flush"
+    # Start a new log file past this many bytes or seconds; None never does
+    default_max_bytes = 10 * 1024 * 1024
+    default_max_age = 24 * 60 * 60
+    # Entries that can wait to be written before log() blocks
+    queue_size = 10000
+    # Seconds the writer thread waits between two batches
+    flush_interval = 0.05
+
+    def __init__(self, log_dir, format=None, durability=None, max_bytes=None, max_age=None, backups=None):
+        self.format = format or LogWriter.default_format
+        self.durability = durability or LogWriter.default_durability
+        if self.format not in LOG_FORMATS:
+            raise ValueError(f"Invalid log format {self.format}, must be one of {', '.join(LOG_FORMATS)}")
+        if self.durability not in DURABILITY_LEVELS:
+            raise ValueError(f"Invalid durability {self.durability}, must be one of {', '.join(DURABILITY_LEVELS)}")
+
+        self.log_dir = log_dir
+        self.max_bytes = max_bytes if max_bytes is not None else LogWriter.default_max_bytes
+        self.max_age = max_age if max_age is not None else LogWriter.default_max_age
+        self.backups = backups
+        self.extension = LOG_EXTENSIONS[self.format]
+
+        self.pending = deque()              # Entries and marks waiting for the writer thread
+        self.wakeup = threading.Event()     # Set to make the writer thread start a batch now
+        self.space = threading.Event()      # Set by the writer thread each time it empties the queue
+        self.file = None
+        self.path = None
+        self.size = 0
+        self.started = 0.0
+        self.last_second = None
+        self.last_timestamp = None
+        self.error = None
+        self.closed = False
+
+        if not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        self.open_file()
+        self.thread = threading.Thread(target=self.run, name="LogWriter", daemon=True)
+        self.thread.start()
+
+    # Queue an entry for an action that took a file from old_path to new_path. Safe to call from any thread.
+    def log(self, action_type, old_path, new_path):
+        if self.closed:
+            raise ValueError("Log writer is closed")
+        while len(self.pending) >= LogWriter.queue_size:
+            self.check_thread()
+            self.space.clear()
+            self.wakeup.set()
+            self.space.wait(self.flush_interval)
+        self.pending.append((time.time(), action_type, old_path, new_path))
+
+    # Wait until every queued entry is written and flushed to the OS
+    def flush(self):
+        if self.closed:
+            return
+        done = threading.Event()
+        self.pending.append(done)
+        self.wakeup.set()
+        while not done.wait(self.flush_interval):
+            self.check_thread()
+
+    # Write every queued entry, then close the file. Safe to call more than once.
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.pending.append(STOP)
+        self.wakeup.set()
+        self.thread.join()
+
+    # Helper function to raise the error that stopped the writer thread, so callers never wait on a thread that is gone
+    def check_thread(self):
+        if not self.thread.is_alive():
+            raise self.error or RuntimeError("Log writer thread has stopped")
+
+    # Helper function to return the paths of the log files in log_dir, oldest first
+    def get_log_files(self):
+        names = [name for name in os.listdir(self.log_dir) if name.startswith(LOG_PREFIX) and name.endswith(self.extension)]
+        # The start time in each name sorts in the order the files were started
+        return [os.path.join(self.log_dir, name) for name in sorted(names)]
+
+    # Helper function to return the time a log file was started, from its name
+    def get_start_time(self, path):
+        name = os.path.basename(path)[len(LOG_PREFIX):-len(self.extension)]
+        for name_format in ("%Y-%m-%d_%H-%M-%S", "%Y-%m-%d_%H-%M-%S_%f"):
+            try:
+                return datetime.strptime(name, name_format).timestamp()
+            except ValueError:
+                pass
+        return 0.0
+
+    # Helper function to check whether the current file is full or too old
+    def needs_rotation(self, size, started):
+        if self.max_bytes is not None and size >= self.max_bytes:
+            return True
+        return self.max_age is not None and time.time() - started >= self.max_age
+
+    # Helper function to claim a file for this writer, releasing the one it had. Returns False if another writer has it.
+    def claim_path(self, path):
+        key = os.path.normcase(os.path.abspath(path))
+        with LogWriter.open_paths_lock:
+            if key in LogWriter.open_paths:
+                return False
+            LogWriter.open_paths.add(key)
+        self.release_path()
+        return True
+
+    # Helper function to release the file this writer has claimed
+    def release_path(self):
+        if self.path is None:
+            return
+        with LogWriter.open_paths_lock:
+            LogWriter.open_paths.discard(os.path.normcase(os.path.abspath(self.path)))
+
+    # Helper function to check whether another open writer is using a file
+    @staticmethod
+    def in_use(path):
+        with LogWriter.open_paths_lock:
+            return os.path.normcase(os.path.abspath(path)) in LogWriter.open_paths
+
+    # Helper function to open the newest log file, or start a new one if it is full, too old or used by another writer
+    def open_file(self):
+        files = self.get_log_files()
+        if files:
+            path = files[-1]
+            size = os.path.getsize(path)
+            started = self.get_start_time(path)
+            if not self.needs_rotation(size, started) and self.claim_path(path):
+                self.file = open(path, "a", encoding=LOG_ENCODING, errors=LOG_ERRORS)
+                self.path, self.size, self.started = path, size, started
+                return
+        self.start_file()
+
+    # Helper function to close the current file and start a new one, removing old files past the backup count
+    def start_file(self):
+        if self.file is not None:
+            self.file.close()
+
+        now = datetime.now()
+        path = os.path.join(self.log_dir, f"{LOG_PREFIX}{now:%Y-%m-%d_%H-%M-%S}{self.extension}")
+        if path == self.path or os.path.exists(path) or not self.claim_path(path):
+            # A file was already started this second; the microseconds keep the names in start order
+            path = os.path.join(self.log_dir, f"{LOG_PREFIX}{now:%Y-%m-%d_%H-%M-%S_%f}{self.extension}")
+            self.claim_path(path)
+        self.file = open(path, "a", encoding=LOG_ENCODING, errors=LOG_ERRORS)
+        self.path, self.size, self.started = path, os.path.getsize(path), now.timestamp()
+
+        if self.backups is not None:
+            for old_path in self.get_log_files()[:-(self.backups + 1)]:
+                if LogWriter.in_use(old_path):
+                    continue
+                try:
+                    os.remove(old_path)
+                except OSError as e:
+                    trace.warning("log_writer", f"Could not remove old log {old_path} - {e}", path=old_path)
+
+    # Helper function to format an entry's time, reusing the last result within the same second
+    def get_timestamp(self, entry_time):
+        second = int(entry_time)
+        if second != self.last_second:
+            self.last_second = second
+            self.last_timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(second))
+        return self.last_timestamp
+
+    # Helper function to format one entry as a line of the log
+    def format_entry(self, entry):
+        entry_time, action_type, old_path, new_path = entry
+        timestamp = self.get_timestamp(entry_time)
+        if self.format == "jsonl":
+            return json.dumps({"time": timestamp, "action": action_type, "from": old_path, "to": new_path}) + "\n"
+        return f"[{timestamp}] {action_type.upper()} | From: {old_path} -> To: {new_path}\n"
+
+    # Helper function to write a batch of entries and make them as durable as the durability level asks
+    def write_batch(self, entries, flush=False):
+        if entries:
+            text = "".join(self.format_entry(entry) for entry in entries)
+            self.file.write(text)
+            # max_bytes is in bytes, and a non-ASCII path takes more than one byte per character
+            self.size += len(text.encode(LOG_ENCODING, LOG_ERRORS))
+        if flush or self.durability != "buffered":
+            self.file.flush()
+        if self.durability == "fsync" and entries:
+            os.fsync(self.file.fileno())
+        if entries and self.needs_rotation(self.size, self.started):
+            self.start_file()
+
+    # Helper function to write a batch, reporting the first failure instead of stopping the writer thread
+    def try_write_batch(self, entries, flush=False):
+        try:
+            self.write_batch(entries, flush)
+        except Exception as e:
+            if self.error is None:
+                trace.error("log_writer", f"Could not write to {self.path} - {e}", path=self.path)
+            self.error = e
+
+    # Body of the writer thread. An error that escapes the loop is kept in self.error, where log() and flush() find it.
+    def run(self):
+        try:
+            self.write_loop()
+        except Exception as e:
+            trace.error("log_writer", f"Log writer for {self.path} stopped - {e}", path=self.path)
+            self.error = e
+        finally:
+            try:
+                self.file.close()
+            except Exception as e:
+                trace.error("log_writer", f"Could not close {self.path} - {e}", path=self.path)
+                self.error = self.error or e
+            self.release_path()
+
+    # Main loop of the writer thread: every flush_interval, or when woken, write every waiting entry as one batch.
+    # A flush request (an Event) is set once the entries queued before it are flushed.
+    def write_loop(self):
+        stopping = False
+        while not stopping:
+            self.wakeup.wait(self.flush_interval)
+            self.wakeup.clear()
+
+            entries = []
+            while self.pending:
+                item = self.pending.popleft()
+                if isinstance(item, tuple):
+                    entries.append(item)
+                    continue
+                self.try_write_batch(entries, flush=True)
+                entries = []
+                if item is STOP:
+                    stopping = True
+                    break
+                item.set()
+            self.space.set()
+            if entries:
+                self.try_write_batch(entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __repr__(self):
+        return f"LogWriter(path={self.path!r}, format={self.format!r}, durability={self.durability!r})"
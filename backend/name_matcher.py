@@ -0,0 +1,94 @@
+from collections import deque
+
+class NameMatcher:
+    """
+    Aho-Corasick automaton that finds every registered substring pattern in a name in one pass.
+
+    Each `includes`/`excludes` name condition would otherwise lowercase the name and search it on
+    its own, so a file is scanned once per condition. Patterns are registered with add(), which
+    returns a pattern id; scan() walks the lowercased name through the automaton once and returns
+    a bitmask with bit `id` set for every pattern the name contains. The result for the last name
+    is memoized, so all the conditions checked for one file share a single scan.
+    """
+    # Below this many distinct patterns, separate substring searches are faster than the automaton
+    min_patterns = 8
+
+    def __init__(self):
+        self.pattern_ids = {}   # Lowercased pattern -> pattern id
+        self.transitions = []   # Per state: character -> next state
+        self.outputs = []       # Per state: bitmask of the patterns that end at this state
+        self.built = False
+        self.last_name = None
+        self.last_mask = 0
+
+    def __len__(self):
+        return len(self.pattern_ids)
+
+    # Register a pattern and return its id. Patterns are case-insensitive; duplicates share an id.
+    def add(self, pattern):
+        pattern = pattern.lower()
+        pattern_id = self.pattern_ids.get(pattern)
+        if pattern_id is None:
+            pattern_id = len(self.pattern_ids)
+            self.pattern_ids[pattern] = pattern_id
+            self.built = False
+        return pattern_id
+
+    # Helper function to build the trie and its failure links from the registered patterns
+    def build(self):
+        self.transitions = [{}]
+        self.outputs = [0]
+
+        for pattern, pattern_id in self.pattern_ids.items():
+            state = 0
+            for char in pattern:
+                next_state = self.transitions[state].get(char)
+                if next_state is None:
+                    next_state = len(self.transitions)
+                    self.transitions[state][char] = next_state
+                    self.transitions.append({})
+                    self.outputs.append(0)
+                state = next_state
+            self.outputs[state] |= 1 << pattern_id
+
+        # Breadth-first pass: point each state at the longest proper suffix that is also in the trie,
+        # and fill in the missing transitions so scanning never has to follow failure links
+        queue = deque((state, 0) for state in self.transitions[0].values())
+
+        while queue:
+            state, failure = queue.popleft()
+            self.outputs[state] |= self.outputs[failure]
+            for char, next_state in self.transitions[state].items():
+                queue.append((next_state, self.transitions[failure].get(char, 0)))
+            for char, next_state in self.transitions[failure].items():
+                self.transitions[state].setdefault(char, next_state)
+
+        self.built = True
+        self.last_name = None
+
+    # Return a bitmask of the ids of every pattern that occurs in the name
+    def scan(self, name):
+        if name is self.last_name or name == self.last_name:
+            return self.last_mask
+        if not self.built:
+            self.build()
+
+        transitions = self.transitions
+        outputs = self.outputs
+        state = 0
+        mask = outputs[0]
+        for char in name.lower():
+            state = transitions[state].get(char, 0)
+            mask |= outputs[state]
+
+        self.last_name = name
+        self.last_mask = mask
+        return mask
+
+    # Return the set of patterns that occur in the name
+    def find(self, name):
+        mask = self.scan(name)
+        return {pattern for pattern, pattern_id in self.pattern_ids.items() if mask >> pattern_id & 1}
+
+    def __repr__(self):
+        return f"NameMatcher(patterns={len(self.pattern_ids)}, states={len(self.transitions)})"
@@ -0,0 +1,100 @@
+import os
+import send2trash
+import backend.trace as trace
+from backend.device_cache import get_cache
+from backend.destination_index import get_index
+
+class RecycleBatch:
+    """
+    Collects the files a job recycles and sends them to the trash in chunks instead of one call per file.
+
+    send2trash accepts a list of paths, which on Windows becomes a single shell file operation per
+    chunk. Files are grouped by device before they are chunked, since each volume has its own trash
+    directory. If a chunk fails part way, the files in it that still exist are recycled one at a time,
+    so one bad file does not stop the rest; files that still fail are reported and kept in self.errors.
+    """
+    def __init__(self, chunk_size=500, logger=None, progress=None, devices=None):
+        self.chunk_size = chunk_size
+        self.logger = logger
+        self.progress = progress        # Optional JobProgress; each recycled file counts as one action
+        self.devices = devices or get_cache()
+        self.pending = {}               # st_dev -> {normalized path: (action, file)}
+        self.count = 0
+        self.recycled = 0
+        self.errors = []                # (path, exception) pairs of files that could not be recycled
+
+    # Return True if a path is waiting to be recycled, so an action that targets it can flush the batch first
+    def contains(self, path):
+        path = os.path.normpath(path)
+        return any(path in group for group in self.pending.values())
+
+    # Queue a file for recycling. Sends a chunk to the trash once enough files are queued.
+    def add(self, action, file):
+        if not os.path.exists(file.path):
+            trace.warning("recycle_batch", f"Skipping {file.path} - File not found", path=file.path)
+            return
+
+        path = os.path.normpath(file.path)
+        device = self.devices.get_device(os.path.dirname(path))
+        self.pending.setdefault(device, {})[path] = (action, file)
+        self.count += 1
+        if self.count >= self.chunk_size:
+            self.flush()
+
+    # Helper function to log and count the files of a chunk once they are in the trash
+    def finish_files(self, entries):
+        for action, file in entries:
+            get_index().remove(file.path)
+            if self.logger is not None:
+                action.log_action(file, self.logger)
+            file.path = action.get_target_path(file)
+            file.name = os.path.basename(file.path)
+            if self.progress is not None:
+                self.progress.add_acted()
+        self.recycled += len(entries)
+
+    # Helper function to recycle one chunk, falling back to one file at a time if the chunk fails
+    def send_chunk(self, chunk):
+        try:
+            send2trash.send2trash(list(chunk))
+            self.finish_files(chunk.values())
+            return
+        except OSError as e:
+            trace.warning("recycle_batch", f"Recycling {len(chunk)} files at once failed, retrying one at a time - {e}")
+
+        for path, entry in chunk.items():
+            if not os.path.exists(path):
+                # Already recycled before the chunk failed
+                self.finish_files([entry])
+                continue
+            try:
+                send2trash.send2trash(path)
+                self.finish_files([entry])
+            except OSError as e:
+                trace.error("recycle_batch", f"Failed to recycle {path} - {e}", path=path)
+                self.errors.append((path, e))
+
+    # Send every queued file to the trash, one device and one chunk at a time
+    def flush(self):
+        pending = self.pending
+        self.pending = {}
+        self.count = 0
+
+        for device, group in pending.items():
+            paths = list(group)
+            for start in range(0, len(paths), self.chunk_size):
+                chunk = {path: group[path] for path in paths[start:start + self.chunk_size]}
+                if trace.debug_enabled:
+                    trace.debug("recycle_batch", f"Recycling {len(chunk)} files on device {device}", device=device, files=len(chunk))
+                self.send_chunk(chunk)
+
+    # Drop the queued files without recycling them, e.g. when a job is cancelled
+    def discard(self):
+        self.pending = {}
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __repr__(self):
+        return f"RecycleBatch(pending={self.count}, recycled={self.recycled}, errors={len(self.errors)})"
@@ -3,6 +3,7 @@ import os
 from dataclasses import dataclass
 from typing import List, Optional
 from backend.action import Action
+from backend.destination_index import get_index
 from backend.folder_info import FolderInfo
 from backend.file_info import FileInfo
 from datetime import datetime
@@ -43,6 +44,7 @@ def undo_last():
 
     batch = undo_stack.pop()
     print(f"Undoing: {batch.description}")
+    get_index().clear()
 
     for record in reversed(batch.actions):
         try:
@@ -92,6 +94,7 @@ def rollback_to_restore_point():
         return
 
     print(f"Rolling back to restore point at folder: {folder_restore_point.path}")
+    get_index().clear()
 
     def restore_file(snapshot_file: FileInfo):
         # Check if the file already exists in the expected (snapshot) location.
@@ -118,11 +121,13 @@ def rollback_to_restore_point():
         else:
             print(f"Could not locate file {snapshot_file.name} for rollback.")
 
-    def restore_folder(folder: FolderInfo):
-        for item in folder.contents:
+    # Walk the snapshot with an explicit stack so restore points of any depth can be restored
+    stack = [folder_restore_point]
+    while stack:
+        folder = stack.pop()
+        for item in reversed(folder.contents):
             if isinstance(item, FolderInfo):
-                restore_folder(item)
-            else:
+                stack.append(item)
+        for item in folder.contents:
+            if isinstance(item, FileInfo):
                 restore_file(item)
-
-    restore_folder(folder_restore_point)
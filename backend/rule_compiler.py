@@ -0,0 +1,172 @@
+"""
+Compiles Conditions and Rulesets into plain Python callables.
+
+Condition.check looks up the check function, verifies the file and the value type, and lowercases
+both operands on every call. A compiled condition does all of that once, up front, and is left
+with a single comparison per file. Compiled matchers give the same results as the interpreter
+(Condition.check / Ruleset.run_rules); invalid conditions raise the same ValueError, but when the
+ruleset is compiled instead of when the condition is first evaluated.
+"""
+import operator
+from datetime import datetime
+from backend.condition import Condition
+from backend.duplicates import get_finder
+
+# Attribute each condition type reads from a FileInfo
+FIELDS = {
+    "name": "name",
+    "extension": "extension",
+    "path": "path",
+    "size": "size",
+    "dateCreated": "dateCreated",
+    "dateModified": "dateModified"
+}
+
+# Helper function to validate a condition and return its value in the form the comparison uses:
+# the compiled pattern for regex/glob conditions, lowercased for other string conditions, float for size conditions
+def normalize_value(condition):
+    if condition.type not in FIELDS and condition.type != "duplicate":
+        raise ValueError(f"Invalid key: {condition.type}")
+    if condition.operation not in Condition.operators:
+        raise ValueError(f"Invalid operator {condition.operation}")
+
+    value = condition.value
+
+    if condition.type == "duplicate":
+        if not isinstance(value, str):
+            raise ValueError("Condition check of type \"duplicate\" must take value type string")
+        if condition.operation not in ("==", "!="):
+            raise ValueError(f"Operator {condition.operation} cannot be used with condition type \"duplicate\"")
+        return value
+
+    if condition.operation in Condition.pattern_operators and condition.type not in Condition.string_types:
+        raise ValueError(f"Operator {condition.operation} can only be used with condition types {', '.join(Condition.string_types)}")
+
+    if condition.type in Condition.string_types:
+        if not isinstance(value, str):
+            raise ValueError(f"Condition check of type \"{condition.type}\" must take value type string")
+        if condition.operation in Condition.pattern_operators:
+            return condition.get_pattern()
+        # String comparisons are case-insensitive, so the condition value is lowercased once here
+        return value.lower()
+
+    if condition.type == "size":
+        if isinstance(value, int):
+            value = float(value)
+        if not isinstance(value, float):
+            raise ValueError("Condition check of type \"size\" must take value type int or float")
+    elif not isinstance(value, datetime):
+        raise ValueError(f"Condition check of type \"{condition.type}\" must take value type datetime")
+
+    return value
+
+# Compile a Condition into a function that takes a FileInfo and returns a bool.
+# If a NameMatcher is given, name includes/excludes conditions register their value with it and
+# share its single scan of each name instead of searching the name themselves.
+def compile_condition(condition, name_matcher=None):
+    value = normalize_value(condition)
+    op = condition.operation
+
+    if condition.type == "duplicate":
+        # Content checks go through the shared DuplicateFinder, which caches hashes between calls
+        is_duplicate = get_finder().is_duplicate
+        expected = op == "=="
+        return lambda file: is_duplicate(file, value) == expected
+
+    get_field = operator.attrgetter(FIELDS[condition.type])
+
+    if name_matcher is not None and condition.type == "name" and op in ("includes", "excludes"):
+        bit = 1 << name_matcher.add(value)
+        scan = name_matcher.scan
+        if op == "includes":
+            return lambda file: scan(file.name) & bit != 0
+        return lambda file: scan(file.name) & bit == 0
+
+    if op in Condition.pattern_operators:
+        compare = Condition.operators[op]
+        return lambda file: compare(get_field(file), value)
+
+    if condition.type in Condition.string_types:
+        if op == "includes":
+            return lambda file: value in get_field(file).lower()
+        if op == "excludes":
+            return lambda file: value not in get_field(file).lower()
+        compare = Condition.operators[op]
+        return lambda file: compare(get_field(file).lower(), value)
+
+    compare = Condition.operators[op]
+    return lambda file: compare(get_field(file), value)
+
+# Compile a Condition into a function that takes the raw file attribute it checks (e.g. a name
+# or path string, or a size) rather than a FileInfo. Used where file data is not held in FileInfo objects.
+def compile_value_test(condition):
+    value = normalize_value(condition)
+    op = condition.operation
+
+    if condition.type == "duplicate":
+        raise ValueError("Condition type \"duplicate\" depends on file contents and cannot be tested on a single value")
+
+    if op in Condition.pattern_operators:
+        compare = Condition.operators[op]
+        return lambda field: compare(field, value)
+
+    if condition.type in Condition.string_types:
+        if op == "includes":
+            return lambda field: value in field.lower()
+        if op == "excludes":
+            return lambda field: value not in field.lower()
+        compare = Condition.operators[op]
+        return lambda field: compare(field.lower(), value)
+
+    compare = Condition.operators[op]
+    return lambda field: compare(field, value)
+
+# Compile a Ruleset into a function that takes a FileInfo and returns the SortingRule whose
+# action should run, or None if the file does not match. Works for both match_all and match-one.
+# name_matcher is passed on to compile_condition. With a RuleStats object, every check records
+# its statistics, and the conditions of a match_all ruleset run in the order the statistics suggest.
+def compile_ruleset(ruleset, name_matcher=None, stats=None):
+    rules = list(ruleset.sorting_rules)
+    if not rules:
+        return lambda file: None
+
+    checks = [compile_condition(rule.condition, name_matcher) for rule in rules]
+
+    if ruleset.match_all:
+        # Every condition must pass; the final rule's action is the one executed
+        final_rule = rules[-1]
+        if stats is not None:
+            # The result does not depend on the order, so the cheapest and most selective checks go first
+            pairs = stats.order_checks([(rule.condition, check) for rule, check in zip(rules, checks)])
+            return stats.wrap_all(pairs, final_rule)
+        if len(checks) == 1:
+            check = checks[0]
+            return lambda file: final_rule if check(file) else None
+
+        def match_all(file):
+            for check in checks:
+                if not check(file):
+                    return None
+            return final_rule
+        return match_all
+
+    # Match one: the first rule whose condition passes wins
+    if stats is not None:
+        checks = [stats.wrap(rule.condition, check) for rule, check in zip(rules, checks)]
+    if len(checks) == 1:
+        check, rule = checks[0], rules[0]
+        return lambda file: rule if check(file) else None
+
+    pairs = list(zip(checks, rules))
+
+    def match_one(file):
+        for check, rule in pairs:
+            if check(file):
+                return rule
+        return None
+    return match_one
+
+# Compile every ruleset in a dictionary, keeping dictionary order.
+# Returns a list of (ruleset, matcher) pairs.
+def compile_rulesets(rulesets, stats=None):
+    return [(ruleset, compile_ruleset(ruleset, stats=stats)) for _, ruleset in rulesets.items()]
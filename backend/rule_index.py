@@ -0,0 +1,93 @@
+from backend.rule_compiler import compile_condition, compile_ruleset
+from backend.name_matcher import NameMatcher
+
+class RuleIndex:
+    """
+    Job-level index from file extension to the rules that can match it.
+
+    Most rules are `extension == ...` conditions, and a file can only satisfy those for its own
+    extension. Those rules are filed under the (lowercased) extension; every other rule goes into a
+    fallback list. For a given file, only the rules filed under its extension and the fallback
+    rules are tried, still in ruleset order and rule order, so first-match semantics are unchanged.
+    An optional RuleStats object is passed to the compiler to record statistics and order match_all checks.
+    """
+    def __init__(self, rulesets, stats=None):
+        self.by_extension = {}  # Extension -> list of candidates
+        self.fallback = []      # Candidates that must be tried for every file
+        self.merged = {}        # Extension -> indexed and fallback candidates, merged in order
+
+        # With many name substring conditions, they all share one multi-pattern scan per file name
+        self.name_matcher = None
+        if RuleIndex.count_name_patterns(rulesets) >= NameMatcher.min_patterns:
+            self.name_matcher = NameMatcher()
+
+        # Each candidate is ((ruleset position, rule position), ruleset, matcher)
+        for ruleset_position, (_, ruleset) in enumerate(rulesets.items()):
+            if not ruleset.sorting_rules:
+                continue
+
+            if ruleset.match_all:
+                # The whole ruleset is one candidate; any extension condition restricts it to that extension
+                key = None
+                for rule in ruleset.sorting_rules:
+                    key = RuleIndex.get_extension_key(rule.condition)
+                    if key is not None:
+                        break
+                self.add_candidate(key, (ruleset_position, 0), ruleset, compile_ruleset(ruleset, self.name_matcher, stats))
+            else:
+                for rule_position, rule in enumerate(ruleset.sorting_rules):
+                    key = RuleIndex.get_extension_key(rule.condition)
+                    self.add_candidate(key, (ruleset_position, rule_position), ruleset, RuleIndex.compile_rule(rule, self.name_matcher, stats))
+
+        self.fallback_pairs = [(ruleset, match) for _, ruleset, match in self.fallback]
+
+    # Helper function to return the index key for an `extension ==` condition, or None if the condition cannot be indexed
+    @staticmethod
+    def get_extension_key(condition):
+        if condition.type == "extension" and condition.operation == "==" and isinstance(condition.value, str):
+            return condition.value.lower()
+        return None
+
+    # Helper function to count the distinct name includes/excludes values across all rulesets
+    @staticmethod
+    def count_name_patterns(rulesets):
+        patterns = set()
+        for _, ruleset in rulesets.items():
+            for rule in ruleset.sorting_rules:
+                condition = rule.condition
+                if (condition.type == "name" and condition.operation in ("includes", "excludes")
+                        and isinstance(condition.value, str)):
+                    patterns.add(condition.value.lower())
+        return len(patterns)
+
+    # Helper function to compile a single rule into a matcher that returns the rule or None
+    @staticmethod
+    def compile_rule(rule, name_matcher=None, stats=None):
+        check = compile_condition(rule.condition, name_matcher)
+        if stats is not None:
+            check = stats.wrap(rule.condition, check)
+        return lambda file: rule if check(file) else None
+
+    def add_candidate(self, key, position, ruleset, match):
+        candidate = (position, ruleset, match)
+        if key is None:
+            self.fallback.append(candidate)
+        else:
+            self.by_extension.setdefault(key, []).append(candidate)
+
+    # Return the (ruleset, matcher) pairs to try for a file, in order. Pass the result to sorting_job.sort_file.
+    def candidates(self, file):
+        key = file.extension.lower()
+        merged = self.merged.get(key)
+        if merged is None:
+            indexed = self.by_extension.get(key)
+            if indexed is None:
+                # Only extensions that have indexed rules are cached, so unusual extensions cannot grow the cache
+                return self.fallback_pairs
+            merged = [(ruleset, match) for _, ruleset, match in sorted(indexed + self.fallback, key=lambda c: c[0])]
+            self.merged[key] = merged
+        return merged
+
+    def __repr__(self):
+        return (f"RuleIndex(extensions={len(self.by_extension)}, fallback={len(self.fallback)}, "
+                f"name_patterns={len(self.name_matcher) if self.name_matcher else 0})")
@@ -0,0 +1,174 @@
+import os
+import json
+import time
+from backend.app_state import get_app_data_dir
+import backend.trace as trace
+
+# Assumed cost in nanoseconds of each condition type before enough evaluations have been timed.
+# Size and date conditions may have to stat the file; duplicate conditions may have to read it.
+DEFAULT_COSTS = {
+    "extension": 300,
+    "name": 400,
+    "path": 500,
+    "size": 2000,
+    "dateCreated": 2000,
+    "dateModified": 2000,
+    "duplicate": 1_000_000
+}
+
+class RuleStats:
+    """
+    Observed pass rate and evaluation time of each condition, persisted between runs as JSON.
+
+    Compiled checks are wrapped to count how often each condition is evaluated and how often it
+    passes; every `sample_every`-th evaluation is also timed. In a match_all ruleset every condition
+    must pass and their order does not change the result, so its conditions are reordered to
+    minimise the expected cost: by cost / (1 - pass rate), cheapest and most selective first.
+    A match_all ruleset only counts the files it samples, on which every condition runs, so a
+    condition's pass rate does not depend on the order it was measured in (see wrap_all).
+    Match-one rulesets and the order of rulesets are never changed, since there the first match wins.
+    """
+    # Evaluations needed before observed numbers replace the defaults
+    min_samples = 100
+    # Time one evaluation in this many
+    sample_every = 16
+    # Counts are halved past this many evaluations, so recent runs keep influencing the order
+    max_evaluations = 1_000_000
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = {}   # Condition key -> [evaluations, passes, timed evaluations, total timed ns]
+
+    # Helper function to return the key a condition's statistics are stored under
+    @staticmethod
+    def get_key(condition):
+        return json.dumps(condition.to_dict(), sort_keys=True, default=str)
+
+    # Helper function to return the statistics entry for a condition, creating it if needed
+    def get_entry(self, condition):
+        key = RuleStats.get_key(condition)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = [0, 0, 0, 0]
+            self.entries[key] = entry
+        return entry
+
+    # Wrap a compiled check so every call is counted (and some are timed) in the condition's entry
+    def wrap(self, condition, check):
+        entry = self.get_entry(condition)
+        sample_every = self.sample_every
+        perf_counter_ns = time.perf_counter_ns
+
+        def instrumented(file):
+            entry[0] += 1
+            if entry[0] % sample_every:
+                result = check(file)
+            else:
+                start = perf_counter_ns()
+                result = check(file)
+                entry[2] += 1
+                entry[3] += perf_counter_ns() - start
+            if result:
+                entry[1] += 1
+            return result
+        return instrumented
+
+    # Return a match_all matcher over (condition, check) pairs, returning final_rule if every check passes. Most files stop
+    # at the first check that fails and are not counted. Every sample_every-th file runs and times every check, and only
+    # those files are counted, so each pass rate is measured on the same files whatever the order. Counting every call
+    # would measure later conditions only on the files earlier ones let through, and the order would never change.
+    def wrap_all(self, pairs, final_rule):
+        checks = [check for _, check in pairs]
+        entries = [self.get_entry(condition) for condition, _ in pairs]
+        sample_every = self.sample_every
+        perf_counter_ns = time.perf_counter_ns
+        calls = 0
+
+        def match_all(file):
+            nonlocal calls
+            calls += 1
+            if calls % sample_every:
+                for check in checks:
+                    if not check(file):
+                        return None
+                return final_rule
+
+            matched = True
+            for check, entry in zip(checks, entries):
+                start = perf_counter_ns()
+                result = check(file)
+                entry[3] += perf_counter_ns() - start
+                entry[0] += 1
+                entry[2] += 1
+                if result:
+                    entry[1] += 1
+                else:
+                    matched = False
+            return final_rule if matched else None
+        return match_all
+
+    # Count evaluations and passes measured outside a compiled check, e.g. over a whole FileTable by BatchEvaluator.
+    # No time is recorded, since a condition evaluated over an array costs far less per file than a compiled check.
+    def add_counts(self, condition, evaluations, passes):
+        entry = self.get_entry(condition)
+        entry[0] += evaluations
+        entry[1] += passes
+
+    # Return the average evaluation time of a condition in nanoseconds
+    def get_cost(self, condition):
+        entry = self.entries.get(RuleStats.get_key(condition))
+        if entry is None or entry[2] * self.sample_every < self.min_samples:
+            return DEFAULT_COSTS.get(condition.type, 1000)
+        return entry[3] / entry[2]
+
+    # Return the fraction of evaluations in which a condition passed
+    def get_pass_rate(self, condition):
+        entry = self.entries.get(RuleStats.get_key(condition))
+        if entry is None or entry[0] < self.min_samples:
+            return 0.5
+        return entry[1] / entry[0]
+
+    # Return the sort key of a condition within a match_all ruleset; lower runs first
+    def get_rank(self, condition):
+        return self.get_cost(condition) / max(1.0 - self.get_pass_rate(condition), 1e-9)
+
+    # Return the (condition, check) pairs of a match_all ruleset in the order they should run.
+    # The sort is stable, so conditions without statistics keep their insertion order.
+    def order_checks(self, pairs):
+        return sorted(pairs, key=lambda pair: self.get_rank(pair[0]))
+
+    # Load statistics from a JSON file; a missing or unreadable file gives empty statistics
+    @classmethod
+    def load(cls, path=None):
+        if path is None:
+            path = os.path.join(get_app_data_dir(), "rule_stats.json")
+
+        stats = cls(path)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            stats.entries = {key: list(entry) for key, entry in data.get("conditions", {}).items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, AttributeError) as e:
+            trace.warning("rule_stats", f"Ignoring unreadable rule statistics at {path} - {e}", path=path)
+        return stats
+
+    # Save statistics to the JSON file they were loaded from
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            path = os.path.join(get_app_data_dir(), "rule_stats.json")
+
+        for entry in self.entries.values():
+            if entry[0] > self.max_evaluations:
+                entry[:] = [value // 2 for value in entry]
+
+        # Write to a temporary file first so an interrupted save never leaves a truncated file
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "conditions": self.entries}, f)
+        os.replace(temp_path, path)
+
+    def __repr__(self):
+        return f"RuleStats(path='{self.path}', conditions={len(self.entries)})"
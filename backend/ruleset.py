@@ -1,23 +1,34 @@
+import os
 from backend.sorting_rule import SortingRule
 from backend.folder_info import FolderInfo
 from backend.file_info import FileInfo
 from backend.rollback import ActionRecord
+from backend.rule_compiler import compile_ruleset
+import backend.trace as trace
 
 class Ruleset:
-    def __init__(self, folder, match_all=False):
+    def __init__(self, folder, match_all=False, exclude_patterns=None, include_patterns=None):
         if not isinstance(folder, FolderInfo):
             raise ValueError("Ruleset must take a FolderInfo object for the assigned folder")
 
         self.sorting_rules = []
         self.folder = folder
         self.match_all = match_all
+        # Directory name patterns the scanner skips (see ScanFilter), and exceptions to them
+        self.exclude_patterns = list(exclude_patterns or [])
+        self.include_patterns = list(include_patterns or [])
 
     def run_rules(self, file, logger=None):
-        records = []
-
         if not isinstance(file, FileInfo):
             raise ValueError("run_rules must take a FileInfo object")
 
+        rule = self.match_rule(file)
+        if rule is None:
+            return []
+        return self.apply_rule(rule, file, logger)
+
+    # Return the rule whose action should run on the file, or None if the file does not match
+    def match_rule(self, file):
         if self.match_all:
             if all(rule.condition.check(file) for rule in self.sorting_rules):
                 # Ensure all actions are the same type
@@ -26,49 +37,49 @@ class Ruleset:
                     raise ValueError("All rules must have the same action type when match_all is enabled.")
 
                 # Execute only the final rule's action
-                final_rule = self.sorting_rules[-1]
-                action = final_rule.action
-                new_path = action.get_target_path(file)
-                if action.type != "recycle":
-                    reverse_action = action.get_reverse_action(file)
-
-                if logger:
-                    action.execute(file, logger)
-                else:
-                    action.execute(file)
-
-                if action.type != "recycle":
-                    record = ActionRecord(
-                        forward_action=action,
-                        reverse_action=reverse_action,
-                        file=file,
-                        result_path=new_path
-                    )
-                    records.append(record)
+                return self.sorting_rules[-1]
         else:
             for rule in self.sorting_rules:
                 if rule.condition.check(file):
-                    action = rule.action
-                    new_path = action.get_target_path(file)
-                    if action.type != "recycle":
-                        reverse_action = action.get_reverse_action(file)
+                    return rule  # Stop after the first match
 
-                    if logger:
-                        action.execute(file, logger)
-                    else:
-                        action.execute(file)
-                    if action.type != "recycle":
-                        record = ActionRecord(
-                            forward_action=action,
-                            reverse_action=reverse_action,
-                            file=file,
-                            result_path=new_path
-                        )
-                        records.append(record)
-                    break  # Stop after the first match
+        return None
+
+    # Execute a matched rule's action on the file and return its undo records
+    def apply_rule(self, rule, file, logger=None):
+        records = []
+        action = rule.action
+        old_path = file.path
+        if trace.debug_enabled:
+            trace.debug("ruleset", f"{file.path} matched {rule.condition!r} in {self.folder.path}", path=file.path,
+                        target=action.get_target_path(file))
+        if action.type != "recycle":
+            reverse_action = action.get_reverse_action(file)
+
+        if logger:
+            new_path = action.execute(file, logger)
+        else:
+            new_path = action.execute(file)
+
+        # Skipped actions are not recorded, since there is nothing to undo
+        if new_path is not None and action.type != "recycle":
+            if action.type == "move" and os.path.basename(new_path) != os.path.basename(old_path):
+                # The conflict policy gave the file a new name, so undo restores the old one
+                reverse_action.new_name = os.path.basename(old_path)
+            record = ActionRecord(
+                forward_action=action,
+                reverse_action=reverse_action,
+                file=file,
+                result_path=new_path
+            )
+            records.append(record)
 
         return records
 
+    # Compile the ruleset into a single matching function (see rule_compiler.compile_ruleset)
+    def compile(self):
+        return compile_ruleset(self)
+
     def add_rule(self, rule):
         if not isinstance(rule, SortingRule):
             raise ValueError("add_rule must take a SortingRule object")
@@ -93,17 +104,22 @@ class Ruleset:
         return {
             "folder": self.folder.path,
             "match_all": self.match_all,
-            "rules": [rule.to_dict() for rule in self.sorting_rules]
+            "rules": [rule.to_dict() for rule in self.sorting_rules],
+            "exclude": self.exclude_patterns,
+            "include": self.include_patterns
         }
 
     @classmethod
-    def from_dict(cls, data):
-        folder = FolderInfo.from_path(
-            folder_path=data["folder"],
-            is_target=False 
+    def from_dict(cls, data, check_folder=True):
+        # Only the folder's path is needed for context, so the folder is not scanned
+        folder = FolderInfo(os.path.basename(data["folder"]), [], False, data["folder"])
+        ruleset = cls(
+            folder,
+            match_all=data["match_all"],
+            exclude_patterns=data.get("exclude"),
+            include_patterns=data.get("include")
         )
-        ruleset = cls(folder, match_all=data["match_all"])
-        ruleset.sorting_rules = [SortingRule.from_dict(rule) for rule in data["rules"]]
+        ruleset.sorting_rules = [SortingRule.from_dict(rule, check_folder) for rule in data["rules"]]
         return ruleset
 
     
@@ -0,0 +1,75 @@
+import os
+import re
+import fnmatch
+
+class ScanFilter:
+    """
+    Decides which directories the scanner descends into.
+
+    Patterns are matched against directory names before the directory is listed, so a pruned
+    subtree costs no system calls at all. A pattern is a glob by default (e.g. "node_modules",
+    ".*"); prefix it with "re:" to use a regular expression instead (e.g. "re:^cache[0-9]*$").
+    A directory is skipped if its name matches an exclude pattern and no include pattern, or if
+    its path is one of the excluded paths.
+    """
+    def __init__(self, exclude=None, include=None, excluded_paths=None):
+        self.exclude = list(exclude or [])
+        self.include = list(include or [])
+        self.excluded_paths = {ScanFilter.normalize_path(path) for path in (excluded_paths or [])}
+
+        self.exclude_regexes = [ScanFilter.compile_pattern(pattern) for pattern in self.exclude]
+        self.include_regexes = [ScanFilter.compile_pattern(pattern) for pattern in self.include]
+
+    # Helper function to compile a glob or "re:" pattern into a case-insensitive regular expression
+    @staticmethod
+    def compile_pattern(pattern):
+        if not isinstance(pattern, str) or not pattern:
+            raise ValueError("Scan filter patterns must be non-empty strings")
+
+        if pattern.startswith("re:"):
+            return re.compile(pattern[3:], re.IGNORECASE)
+        if pattern.startswith("glob:"):
+            pattern = pattern[5:]
+        return re.compile(fnmatch.translate(pattern), re.IGNORECASE)
+
+    # Helper function to normalize a path for comparison
+    @staticmethod
+    def normalize_path(path):
+        return os.path.normcase(os.path.normpath(path))
+
+    # Returns True if the directory at the given path should not be scanned
+    def prune(self, path):
+        if self.excluded_paths and ScanFilter.normalize_path(path) in self.excluded_paths:
+            return True
+
+        if not self.exclude_regexes:
+            return False
+
+        name = os.path.basename(path)
+        if not any(regex.search(name) for regex in self.exclude_regexes):
+            return False
+        return not any(regex.search(name) for regex in self.include_regexes)
+
+    # Build a filter from the patterns of every ruleset. With exclude_destinations, the folders the
+    # rulesets sort into are skipped as well, since their files have already been sorted.
+    @classmethod
+    def from_rulesets(cls, rulesets, exclude_destinations=False):
+        exclude = []
+        include = []
+        excluded_paths = []
+
+        for _, ruleset in rulesets.items():
+            exclude.extend(pattern for pattern in ruleset.exclude_patterns if pattern not in exclude)
+            include.extend(pattern for pattern in ruleset.include_patterns if pattern not in include)
+
+            if exclude_destinations:
+                excluded_paths.append(ruleset.folder.path)
+                for rule in ruleset.sorting_rules:
+                    if rule.action.final_folder is not None:
+                        excluded_paths.append(rule.action.final_folder)
+
+        return cls(exclude, include, excluded_paths)
+
+    def __repr__(self):
+        return (f"ScanFilter(exclude={self.exclude!r}, include={self.include!r}, "
+                f"excluded_paths={len(self.excluded_paths)})")
@@ -0,0 +1,165 @@
+import os
+import sqlite3
+from datetime import datetime
+from backend.app_state import get_app_data_dir
+from backend.file_info import FileInfo
+from backend.folder_info import FolderInfo
+
+class ScanIndex:
+    """
+    Persistent SQLite index of scanned folders and files.
+
+    Each folder row stores the directory's mtime at the time it was listed. On refresh, a
+    folder whose mtime is unchanged is not listed again and its file rows are reused as-is,
+    so only directories whose entries changed cost a scandir and a stat per file.
+    """
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(get_app_data_dir(), "scan_index.db")
+
+        self.db_path = db_path
+        # Sorting jobs scan on a background thread; the GUI only runs one job at a time
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS folders (
+                path TEXT PRIMARY KEY,
+                parent TEXT,
+                mtime_ns INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                folder TEXT NOT NULL,
+                name TEXT NOT NULL,
+                extension TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                ctime_ns INTEGER NOT NULL,
+                inode INTEGER,
+                device INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS folders_parent ON folders (parent);
+            CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+        """)
+
+    # Bring the index up to date for a directory tree. Only folders whose mtime changed are listed again.
+    # max_depth and prune work as in FolderInfo.from_path.
+    def refresh(self, folder_path, max_depth=None, prune=None):
+        folder_path = os.path.normpath(folder_path)
+        stack = [(folder_path, 0)]
+
+        with self.connection:
+            while stack:
+                path, depth = stack.pop()
+
+                try:
+                    folder_mtime = os.stat(path).st_mtime_ns
+                except (PermissionError, FileNotFoundError) as e:
+                    print(f"Error accessing {path} - {e}")
+                    self.remove_folder(path)
+                    continue
+
+                row = self.connection.execute("SELECT mtime_ns FROM folders WHERE path = ?", (path,)).fetchone()
+                if row is not None and row[0] == folder_mtime:
+                    subfolders = self.get_subfolders(path)
+                else:
+                    subfolders = self.rescan_folder(path, folder_mtime)
+
+                if FolderInfo.within_depth(depth, max_depth):
+                    for subfolder in subfolders:
+                        if prune is None or not prune(subfolder):
+                            stack.append((subfolder, depth + 1))
+
+    # Helper function to list one folder and replace its rows in the index
+    def rescan_folder(self, path, folder_mtime):
+        files = []
+        subfolders = []
+
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subfolders.append(entry.path)
+                        elif entry.is_file():
+                            entry_stat = entry.stat()
+                            name, extension = os.path.splitext(entry.name)
+                            files.append((entry.path, path, name, extension, entry_stat.st_size,
+                                          entry_stat.st_mtime_ns, entry_stat.st_ctime_ns,
+                                          entry_stat.st_ino, entry_stat.st_dev))
+                    except (PermissionError, FileNotFoundError) as e:
+                        print(f"Error accessing {entry.path} - {e}")
+        except (PermissionError, FileNotFoundError) as e:
+            print(f"Error accessing {path} - {e}")
+            self.remove_folder(path)
+            return []
+
+        # Drop subfolders that no longer exist, along with everything under them
+        for old_subfolder in self.get_subfolders(path):
+            if old_subfolder not in subfolders:
+                self.remove_folder(old_subfolder)
+
+        # New subfolders get a NULL mtime so they are listed when visited
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO folders (path, parent, mtime_ns) VALUES (?, ?, NULL)",
+            [(subfolder, path) for subfolder in subfolders]
+        )
+        self.connection.execute("DELETE FROM files WHERE folder = ?", (path,))
+        self.connection.executemany("INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", files)
+        self.connection.execute(
+            "INSERT INTO folders (path, parent, mtime_ns) VALUES (?, ?, ?) "
+            "ON CONFLICT (path) DO UPDATE SET mtime_ns = excluded.mtime_ns",
+            (path, os.path.dirname(path), folder_mtime)
+        )
+
+        return subfolders
+
+    # Helper function to return the indexed subfolders of a folder
+    def get_subfolders(self, path):
+        return [row[0] for row in self.connection.execute("SELECT path FROM folders WHERE parent = ?", (path,))]
+
+    # Remove a folder and everything under it from the index
+    def remove_folder(self, path):
+        prefix = os.path.join(path, "")
+        self.connection.execute("DELETE FROM files WHERE folder = ? OR substr(folder, 1, ?) = ?", (path, len(prefix), prefix))
+        self.connection.execute("DELETE FROM folders WHERE path = ? OR substr(path, 1, ?) = ?", (path, len(prefix), prefix))
+
+    # Build a FolderInfo tree from the index without touching the disk
+    def to_folder_info(self, folder_path, is_target=True, max_depth=None, prune=None):
+        folder_path = os.path.normpath(folder_path)
+        root = FolderInfo(os.path.basename(folder_path), [], is_target, folder_path)
+        stack = [(root, 0)]
+
+        while stack:
+            folder, depth = stack.pop()
+            for subfolder in self.get_subfolders(folder.path):
+                node = FolderInfo(os.path.basename(subfolder), [], False, subfolder)
+                folder.contents.append(node)
+                if FolderInfo.within_depth(depth, max_depth) and (prune is None or not prune(subfolder)):
+                    stack.append((node, depth + 1))
+
+            rows = self.connection.execute(
+                "SELECT path, name, extension, size, mtime_ns, ctime_ns FROM files WHERE folder = ?", (folder.path,)
+            )
+            for path, name, extension, size, mtime_ns, ctime_ns in rows:
+                folder.contents.append(FileInfo(
+                    name, extension, path, size,
+                    datetime.fromtimestamp(ctime_ns / 1e9),
+                    datetime.fromtimestamp(mtime_ns / 1e9)
+                ))
+
+        return root
+
+    # Refresh the index for a folder and return its FolderInfo tree; a drop-in for FolderInfo.from_path
+    def scan(self, folder_path, is_target=True, max_depth=None, prune=None):
+        if not os.path.isdir(folder_path):
+            print(f"Folder not found or not a directory: {folder_path}")
+            return FolderInfo(os.path.basename(folder_path), [], is_target, folder_path)
+
+        self.refresh(folder_path, max_depth, prune)
+        return self.to_folder_info(folder_path, is_target, max_depth, prune)
+
+    def close(self):
+        self.connection.close()
+
+    def __repr__(self):
+        return f"ScanIndex(db_path='{self.db_path}')"
@@ -0,0 +1,253 @@
+import os
+import json
+from datetime import datetime
+import backend.trace as trace
+from backend.file_info import FileInfo
+from backend.folder_info import FolderInfo
+from backend.ruleset import Ruleset
+from backend.sorting_rule import SortingRule
+from backend.rule_index import RuleIndex
+from backend.action_executor import ActionExecutor
+from backend.duplicates import prefetch_duplicates
+from backend.job_progress import JobProgress
+from backend.recycle_batch import RecycleBatch
+from backend.device_cache import get_cache, CrossDeviceQueue
+from backend.destination_index import DestinationIndex, get_index
+from backend.journal import ActionJournal
+from backend.sorting_job import (create_log_file, get_all_files, match_files, run_tasks, collect_results, get_errors,
+                                 finish_job, save_stats)
+
+class PlanEntry:
+    """
+    One planned action: the file at `path` matched `rule` of the ruleset for folder `ruleset`, and the
+    rule's action will take it to `target`. `size` is the file's size when it was planned, so a file
+    that changed since can be skipped instead of being acted on blindly.
+    """
+    def __init__(self, path, ruleset, rule, target, size=None):
+        self.path = path
+        self.ruleset = ruleset
+        self.rule = rule
+        self.target = target
+        self.size = size
+
+    def __repr__(self):
+        return f"PlanEntry(path={self.path!r}, action={self.rule.action.type!r}, target={self.target!r})"
+
+class SortPlan:
+    """
+    The ordered list of actions a sorting job would take, built without touching any file.
+
+    A plan can be inspected (summary, find_conflicts), saved to disk for a dry run and loaded again
+    later, and applied with execute_plan. It is stored as JSON Lines: a header line with the plan's
+    details and its rules, which are stored once, then one line per entry.
+    """
+    version = 1
+
+    def __init__(self, entries=None, description="Sorting Job", target=None, created=None):
+        self.entries = list(entries or [])
+        self.description = description
+        self.target = target
+        self.created = created or datetime.now()
+
+    # Return aggregate statistics: entry count, bytes, and entries per action type and per destination folder
+    def summary(self):
+        actions = {}
+        destinations = {}
+        total_bytes = 0
+        for entry in self.entries:
+            action = entry.rule.action
+            actions[action.type] = actions.get(action.type, 0) + 1
+            if action.final_folder is not None:
+                destinations[action.final_folder] = destinations.get(action.final_folder, 0) + 1
+            total_bytes += entry.size or 0
+        return {
+            "files": len(self.entries),
+            "bytes": total_bytes,
+            "actions": actions,
+            "destinations": destinations,
+            "conflicts": len(self.find_conflicts())
+        }
+
+    # Return the entries whose target already exists, or is also the target of an earlier entry.
+    # Each destination folder is listed once instead of checking every target on disk.
+    def find_conflicts(self):
+        index = DestinationIndex()
+        conflicts = []
+        for entry in self.entries:
+            if entry.rule.action.type == "recycle":
+                continue
+            if index.exists(entry.target):
+                conflicts.append(entry)
+            index.add(entry.target)
+        return conflicts
+
+    # Save the plan as JSON Lines
+    def save(self, path):
+        rule_ids = {}
+        rules = []
+        for entry in self.entries:
+            if id(entry.rule) not in rule_ids:
+                rule_ids[id(entry.rule)] = len(rules)
+                rules.append({"ruleset": entry.ruleset, "rule": entry.rule.to_dict()})
+
+        header = {
+            "version": self.version,
+            "description": self.description,
+            "target": self.target,
+            "created": self.created.isoformat(),
+            "rules": rules
+        }
+
+        # Write to a temporary file first so an interrupted save never leaves a truncated plan
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header, default=str) + "\n")
+            for entry in self.entries:
+                f.write(json.dumps({
+                    "path": entry.path,
+                    "rule": rule_ids[id(entry.rule)],
+                    "target": entry.target,
+                    "size": entry.size
+                }) + "\n")
+        os.replace(temp_path, path)
+
+    # Load a plan saved with save(). Rules are rebuilt from the plan, not from the current rulesets.
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != cls.version:
+                raise ValueError(f"Unsupported sort plan version: {header.get('version')}")
+
+            rules = [(item["ruleset"], SortingRule.from_dict(item["rule"])) for item in header["rules"]]
+            entries = []
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                ruleset, rule = rules[data["rule"]]
+                entries.append(PlanEntry(data["path"], ruleset, rule, data["target"], data.get("size")))
+
+        return cls(entries, header.get("description", "Sorting Job"), header.get("target"),
+                   datetime.fromisoformat(header["created"]))
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f"SortPlan(description={self.description!r}, entries={len(self.entries)})"
+
+# Build the plan of a sorting job: every file is matched as run_sorting_job would match it, but no action runs.
+# target is a FolderInfo, or a directory path that is scanned with FolderInfo.iter_files.
+def build_plan(rulesets, target, description="Sorting Job", max_depth=None, prune=None, stats=None, progress=None):
+    progress = progress or JobProgress()
+    if isinstance(target, FolderInfo):
+        files = list(get_all_files(target))
+        target_path = target.path
+    elif os.path.isdir(target):
+        files = list(FolderInfo.iter_files(target, max_depth=max_depth, prune=prune))
+        target_path = target
+    else:
+        raise ValueError("Target folder must be a FolderInfo object or an existing directory.")
+    progress.add_scanned(len(files))
+
+    rule_index = RuleIndex(rulesets, stats)
+    prefetch_duplicates(rulesets, files)
+    # Rulesets are identified by their folder path, as in the rulesets dictionary
+    ruleset_keys = {id(ruleset): key for key, ruleset in rulesets.items()}
+
+    entries = []
+    try:
+        for ruleset, rule, file in match_files(files, rule_index, progress):
+            try:
+                size = file.size
+            except OSError:
+                size = None
+            entries.append(PlanEntry(file.path, ruleset_keys[id(ruleset)], rule, rule.action.get_target_path(file), size))
+    finally:
+        save_stats(stats)
+
+    plan = SortPlan(entries, description, target_path)
+    if trace.info_enabled:
+        trace.info("sort_plan", f"Planned {len(entries)} actions for {target_path}", **plan.summary())
+    return plan
+
+# Helper function to yield the (ruleset, rule, file) tasks of a plan, skipping files that are gone or have changed
+def iter_plan_tasks(plan, progress):
+    rulesets = {}
+    for entry in plan.entries:
+        if progress.cancelled:
+            return
+        try:
+            file = FileInfo.from_path(entry.path)
+        except (PermissionError, FileNotFoundError) as e:
+            trace.warning("sort_plan", f"Skipping {entry.path} - {e}", path=entry.path)
+            continue
+        if entry.size is not None and file.size != entry.size:
+            trace.warning("sort_plan", f"Skipping {entry.path} - File changed since it was planned", path=entry.path)
+            continue
+
+        ruleset = rulesets.get(entry.ruleset)
+        if ruleset is None:
+            # apply_rule only needs the ruleset's folder, so a plan does not need the rulesets it was built from
+            ruleset = Ruleset(FolderInfo(os.path.basename(entry.ruleset), [], False, entry.ruleset))
+            rulesets[entry.ruleset] = ruleset
+        progress.add_matched()
+        yield ruleset, entry.rule, file
+
+# Apply a plan built by build_plan or loaded from disk. The undo records, logging, device grouping, recycling and
+# journaling are the same as in run_sorting_job; files that disappeared or changed since the plan was built are skipped.
+# records are undo records of actions that already ran, e.g. of a recovered job; they are recorded with the plan's.
+# rulesets are the rulesets the plan came from, if known; they are kept in the journal so a recovered job can finish,
+# with exclude_destinations telling whether it skips their destination folders.
+def execute_plan(plan, log_dir="logs", description=None, workers=1, progress=None, journal_dir=None, records=None,
+                 rulesets=None, exclude_destinations=False):
+    progress = progress or JobProgress()
+    description = description or plan.description
+    log_file = create_log_file(log_dir)
+    all_records = list(records or [])
+    get_index().clear()
+    devices = get_cache()
+    devices.clear()
+    devices.resolve({os.path.dirname(entry.path) for entry in plan.entries} |
+                    {entry.rule.action.final_folder for entry in plan.entries if entry.rule.action.final_folder is not None})
+    queue = CrossDeviceQueue(devices)
+    executor = ActionExecutor(workers, logger=log_file, devices=devices) if workers > 1 else None
+    recycler = RecycleBatch(logger=log_file, progress=progress, devices=devices)
+    journal = ActionJournal.create(description, journal_dir, plan.target, rulesets, exclude_destinations) \
+        if journal_dir is not None else None
+
+    try:
+        run_tasks(iter_plan_tasks(plan, progress), all_records, log_file, executor, progress, recycler, queue, journal)
+    except BaseException:
+        progress.finish("failed")
+        raise
+    finally:
+        if executor is not None:
+            collect_results(all_records, executor, progress)
+        log_file.close()
+        if journal is not None:
+            journal.close()
+
+    finish_job(all_records, description, get_errors(executor, recycler), progress, journal)
+
+# Resume a job recovered from its journal (see journal.RecoveredJob). The actions it completed are kept for undo, its
+# pending actions run first, in the order they were matched, and then the files it had not reached are matched and
+# acted on. Files the job already acted on are not matched again. The whole job is recorded as one undo batch.
+# max_depth and prune limit the scan as in build_plan. A job that ran a plan has no rulesets, so only its pending
+# actions run. The old journal is deleted once the resumed job has ended without an error; the resumed job keeps its own.
+def resume_job(job, log_dir="logs", workers=1, progress=None, journal_dir=None, max_depth=None, prune=None):
+    progress = progress or JobProgress()
+    job.remove_partial()
+    entries = [PlanEntry(entry.path, entry.ruleset, entry.rule, entry.target) for entry in job.get_pending()]
+    if job.rulesets is not None and job.target is not None and os.path.isdir(job.target):
+        seen = {os.path.normpath(entry.path) for entry in job.entries}
+        seen.update(os.path.normpath(entry.result) for entry in job.entries if entry.result is not None)
+        rest = build_plan(job.rulesets, job.target, max_depth=max_depth, prune=prune)
+        entries.extend(entry for entry in rest.entries if os.path.normpath(entry.path) not in seen)
+
+    plan = SortPlan(entries, job.description, job.target, job.created)
+    trace.info("sort_plan", f"Resuming {job.description} with {len(entries)} actions left", actions=len(entries))
+    execute_plan(plan, log_dir, workers=workers, progress=progress, journal_dir=journal_dir, records=job.get_records(),
+                 rulesets=job.rulesets, exclude_destinations=job.exclude_destinations)
+    job.discard()
@@ -1,51 +1,494 @@
 import os
 import time
+import asyncio
+import threading
 import backend.rollback
-from datetime import datetime
+import backend.trace as trace
 
 from backend.file_info import FileInfo
 from backend.folder_info import FolderInfo
 from backend.sorting_rule import SortingRule
 from backend.ruleset import Ruleset
 from backend.condition import Condition
-from backend.action import Action
+from backend.action import Action, on_destination
+from backend.rule_index import RuleIndex
+from backend.batch_eval import BatchEvaluator
+from backend.file_table import FileTable
+from backend.duplicates import prefetch_duplicates
+from backend.action_executor import ActionExecutor
+from backend.device_cache import get_cache, CrossDeviceQueue
+from backend.destination_index import get_index
+from backend.job_progress import JobProgress
+from backend.recycle_batch import RecycleBatch
+from backend.journal import ActionJournal
+from backend.log_writer import LogWriter
 
+# Held while files are being sorted or undone, so the app's jobs and the watcher's groups never run at the same time.
+# They share the destination index, the device cache and the undo stack.
+job_lock = threading.Lock()
+
+# Return a LogWriter for a job's action log in log_dir, appending to the newest log file until it is rotated.
+# The format and durability are LogWriter's defaults.
 def create_log_file(log_dir="logs"):
     base_dir = os.path.dirname(os.path.abspath(__file__))
     log_path = os.path.join(base_dir, log_dir)
+    return LogWriter(log_path) # Caller is responsible for closing log file
 
-    if not os.path.exists(log_path):
-        os.makedirs(log_path)
+# Helper function to flatten a folder structure. Uses a stack of iterators instead of
+# recursion so trees of any depth can be flattened.
+def get_all_files(folder):
+    stack = [iter(folder.contents)]
+    while stack:
+        for item in stack[-1]:
+            if isinstance(item, FileInfo):
+                yield item
+            elif isinstance(item, FolderInfo):
+                stack.append(iter(item.contents))
+                break
+        else:
+            stack.pop()
 
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    full_log_path = os.path.join(log_path, f"sorting_log_{timestamp}.txt")
-    return open(full_log_path, "a") # Caller is responsible for closing log file
+# Helper function to find the first ruleset that matches a file. Returns (ruleset, rule), or None if nothing matches.
+# matchers is a list of (ruleset, matcher) pairs, e.g. from RuleIndex.candidates or rule_compiler.compile_rulesets.
+def match_file(file, matchers):
+    try:
+        for ruleset, match in matchers:
+            rule = match(file)
+            if rule is not None:
+                return ruleset, rule
+    except FileNotFoundError as e:
+        # File metadata is read lazily, so a file removed after the scan is only noticed here
+        trace.warning("sorting_job", f"Skipping {file.path} - {e}", path=file.path)
+    return None
 
-# Helper function to flatten a folder structure
-def get_all_files(folder):
-    for item in folder.contents:
-        if isinstance(item, FileInfo):
-            yield item
-        elif isinstance(item, FolderInfo):
-            yield from get_all_files(item)
+# Helper function to apply a matched rule to a file, skipping the file if it has disappeared
+def apply_match(ruleset, rule, file, logger=None):
+    try:
+        return ruleset.apply_rule(rule, file, logger)
+    except FileNotFoundError as e:
+        trace.warning("sorting_job", f"Skipping {file.path} - {e}", path=file.path)
+    return []
+
+# Helper function to run a single file through compiled rulesets, stopping at the first ruleset that matches it
+def sort_file(file, matchers, logger=None):
+    matched = match_file(file, matchers)
+    if matched is None:
+        return []
+    return apply_match(*matched, file, logger)
+
+# Helper function to look up the device of every source and destination folder of a job before it runs.
+# folders are looked up too, e.g. the target of a streaming job whose files are not known yet.
+def resolve_devices(rulesets, files, folders=()):
+    devices = get_cache()
+    devices.clear()
+    folders = {os.path.dirname(file.path) for file in files} | set(folders)
+    for _, ruleset in rulesets.items():
+        for rule in ruleset.sorting_rules:
+            if rule.action.final_folder is not None:
+                folders.add(rule.action.final_folder)
+    devices.resolve(folders)
+    return devices
+
+# Helper function to check whether any rule uses a duplicate condition
+def uses_duplicates(rulesets):
+    return any(rule.condition.type == "duplicate" for _, ruleset in rulesets.items() for rule in ruleset.sorting_rules)
+
+# Helper function to persist rule statistics after a job; a failed save must not fail the job
+def save_stats(stats):
+    if stats is None:
+        return
+    try:
+        stats.save()
+    except OSError as e:
+        trace.warning("sorting_job", f"Could not save rule statistics - {e}")
+
+# Helper function to run a matched rule now, or queue it on the executor, counting it in the job's progress.
+# Recycle actions are queued on the recycler instead. Returns the records of an action that ran now; records
+# of queued actions come from executor.results(). With a journal, the action is journaled before it runs, and the
+# path its conflict policy picks is journaled before it writes there.
+def start_task(ruleset, rule, file, all_records, logger, executor=None, progress=None, recycler=None, journal=None):
+    entry_id = journal.intend(ruleset, rule, file) if journal is not None else None
+    destination_callback = journal.get_destination_callback(entry_id) if journal is not None else None
+    if recycler is not None:
+        if rule.action.type == "recycle":
+            recycler.add(rule.action, file)
+            return []
+        # A file waiting to be recycled still occupies its path, which this action may need
+        if recycler.contains(rule.action.get_target_path(file)):
+            recycler.flush()
+
+    action_bytes = progress.get_action_bytes(rule.action, file) if progress is not None else 0
+    if executor is None:
+        with on_destination(destination_callback):
+            records = apply_match(ruleset, rule, file, logger)
+        all_records.extend(records)
+        if journal is not None:
+            journal.complete(entry_id, records)
+        if progress is not None:
+            progress.add_acted(action_bytes)
+        return records
+
+    future = executor.submit(ruleset, rule, file, destination_callback)
+    if journal is not None:
+        # Failed and cancelled actions stay pending in the journal
+        future.add_done_callback(lambda done: done.cancelled() or done.exception() or journal.complete(entry_id, done.result()))
+    if progress is not None:
+        future.add_done_callback(lambda done: done.cancelled() or progress.add_acted(action_bytes))
+    return []
+
+# Helper function to match files in order, yielding (ruleset, rule, file) for each file that matched.
+# Stops when the job is cancelled.
+def match_files(files, rule_index, progress):
+    for file in files:
+        if progress.cancelled:
+            return
+        matched = match_file(file, rule_index.candidates(file))
+        if matched is None:
+            continue
+        progress.add_matched()
+        yield (*matched, file)
 
-def run_sorting_job(rulesets, target_folder, log_dir="logs", description="Sorting Job"):
+# Helper function to run matched (ruleset, rule, file) tasks in order. Moves to another device are held on the
+# queue, if one is given, and run at the end grouped by device pair; recycle actions go to the recycler.
+def run_tasks(tasks, all_records, logger, executor, progress, recycler, queue=None, journal=None):
+    for task in tasks:
+        if progress.cancelled:
+            break
+        for ready in (queue.schedule(*task) if queue is not None else [task]):
+            start_task(*ready, all_records, logger, executor, progress, recycler, journal)
+    if queue is not None:
+        for task in queue.drain():
+            if progress.cancelled:
+                break
+            start_task(*task, all_records, logger, executor, progress, recycler, journal)
+    flush_recycler(recycler, progress)
+
+# Helper function to recycle the files still queued at the end of a job; a cancelled job drops them instead
+def flush_recycler(recycler, progress):
+    if progress.cancelled:
+        recycler.discard()
+    else:
+        recycler.flush()
+
+# Helper function to stop a cancelled job's pending actions and wait for the rest
+def collect_results(all_records, executor, progress):
+    if progress.cancelled:
+        executor.cancel_pending()
+    all_records.extend(executor.results())
+    executor.close()
+
+# Helper function to return the errors of the actions that failed on an executor thread or in the recycler
+def get_errors(executor=None, recycler=None):
+    errors = list(executor.errors) if executor is not None else []
+    if recycler is not None:
+        errors.extend(error for _, error in recycler.errors)
+    return errors
+
+# Helper function to record a finished job for undo, then raise the first action that failed on an executor thread
+# or in the recycler. A cancelled job records the actions it completed, so it can be undone like a finished one.
+# The job's journal is no longer needed once its actions are recorded, so it is removed.
+def finish_job(all_records, description, errors=(), progress=None, journal=None):
+    state = "cancelled" if progress is not None and progress.cancelled else "finished"
+    trace.info("sorting_job", f"{description} {state} with {len(all_records)} undoable actions", actions=len(all_records))
+    if all_records:
+        backend.rollback.record_batch(all_records, description)
+    if journal is not None:
+        journal.remove()
+    if errors:
+        if progress is not None:
+            progress.finish("failed")
+        raise errors[0]
+    if progress is not None:
+        progress.finish(state)
+
+# Moves to another device are held back and run after the other actions, grouped by device pair (see
+# device_cache.CrossDeviceQueue). With workers > 1, files are still matched in order on the calling thread,
+# but their actions run on an ActionExecutor; the undo records are the same, in the same order, as when
+# actions run one at a time. progress is an optional JobProgress that is updated as the job runs and can cancel it.
+# With a journal_dir, every action is journaled before it runs, so the job can be recovered if the process dies.
+# exclude_destinations is journaled, so a recovered job skips the same folders; the scan itself is up to the caller.
+def run_sorting_job(rulesets, target_folder, log_dir="logs", description="Sorting Job", stats=None, workers=1, progress=None,
+                    journal_dir=None, exclude_destinations=False):
     if not isinstance(target_folder, FolderInfo):
         raise ValueError("Target folder must be a valid FolderInfo object.")
 
+    progress = progress or JobProgress()
+    rule_index = RuleIndex(rulesets, stats)
     log_file = create_log_file(log_dir)
+    # Folders may have changed since the last job, so they are listed again
+    get_index().clear()
     all_files = list(get_all_files(target_folder))
+    progress.add_scanned(len(all_files))
     all_records = []
+    prefetch_duplicates(rulesets, all_files)
+    devices = resolve_devices(rulesets, all_files)
+    # Duplicate conditions must see the files that earlier actions moved, so moves are only held back without them
+    queue = CrossDeviceQueue(devices) if not uses_duplicates(rulesets) else None
+    executor = ActionExecutor(workers, logger=log_file, devices=devices) if workers > 1 else None
+    recycler = RecycleBatch(logger=log_file, progress=progress, devices=devices)
+    journal = ActionJournal.create(description, journal_dir, target_folder.path, rulesets, exclude_destinations) \
+        if journal_dir is not None else None
 
     try:
-        for file in all_files:
-            for _, ruleset in rulesets.items():
-                records = ruleset.run_rules(file, logger=log_file)
-                all_records.extend(records)
-                if records:
-                    break
+        run_tasks(match_files(all_files, rule_index, progress), all_records, log_file, executor, progress, recycler, queue,
+                  journal)
+    except BaseException:
+        progress.finish("failed")
+        raise
     finally:
+        if executor is not None:
+            collect_results(all_records, executor, progress)
         log_file.close()
-    
-    if all_records:
-        backend.rollback.record_batch(all_records, description)
\ No newline at end of file
+        if journal is not None:
+            journal.close()
+        save_stats(stats)
+
+    finish_job(all_records, description, get_errors(executor, recycler), progress, journal)
+
+# Helper function to return a path's normalized folder and name, as the streaming job compares them
+def split_path(path):
+    folder, name = os.path.split(os.path.normpath(path))
+    return os.path.normcase(folder), os.path.normcase(name)
+
+# Helper function to remember a path the streaming job put a file at, so the scanner skips the file if it finds it.
+# result_paths maps a folder to the names put there. The scanner lists each folder once, so paths in a folder it has
+# already left, outside the target tree or under a pruned folder can never be found again and are not kept.
+def add_result_path(result_paths, path, target_path, passed, prune=None):
+    folder, name = split_path(path)
+    if folder in passed or not (folder == target_path or folder.startswith(os.path.join(target_path, ""))):
+        return
+    if prune is not None:
+        parent = folder
+        while parent != target_path:
+            if prune(parent):
+                return
+            parent = os.path.dirname(parent)
+    result_paths.setdefault(folder, set()).add(name)
+
+# Streaming variant of run_sorting_job: files are matched and acted on as the scanner finds them,
+# so no FolderInfo tree is built and the first actions run before the scan finishes
+def run_streaming_sorting_job(rulesets, target_path, log_dir="logs", description="Sorting Job", max_depth=None, prune=None, stats=None, workers=1,
+                              progress=None, journal_dir=None, exclude_destinations=False):
+    if not os.path.isdir(target_path):
+        raise ValueError("Target folder must be an existing directory.")
+
+    progress = progress or JobProgress()
+    rule_index = RuleIndex(rulesets, stats)
+    log_file = create_log_file(log_dir)
+    # Folders may have changed since the last job, so they are listed again
+    get_index().clear()
+    all_records = []
+    # Files moved deeper into the target tree may be found again by the scanner; skip those. The scanner yields each
+    # folder's files together, so a folder's paths are dropped once it moves on, and `passed` holds the folders it left.
+    root = os.path.normcase(os.path.normpath(target_path))
+    result_paths = {}
+    passed = set()
+    scan_folder = None
+    # Drives may have been mounted or swapped since the last job. The files are not known yet, so the target folder
+    # stands in for their folders; the folders below it are looked up as the scanner reaches them.
+    devices = resolve_devices(rulesets, (), (target_path,))
+    executor = ActionExecutor(workers, logger=log_file, devices=devices) if workers > 1 else None
+    recycler = RecycleBatch(logger=log_file, progress=progress, devices=devices)
+    journal = ActionJournal.create(description, journal_dir, target_path, rulesets, exclude_destinations) \
+        if journal_dir is not None else None
+
+    try:
+        for file in FolderInfo.iter_files(target_path, max_depth=max_depth, prune=prune):
+            if progress.cancelled:
+                break
+            folder, name = split_path(file.path)
+            if folder != scan_folder:
+                if scan_folder is not None:
+                    result_paths.pop(scan_folder, None)
+                    passed.add(scan_folder)
+                scan_folder = folder
+            names = result_paths.get(folder)
+            if names is not None and name in names:
+                names.discard(name)
+                continue
+            progress.add_scanned()
+            matched = match_file(file, rule_index.candidates(file))
+            if matched is None:
+                continue
+            progress.add_matched()
+            ruleset, rule = matched
+            if executor is None:
+                records = start_task(ruleset, rule, file, all_records, log_file, progress=progress, recycler=recycler,
+                                     journal=journal)
+                for record in records:
+                    add_result_path(result_paths, record.result_path, root, passed, prune)
+                continue
+            # The target is known before the action runs, so the scanner can skip it even if it is not there yet
+            if rule.action.type != "recycle":
+                add_result_path(result_paths, rule.action.get_target_path(file), root, passed, prune)
+            start_task(ruleset, rule, file, all_records, log_file, executor, progress, recycler, journal)
+        flush_recycler(recycler, progress)
+    except BaseException:
+        progress.finish("failed")
+        raise
+    finally:
+        if executor is not None:
+            collect_results(all_records, executor, progress)
+        log_file.close()
+        if journal is not None:
+            journal.close()
+        save_stats(stats)
+
+    finish_job(all_records, description, get_errors(executor, recycler), progress, journal)
+
+# Helper function to yield the (ruleset, rule, file) tasks of a table's matches, in table order. FileInfo objects are
+# only created for the files that matched. Stops when the job is cancelled.
+def match_table(table, evaluator, progress):
+    for row, ruleset, rule in evaluator.iter_matches(table):
+        if progress.cancelled:
+            return
+        progress.add_matched()
+        yield ruleset, rule, table.file_info(row)
+
+# Table variant of run_sorting_job: every rule is evaluated over the whole FileTable at once with
+# NumPy masks, and FileInfo objects are only created for the files that matched. Requires NumPy.
+# stats, workers, progress and journal_dir work as in run_sorting_job, and actions are scheduled the same way.
+# Only pass rates are collected, since conditions are evaluated over arrays (see BatchEvaluator).
+def run_batch_sorting_job(rulesets, table, log_dir="logs", description="Sorting Job", stats=None, workers=1, progress=None,
+                          journal_dir=None, exclude_destinations=False):
+    progress = progress or JobProgress()
+    evaluator = BatchEvaluator(rulesets, stats)
+    log_file = create_log_file(log_dir)
+    get_index().clear()
+    progress.add_scanned(len(table))
+    all_records = []
+    devices = get_cache()
+    devices.clear()
+    devices.resolve(set(table.folders) | {rule.action.final_folder for _, rule in evaluator.rules
+                                          if rule.action.final_folder is not None})
+    queue = CrossDeviceQueue(devices) if not uses_duplicates(rulesets) else None
+    executor = ActionExecutor(workers, logger=log_file, devices=devices) if workers > 1 else None
+    recycler = RecycleBatch(logger=log_file, progress=progress, devices=devices)
+    journal = ActionJournal.create(description, journal_dir, table.root_path, rulesets, exclude_destinations) \
+        if journal_dir is not None else None
+
+    try:
+        # The table is a snapshot, so a file removed after the scan is skipped when its action runs (see apply_match)
+        run_tasks(match_table(table, evaluator, progress), all_records, log_file, executor, progress, recycler, queue,
+                  journal)
+    except BaseException:
+        progress.finish("failed")
+        raise
+    finally:
+        if executor is not None:
+            collect_results(all_records, executor, progress)
+        log_file.close()
+        if journal is not None:
+            journal.close()
+        save_stats(stats)
+
+    finish_job(all_records, description, get_errors(executor, recycler), progress, journal)
+
+class AsyncSortingJob:
+    """
+    Runs a sorting job from asyncio without blocking the event loop.
+
+    The scan and the job run in the loop's default executor, and their progress is delivered as
+    ProgressEvents through an async iterator:
+
+        job = AsyncSortingJob(rulesets, target_path, description="User-initiated sort")
+        async for event in job:
+            print(event.scanned, event.matched, event.acted, event.bytes_moved)
+
+    The last event has state "finished", "cancelled" or "failed"; after a failure the job's exception
+    is raised by the iterator. cancel() stops the job after the action in progress, and the actions
+    it completed are recorded as an undo batch. Closing the iterator early, e.g. by leaving an
+    `async with contextlib.aclosing(job.events())` block, also cancels the job and waits for it.
+    """
+    def __init__(self, rulesets, target, description="Sorting Job", streaming=False, log_dir="logs", stats=None, workers=1,
+                 max_depth=None, prune=None, scan=None, journal_dir=None, run_job=None, batch=False, exclude_destinations=False):
+        self.rulesets = rulesets
+        self.target = target
+        self.description = description
+        self.streaming = streaming
+        # Match with run_batch_sorting_job over a FileTable; ignored when streaming. Requires NumPy.
+        self.batch = batch
+        self.log_dir = log_dir
+        self.stats = stats
+        self.workers = workers
+        self.max_depth = max_depth
+        self.prune = prune
+        # Optional callable returning the FolderInfo to sort, e.g. a ScanIndex scan; runs on the executor
+        self.scan = scan
+        self.journal_dir = journal_dir
+        # Whether prune and scan skip the rulesets' destination folders; journaled so a recovered job does the same
+        self.exclude_destinations = exclude_destinations
+        # Optional callable taking the JobProgress that runs instead of a sorting job, e.g. resuming a recovered job
+        self.run_job = run_job
+        self.progress = JobProgress()
+
+    # Ask the job to stop. Safe to call from any thread.
+    def cancel(self):
+        self.progress.cancel()
+
+    # Helper function run on the executor: scan if needed, then run the job while holding the job lock
+    def run(self):
+        with job_lock:
+            self.run_locked()
+
+    # Helper function to scan if needed, then run the job
+    def run_locked(self):
+        try:
+            if self.run_job is not None:
+                self.run_job(self.progress)
+                return
+            if self.streaming:
+                run_streaming_sorting_job(self.rulesets, self.target, self.log_dir, self.description, self.max_depth,
+                                          self.prune, self.stats, self.workers, self.progress, self.journal_dir,
+                                          self.exclude_destinations)
+                return
+            if self.batch:
+                if isinstance(self.target, FolderInfo) or self.scan is not None:
+                    table = FileTable.from_folder_info(self.target if isinstance(self.target, FolderInfo) else self.scan())
+                else:
+                    table = FileTable.from_path(self.target, self.max_depth, self.prune)
+                run_batch_sorting_job(self.rulesets, table, self.log_dir, self.description, self.stats, self.workers,
+                                      self.progress, self.journal_dir, self.exclude_destinations)
+                return
+            if isinstance(self.target, FolderInfo):
+                folder = self.target
+            elif self.scan is not None:
+                folder = self.scan()
+            else:
+                folder = FolderInfo.from_path(self.target, True, max_depth=self.max_depth, prune=self.prune)
+            run_sorting_job(self.rulesets, folder, self.log_dir, self.description, self.stats, self.workers, self.progress,
+                            self.journal_dir, self.exclude_destinations)
+        except BaseException:
+            # Failures before the job started never reached its own failure report
+            if self.progress.state == "running":
+                self.progress.finish("failed")
+            raise
+
+    # Run the job and yield its progress events until it ends
+    async def events(self):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        self.progress.callback = lambda event: loop.call_soon_threadsafe(queue.put_nowait, event)
+        job = loop.run_in_executor(None, self.run)
+
+        try:
+            while True:
+                event = await queue.get()
+                yield event
+                if event.state != "running":
+                    break
+        finally:
+            if not job.done():
+                # The consumer stopped early; let the job record what it completed before returning
+                self.cancel()
+                try:
+                    await asyncio.shield(job)
+                except BaseException:
+                    pass
+        await job
+
+    def __aiter__(self):
+        return self.events()
+
+    def __repr__(self):
+        return f"AsyncSortingJob(target={self.target!r}, description={self.description!r}, progress={self.progress!r})"
@@ -16,6 +16,10 @@ class SortingRule:
     def __str__(self):
         condition_type = self.condition.type
 
+        if condition_type == "duplicate":
+            negation = "" if self.condition.operation == "==" else "not "
+            return f"If file is {negation}a duplicate of a file in {self.condition.value}, move file here."
+
         if condition_type == "date_created":
             condition_type = "date created"
         elif condition_type == "date_modified":
@@ -37,11 +41,11 @@ class SortingRule:
         }
 
     @classmethod
-    def from_dict(cls, data):
+    def from_dict(cls, data, check_folder=True):
         from backend.condition import Condition
         from backend.action import Action
         return cls(
             condition=Condition.from_dict(data["condition"]),
-            action=Action.from_dict(data["action"])
+            action=Action.from_dict(data["action"], check_folder)
         )
     
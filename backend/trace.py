@@ -0,0 +1,175 @@
+"""
+Structured tracing for the sorting engine.
+
+Modules report events through debug(), info(), warning() and error() with a category (e.g.
+"condition", "action") and a message. Each event is passed to every sink whose level it meets;
+a sink is any callable that takes a TraceEvent. By default only warnings and errors are written,
+to stderr. Set the QWIKSORT_TRACE environment variable to a level name (e.g. "debug") to lower it.
+
+Hot paths guard their hooks with the module flags, so a disabled hook costs a single check and
+the message is never formatted:
+
+    if trace.debug_enabled:
+        trace.debug("condition", f"Evaluating: {left!r} {op} {right!r}")
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+LEVEL_NAMES = {
+    DEBUG: "DEBUG",
+    INFO: "INFO",
+    WARNING: "WARNING",
+    ERROR: "ERROR"
+}
+
+# True when at least one sink accepts events of that level. Updated whenever sinks change.
+debug_enabled = False
+info_enabled = False
+warning_enabled = False
+error_enabled = False
+
+# (level, sink) pairs. The list is replaced rather than modified, so emit() needs no lock.
+sinks = []
+sinks_lock = threading.Lock()
+
+class TraceEvent:
+    def __init__(self, level, category, message, fields=None):
+        self.time = time.time()
+        self.level = level
+        self.category = category
+        self.message = message
+        self.fields = fields or {}
+
+    def to_dict(self):
+        return {
+            "time": self.time,
+            "level": LEVEL_NAMES.get(self.level, str(self.level)),
+            "category": self.category,
+            "message": self.message,
+            **self.fields
+        }
+
+    def __str__(self):
+        return f"{LEVEL_NAMES.get(self.level, self.level)} [{self.category}] {self.message}"
+
+    def __repr__(self):
+        return (f"TraceEvent(level={self.level!r}, category={self.category!r}, "
+                f"message={self.message!r})")
+
+class StreamSink:
+    """
+    Writes each event as one line of text to a stream (stderr by default).
+    """
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        # Looked up on each call so a replaced sys.stderr is respected
+        stream = self.stream or sys.stderr
+        with self.lock:
+            stream.write(f"{event}\n")
+            stream.flush()
+
+class JsonLinesSink:
+    """
+    Appends each event as one JSON object per line to a file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        line = json.dumps(event.to_dict(), default=str)
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# Helper function to convert a level name such as "debug" into its number
+def parse_level(level):
+    if isinstance(level, int):
+        return level
+    for number, name in LEVEL_NAMES.items():
+        if name == str(level).upper():
+            return number
+    raise ValueError(f"Invalid trace level: {level}")
+
+# Helper function to recompute the module flags from the current sinks
+def update_flags():
+    global debug_enabled, info_enabled, warning_enabled, error_enabled
+    lowest = min((level for level, _ in sinks), default=ERROR + 1)
+    debug_enabled = lowest <= DEBUG
+    info_enabled = lowest <= INFO
+    warning_enabled = lowest <= WARNING
+    error_enabled = lowest <= ERROR
+
+# Add a sink that receives events at or above the given level
+def add_sink(sink, level=WARNING):
+    global sinks
+    with sinks_lock:
+        sinks = sinks + [(parse_level(level), sink)]
+        update_flags()
+    return sink
+
+# Remove a sink added with add_sink
+def remove_sink(sink):
+    global sinks
+    with sinks_lock:
+        sinks = [(level, existing) for level, existing in sinks if existing is not sink]
+        update_flags()
+
+# Change the level of a sink that was already added
+def set_level(sink, level):
+    global sinks
+    with sinks_lock:
+        sinks = [(parse_level(level) if existing is sink else current, existing) for current, existing in sinks]
+        update_flags()
+
+# Pass an event to every sink whose level it meets
+def emit(level, category, message, **fields):
+    current_sinks = sinks
+    event = None
+    for sink_level, sink in current_sinks:
+        if level >= sink_level:
+            if event is None:
+                event = TraceEvent(level, category, message, fields)
+            try:
+                sink(event)
+            except Exception:
+                # A broken sink must never stop a sorting job
+                pass
+
+def debug(category, message, **fields):
+    if debug_enabled:
+        emit(DEBUG, category, message, **fields)
+
+def info(category, message, **fields):
+    if info_enabled:
+        emit(INFO, category, message, **fields)
+
+def warning(category, message, **fields):
+    if warning_enabled:
+        emit(WARNING, category, message, **fields)
+
+def error(category, message, **fields):
+    if error_enabled:
+        emit(ERROR, category, message, **fields)
+
+# Default sink: warnings and errors to stderr, unless QWIKSORT_TRACE asks for a different level
+try:
+    default_level = parse_level(os.environ.get("QWIKSORT_TRACE", "warning"))
+except ValueError:
+    default_level = WARNING
+default_sink = add_sink(StreamSink(), default_level)
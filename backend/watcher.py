@@ -0,0 +1,264 @@
+import os
+import sys
+import stat
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+import threading
+import backend.rollback
+import backend.trace as trace
+from backend.file_info import FileInfo
+from backend.sorting_job import create_log_file, sort_file, job_lock
+from backend.rule_index import RuleIndex
+from backend.destination_index import get_index
+
+# inotify event flags (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+class InotifySource:
+    """
+    Reports the names of files created, written or moved into a folder using Linux inotify.
+    Events for subfolders are ignored, as PollingSource only lists files.
+    """
+    def __init__(self, folder_path):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder_path), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, f"inotify_add_watch failed for {folder_path}")
+
+        self.overflowed = False
+
+    # Wait up to timeout seconds and return the set of file names that changed
+    def poll(self, timeout):
+        names = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return names
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return names
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].split(b"\0", 1)[0]
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped by the kernel; the watcher rescans the folder
+                self.overflowed = True
+            elif name and not mask & IN_ISDIR:
+                names.add(os.fsdecode(name))
+
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+class PollingSource:
+    """
+    Reports the names of new or modified files by listing a folder at a fixed interval.
+    Used where inotify is not available (e.g. Windows).
+    """
+    def __init__(self, folder_path, interval=1.0):
+        self.folder_path = folder_path
+        self.interval = interval
+        self.overflowed = False
+        self.snapshot = self.take_snapshot()
+
+    # Helper function to map each file name in the folder to its size and modification time
+    def take_snapshot(self):
+        snapshot = {}
+        try:
+            with os.scandir(self.folder_path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_file():
+                            entry_stat = entry.stat()
+                            snapshot[entry.name] = (entry_stat.st_size, entry_stat.st_mtime_ns)
+                    except (PermissionError, FileNotFoundError):
+                        continue
+        except (PermissionError, FileNotFoundError) as e:
+            trace.error("watcher", f"Error accessing {self.folder_path} - {e}", path=self.folder_path)
+        return snapshot
+
+    # Wait up to timeout seconds and return the set of file names that changed
+    def poll(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        snapshot = self.take_snapshot()
+        names = {name for name, state in snapshot.items() if self.snapshot.get(name) != state}
+        self.snapshot = snapshot
+        return names
+
+    def close(self):
+        pass
+
+class FolderWatcher:
+    """
+    Watches a folder and runs new or modified files through the rulesets as they arrive.
+
+    Change events are coalesced per file name. A file is only sorted once it has had no events
+    and kept the same size for `debounce` seconds, so files that are still being written are left
+    alone. Each group of files sorted together is recorded as one undo batch.
+    """
+    def __init__(self, rulesets, folder_path, debounce=2.0, poll_interval=1.0, log_dir="logs", description="Watch mode"):
+        if folder_path is None or not os.path.isdir(folder_path):
+            raise ValueError("FolderWatcher must take an existing directory")
+
+        self.rulesets = rulesets
+        self.folder_path = folder_path
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.log_dir = log_dir
+        self.description = description
+
+        self.pending = {}           # File name -> (time of last event, last seen size)
+        self.result_paths = set()   # Paths written by our own actions, which must not be sorted again
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    # Helper function to pick the best available change source for this platform
+    def create_source(self):
+        if sys.platform.startswith("linux"):
+            try:
+                return InotifySource(self.folder_path)
+            except OSError as e:
+                trace.warning("watcher", f"inotify unavailable, falling back to polling - {e}")
+        return PollingSource(self.folder_path, self.poll_interval)
+
+    # Replace the rulesets, e.g. with a new copy after the user edited them. The group being sorted keeps the old
+    # ones; the next group uses these.
+    def set_rulesets(self, rulesets):
+        self.rulesets = rulesets
+
+    # Start watching on a background thread
+    def start(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self.run, name="FolderWatcher", daemon=True)
+        self.thread.start()
+
+    # Stop watching and wait for the background thread to finish
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # Main watch loop; runs until stop() is called
+    def run(self):
+        source = self.create_source()
+        log_file = create_log_file(self.log_dir)
+
+        try:
+            while not self.stop_event.is_set():
+                names = source.poll(min(self.debounce, self.poll_interval))
+                if source.overflowed:
+                    with os.scandir(self.folder_path) as entries:
+                        names.update(entry.name for entry in entries if entry.is_file())
+                    source.overflowed = False
+
+                now = time.monotonic()
+                for name in names:
+                    self.pending[name] = (now, self.pending.get(name, (now, None))[1])
+
+                ready = self.collect_ready(now)
+                if ready:
+                    self.sort_files(ready, log_file)
+        except Exception as e:
+            trace.error("watcher", f"Stopped watching {self.folder_path} - {e}", path=self.folder_path)
+        finally:
+            source.close()
+            log_file.close()
+
+    # Helper function to return the pending files that have settled, dropping any that disappeared or are not files
+    def collect_ready(self, now):
+        ready = []
+
+        for name, (last_event, last_size) in list(self.pending.items()):
+            if now - last_event < self.debounce:
+                continue
+
+            path = os.path.normpath(os.path.join(self.folder_path, name))
+            try:
+                path_stat = os.stat(path)
+            except (PermissionError, FileNotFoundError):
+                del self.pending[name]
+                continue
+            # A folder or a special file is never sorted, e.g. a folder renamed into the watched folder
+            if not stat.S_ISREG(path_stat.st_mode):
+                del self.pending[name]
+                continue
+            size = path_stat.st_size
+
+            # A file that is still growing gets another debounce period
+            if size != last_size:
+                self.pending[name] = (now, size)
+                continue
+
+            del self.pending[name]
+            if path in self.result_paths:
+                self.result_paths.discard(path)
+                continue
+            ready.append(path)
+
+        return ready
+
+    # Run a group of settled files through the rulesets and record them as one undo batch. The group waits for any
+    # sorting job the app is running, since they share the destination index and the undo stack; the group is dropped
+    # if the watcher is stopped while it waits.
+    def sort_files(self, paths, log_file):
+        while not job_lock.acquire(timeout=self.poll_interval):
+            if self.stop_event.is_set():
+                return
+        try:
+            self.sort_group(paths, log_file)
+        finally:
+            job_lock.release()
+
+    # Helper function to sort a group of files while holding the job lock. A file that fails is reported and skipped,
+    # and the files already sorted are recorded for undo even if the group is cut short.
+    def sort_group(self, paths, log_file):
+        all_records = []
+        # Compile for each group, since the rulesets may have been replaced since the last one (see set_rulesets)
+        rule_index = RuleIndex(self.rulesets)
+        # Files may have been added to the destination folders since the last group
+        get_index().clear()
+
+        try:
+            for path in paths:
+                try:
+                    file = FileInfo.from_path(path)
+                    records = sort_file(file, rule_index.candidates(file), logger=log_file)
+                except Exception as e:
+                    trace.error("watcher", f"Could not sort {path} - {e}", path=path)
+                    continue
+                all_records.extend(records)
+                self.result_paths.update(os.path.normpath(record.result_path) for record in records)
+        finally:
+            if all_records:
+                backend.rollback.record_batch(all_records, self.description)
+
+    def __repr__(self):
+        return f"FolderWatcher(folder='{self.folder_path}', pending={len(self.pending)})"
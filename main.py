@@ -2,7 +2,10 @@
 import sys
 import ctypes
 import os
+import copy
 import json
+import asyncio
+import multiprocessing
 from datetime import datetime
 from pathlib import Path
 from PySide6.QtWidgets import (
@@ -10,17 +13,19 @@ from PySide6.QtWidgets import (
     QFileSystemModel, QFileDialog, QLabel, QTreeWidgetItem,
     QLineEdit, QStyleFactory, QCheckBox, QTreeWidget,
     QDateTimeEdit, QCalendarWidget, QListWidget, QListWidgetItem,
-    QButtonGroup, QRadioButton, QMessageBox
+    QButtonGroup, QRadioButton, QMessageBox, QMenu
 )
-from PySide6.QtCore import QDir, QModelIndex, QDateTime, Qt, QCalendar
-from PySide6.QtGui import QPalette, QColor, QIcon
+from PySide6.QtCore import QDir, QModelIndex, QDateTime, Qt, QCalendar, QThread, Signal
+from PySide6.QtGui import QPalette, QColor, QIcon, QShortcut, QKeySequence, QAction
 from frontend.MainWindow import Ui_MainWindow
 from frontend.ruleset import Ui_Dialog
 from frontend.newFolder import Ui_Form
 
 # backend Functionality Imports
 from backend.action import Action
-from backend.sorting_job import run_sorting_job
+from backend.sorting_job import AsyncSortingJob, job_lock
+from backend.watcher import FolderWatcher
+import backend.batch_eval
 from backend.sorting_rule import SortingRule
 from backend.condition import Condition
 from backend.ruleset import Ruleset
@@ -28,6 +33,12 @@ from backend.folder_info import FolderInfo
 from backend.file_info import FileInfo
 from backend.rollback import undo_last, save_restore_point, rollback_to_restore_point
 from backend.app_state import AppState
+from backend.scan_index import ScanIndex
+from backend.scan_filter import ScanFilter
+from backend.rule_stats import RuleStats
+from backend.action_executor import ActionExecutor
+from backend.journal import get_journal_dir, find_unfinished
+from backend.sort_plan import SortPlan, build_plan, execute_plan, resume_job
 
 import sys
 import ctypes
@@ -245,10 +256,11 @@ class RulesetWindow(QDialog):
         if condition is None:
             name_includes = self.regexInclude.text().strip()
             name_excludes = self.regexExclude.text().strip()
+            # Plain text is a substring; "re:" and "glob:" prefixes give a regex or glob pattern, as in scan filters
             if name_includes:
-                condition = Condition("name", "includes", name_includes)
+                condition = self.get_name_condition(name_includes, "includes", "regex", "glob")
             elif name_excludes:
-                condition = Condition("name", "excludes", name_excludes)
+                condition = self.get_name_condition(name_excludes, "excludes", "notRegex", "notGlob")
 
         if condition is None:
             return None  # No rule selected
@@ -256,12 +268,31 @@ class RulesetWindow(QDialog):
         # Default action - move to the folder where the rule is being created
         action = Action("move", self.state.selected_folder)
         return SortingRule(condition, action)
-    
+
+    def get_name_condition(self, text, substring_operation, regex_operation, glob_operation):
+        """
+        Builds a name Condition from the text of a name field, using its prefix to choose the operation.
+        """
+        if text.startswith("re:"):
+            condition = Condition("name", regex_operation, text[3:])
+        elif text.startswith("glob:"):
+            condition = Condition("name", glob_operation, text[5:])
+        else:
+            return Condition("name", substring_operation, text)
+
+        # Reject invalid patterns now rather than when the sorting job runs
+        try:
+            condition.get_pattern()
+        except ValueError as e:
+            print(e)
+            return None
+        return condition
+
     def apply_rule_to_ruleset(self):
         new_rule = self.get_new_rule()
         if new_rule:
             path = self.state.selected_folder
-            folder = FolderInfo.from_path(path, False)
+            folder = FolderInfo(os.path.basename(path), [], False, path)
 
             if path in self.state.rulesets:
                 self.state.rulesets[path].sorting_rules.append(new_rule)
@@ -270,12 +301,34 @@ class RulesetWindow(QDialog):
             
             # Update the rule viewer
             self.main_window.create_ruleset_widget(self.state.rulesets[path])
+            self.main_window.update_watcher_rulesets()
         
         self.accept() # close dialog
 
         # Reselect folder
         self.main_window.folder_clicked(self.main_window.state.selected_folder)
 
+class SortingJobThread(QThread):
+    """
+    Runs an AsyncSortingJob on its own event loop so the window stays responsive while files are sorted.
+    """
+    progress = Signal(object)
+    failed = Signal(str)
+
+    def __init__(self, job, parent=None):
+        super().__init__(parent)
+        self.job = job
+
+    def run(self):
+        asyncio.run(self.consume())
+
+    async def consume(self):
+        try:
+            async for event in self.job:
+                self.progress.emit(event)
+        except Exception as e:
+            self.failed.emit(str(e))
+
 class MainWindow(QMainWindow):
     """
     The main application window that displays the file system and hooks up UI events.
@@ -285,6 +338,7 @@ class MainWindow(QMainWindow):
         self.state = state
         self.ui = Ui_MainWindow()
         self.ui.setupUi(self)
+        self.watcher = None # FolderWatcher of the target directory while Watch Target Folder is on
         self.setup_file_system_model()
         self.setup_connections()
         self.filepath = QDir(self.model.filePath(self.ui.listFiles.rootIndex()))
@@ -293,6 +347,7 @@ class MainWindow(QMainWindow):
         self.ui.pushbttn_matchAll.hide()
         self.ui.pushbttn_matchOne.hide()
         self.setWindowIcon(QIcon("qwikicon.ico"))
+        self.job_thread = None # SortingJobThread of the running sort or delete, if any
 
     def setup_file_system_model(self):
         """
@@ -339,6 +394,9 @@ class MainWindow(QMainWindow):
         self.ui.actionExport_Ruleset.triggered.connect(self.export_ruleset)
         self.ui.actionCreate_New_Restore_Point.triggered.connect(self.create_restore_point)
         self.ui.actionRestore_Back_to_Restore_Point.triggered.connect(self.rollback_to_restore_point)
+        QShortcut(QKeySequence(Qt.Key.Key_Escape), self, activated=self.cancel_job)
+        self.setup_settings_menu()
+        self.setup_plan_actions()
 
         
         # Open rulesets button is not needed right now
@@ -361,6 +419,116 @@ class MainWindow(QMainWindow):
         self.is_dark_mode = True
         self.set_dark_theme()
 
+    def setup_settings_menu(self):
+        """
+        Adds the Settings menu, whose checkable entries turn optional sorting features on and off.
+        It is built here rather than in MainWindow.ui, and sits before the Help menu.
+        """
+        self.menuSettings = QMenu("Settings", self)
+        self.ui.menubar.insertMenu(self.ui.menuHelp.menuAction(), self.menuSettings)
+
+        self.actionStreaming = self.add_setting("Streaming Sort", self.state.streaming,
+                                                "Sort files as they are found instead of scanning the whole folder first",
+                                                self.set_streaming)
+        self.actionScanIndex = self.add_setting("Use Scan Index", self.state.scan_index is not None,
+                                                "Reuse the last scan of unchanged folders. Files edited in place keep "
+                                                "their old size and dates until their folder changes",
+                                                self.set_scan_index)
+        self.actionBatch = self.add_setting("Batch Evaluation", self.state.batch,
+                                            "Match every file at once with NumPy arrays; faster on very large folders",
+                                            self.set_batch)
+        # Batch evaluation needs the optional NumPy dependency
+        self.actionBatch.setEnabled(backend.batch_eval.np is not None)
+        self.actionRuleStats = self.add_setting("Collect Rule Statistics", self.state.rule_stats is not None,
+                                                "Measure how often each condition passes and run the cheapest, most "
+                                                "selective conditions of Match All rulesets first",
+                                                self.set_rule_stats)
+        self.actionWatch = self.add_setting("Watch Target Folder", False,
+                                            "Sort new files as they arrive in the target directory", self.set_watching)
+
+    def setup_plan_actions(self):
+        """
+        Adds the dry run entries to the File menu, before Exit.
+        """
+        self.actionSave_Sort_Plan = QAction("Save Sort Plan...", self)
+        self.actionSave_Sort_Plan.setStatusTip("Match the target directory without moving any file, and save the plan")
+        self.actionSave_Sort_Plan.triggered.connect(self.save_sort_plan)
+        self.actionRun_Sort_Plan = QAction("Run Sort Plan...", self)
+        self.actionRun_Sort_Plan.setStatusTip("Apply a saved sort plan")
+        self.actionRun_Sort_Plan.triggered.connect(self.run_sort_plan)
+        self.ui.menuFile.insertAction(self.ui.actionExit, self.actionSave_Sort_Plan)
+        self.ui.menuFile.insertAction(self.ui.actionExit, self.actionRun_Sort_Plan)
+        self.ui.menuFile.insertSeparator(self.ui.actionExit)
+
+    def add_setting(self, text, checked, status_tip, on_toggled):
+        """
+        Adds a checkable entry to the Settings menu. on_toggled is called with the new checked state.
+        """
+        action = self.menuSettings.addAction(text)
+        action.setCheckable(True)
+        action.setChecked(checked)
+        action.setStatusTip(status_tip)
+        action.toggled.connect(on_toggled)
+        return action
+
+    def set_streaming(self, checked):
+        # Read when the next job starts, so a running job is not affected
+        self.state.streaming = checked
+
+    def set_batch(self, checked):
+        self.state.batch = checked
+
+    def set_rule_stats(self, checked):
+        # Statistics are saved after each job, so turning collection off keeps what was measured for next time
+        self.state.rule_stats = RuleStats.load() if checked else None
+
+    def set_scan_index(self, checked):
+        if checked and self.state.scan_index is None:
+            self.state.scan_index = ScanIndex()
+        elif not checked and self.state.scan_index is not None:
+            self.state.scan_index.close()
+            self.state.scan_index = None
+
+    def set_watching(self, checked):
+        self.stop_watcher()
+        if checked:
+            self.start_watcher()
+
+    def start_watcher(self):
+        """
+        Starts watching the target directory. The watcher sorts new files on its own thread, with its own copy of the
+        rulesets, and waits for any running job first. Without a valid target directory, watching is turned off.
+        """
+        try:
+            self.watcher = FolderWatcher(copy.deepcopy(self.state.rulesets), self.state.target_directory)
+        except ValueError:
+            self.ui.statusbar.showMessage("Choose a target directory to watch first")
+            self.actionWatch.setChecked(False)
+            return
+        self.watcher.start()
+        print(f"Watching {self.state.target_directory}")
+
+    def update_watcher_rulesets(self):
+        """
+        Gives the watcher a new copy of the rulesets after they were edited, if watching is on. Its next group of
+        files is sorted with them.
+        """
+        if self.watcher is not None:
+            self.watcher.set_rulesets(copy.deepcopy(self.state.rulesets))
+
+    def stop_watcher(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def restart_watcher(self):
+        """
+        Points the watcher at the current target directory and rulesets, if watching is on.
+        """
+        if self.watcher is not None:
+            self.stop_watcher()
+            self.start_watcher()
+
     def close_event(self):
         msg_box = QMessageBox(self)
         msg_box.setWindowTitle("Confirm Action")
@@ -442,6 +610,7 @@ class MainWindow(QMainWindow):
         self.ui.leTargetDirectory.setText(path)
         self.model.setRootPath(path)
         self.ui.listFiles.setRootIndex(self.model.index(path))
+        self.restart_watcher()
 
     def get_target_directory(self):
         """
@@ -460,6 +629,8 @@ class MainWindow(QMainWindow):
         """
         Opens the ruleset dialog window.
         """
+        if self.refuse_while_job_running():
+            return
         dialog = RulesetWindow(self.state, self)
         dialog.exec()
 
@@ -538,12 +709,20 @@ class MainWindow(QMainWindow):
             return
 
         sender = self.sender()
+        if not sender.isChecked() or (sender == self.ui.pushbttn_matchAll) == self.ruleset.match_all:
+            return
+        if self.refuse_while_job_running():
+            # Put the buttons back to the ruleset's mode
+            self.set_match_mode(self.ruleset.match_all)
+            return
+
         if sender == self.ui.pushbttn_matchAll and sender.isChecked():
             self.ruleset.match_all = True
             print("User selected: Match All")
         elif sender == self.ui.pushbttn_matchOne and sender.isChecked():
             self.ruleset.match_all = False
             print("User selected: Match One")
+        self.update_watcher_rulesets()
 
     def folder_clicked(self, path):
         """
@@ -586,44 +765,246 @@ class MainWindow(QMainWindow):
             self.ui.pushbttn_matchAll.hide()
             self.ui.pushbttn_matchOne.hide()
 
+    def scan_target_directory(self, exclude_destinations=False, rulesets=None):
+        """
+        Returns a FolderInfo snapshot of the target directory, refreshed from the scan index when one is enabled.
+        The scan filter comes from rulesets, or the current rulesets. With exclude_destinations, the folders the
+        rulesets sort into are skipped, as a Sort does.
+        """
+        rulesets = rulesets if rulesets is not None else self.state.rulesets
+        prune = ScanFilter.from_rulesets(rulesets, exclude_destinations=exclude_destinations).prune
+        if self.state.scan_index is not None:
+            return self.state.scan_index.scan(self.state.target_directory, True, prune=prune)
+        return FolderInfo.from_path(self.state.target_directory, True, prune=prune)
+
+    def start_job(self, description, on_finished, run_job=None, exclude_destinations=False, rulesets=None):
+        """
+        Runs a sorting job on a background thread, showing its progress in the status bar.
+        on_finished is called on the UI thread once the job has ended. run_job, if given, runs instead of sorting
+        the target directory, e.g. to resume a recovered job. exclude_destinations skips the folders the rulesets
+        sort into, whose files are already sorted; only a Sort sets it, so a Delete still recycles files there.
+        The job works on its own copy of rulesets, or of the current rulesets, so nothing the user edits while it
+        runs can change it.
+        """
+        rulesets = copy.deepcopy(rulesets if rulesets is not None else self.state.rulesets)
+        prune = ScanFilter.from_rulesets(rulesets, exclude_destinations=exclude_destinations).prune
+        scan = lambda: self.scan_target_directory(exclude_destinations, rulesets)
+        job = AsyncSortingJob(rulesets, self.state.target_directory, description=description,
+                    streaming=self.state.streaming, stats=self.state.rule_stats, workers=self.state.action_workers,
+                    prune=prune, scan=None if self.state.streaming else scan,
+                    journal_dir=self.state.journal_dir, run_job=run_job, batch=self.state.batch,
+                    exclude_destinations=exclude_destinations)
+
+        self.job_thread = SortingJobThread(job, self)
+        self.job_thread.progress.connect(self.show_job_progress)
+        self.job_thread.failed.connect(lambda message: QMessageBox.warning(self, "Sorting failed", message))
+        self.job_thread.finished.connect(on_finished)
+        self.ui.pushButton_5.setEnabled(False)
+        self.ui.pushButton_4.setEnabled(False)
+        # The job reads the settings' objects, e.g. the scan index, while it runs
+        self.menuSettings.setEnabled(False)
+        self.job_thread.start()
+
+    def job_running(self):
+        return self.job_thread is not None and self.job_thread.isRunning()
+
+    def refuse_while_job_running(self):
+        """
+        Returns True, and says so in the status bar, if a job is running. Used by actions that change the rulesets
+        or the files a job is working on.
+        """
+        if not self.job_running():
+            return False
+        self.ui.statusbar.showMessage("Wait for the running job to finish, or press Escape to cancel it")
+        return True
+
+    def end_job(self):
+        self.job_thread = None
+        self.ui.pushButton_5.setEnabled(True)
+        self.ui.pushButton_4.setEnabled(True)
+        self.menuSettings.setEnabled(True)
+
+    def cancel_job(self):
+        """
+        Hook for the Escape key: stops the running job after its current action. Completed actions can still be undone.
+        """
+        if self.job_running():
+            self.job_thread.job.cancel()
+            self.ui.statusbar.showMessage("Cancelling...")
+
+    def show_job_progress(self, event):
+        self.ui.statusbar.showMessage(f"{event.state.capitalize()}: {event.scanned} scanned, {event.matched} matched, "
+                                      f"{event.acted} done, {event.bytes_moved / (1024 * 1024):.1f} MB moved")
+
     def sort(self):
         """
         Hook for sorting files when clicking the Sort button (pushButton_5)
         """
-        target = FolderInfo.from_path(self.state.target_directory, True) 
-        run_sorting_job(self.state.rulesets, target, description="User-initiated sort")
-        print(f"Ran sorting job successfully on directory {self.state.target_directory}")
+        if self.job_running():
+            return
+
+        def on_finished():
+            self.end_job()
+            print(f"Ran sorting job on directory {self.state.target_directory}")
+
+        self.start_job("User-initiated sort", on_finished, exclude_destinations=True)
 
     def delete(self):
+        if self.job_running():
+            return
+
         print("Deleting files by recycling those matching criteria...")
-        # Backup original actions so we can restore them later
-        original_actions = []
-        for folder, ruleset in self.state.rulesets.items():
+        # Recycle with a copy of the rulesets, so the user's rules keep their actions
+        rulesets = copy.deepcopy(self.state.rulesets)
+        for folder, ruleset in rulesets.items():
             for rule in ruleset.sorting_rules:
-                # Save a reference to each rule and its original action
-                original_actions.append((rule, rule.action))
-                # Overwrite the rule's action
                 rule.action = Action("recycle")
-        
-        target = FolderInfo.from_path(self.state.target_directory, True)
-        run_sorting_job(self.state.rulesets, target,
-                    description="User-initiated recycle action")
 
-        # Restore the original actions for all rules
-        for rule, original_action in original_actions:
-            rule.action = original_action
+        def on_finished():
+            self.end_job()
+            print("Deletion (recycle) process completed.")
 
-        print("Deletion (recycle) process completed, and original actions have been restored.")
+        self.start_job("User-initiated recycle action", on_finished, rulesets=rulesets)
     
+    def save_sort_plan(self):
+        """
+        Hook for File > Save Sort Plan: matches the target directory as a Sort would, without running any action, and
+        saves the plan as a dry run. Its summary is shown once it is saved, and File > Run Sort Plan applies it later.
+        """
+        if self.refuse_while_job_running():
+            return
+
+        file_path, _ = QFileDialog.getSaveFileName(
+            None,
+            "Save Sort Plan",
+            "",
+            "QwikSort Sort Plan (*.qsp);;All Files (*)"
+        )
+        if not file_path:
+            return  # User cancelled
+        if not file_path.endswith(".qsp"):
+            file_path += ".qsp"
+
+        # The job thread gets its own copies of everything it needs from the state
+        rulesets = copy.deepcopy(self.state.rulesets)
+        target = self.state.target_directory
+        use_scan_index = self.state.scan_index is not None
+        stats = self.state.rule_stats
+        summary = {}
+
+        def plan_job(progress):
+            prune = ScanFilter.from_rulesets(rulesets, exclude_destinations=True).prune
+            folder = self.scan_target_directory(True, rulesets) if use_scan_index else target
+            plan = build_plan(rulesets, folder, "User-initiated sort", prune=prune, stats=stats, progress=progress)
+            if progress.cancelled:
+                progress.finish("cancelled")
+                return
+            plan.save(file_path)
+            summary.update(plan.summary())
+            progress.finish("finished")
+
+        def on_finished():
+            self.end_job()
+            if not summary:
+                return
+            actions = ", ".join(f"{count} {action}" for action, count in summary["actions"].items()) or "none"
+            QMessageBox.information(self, "Sort Plan Saved",
+                                    f"{summary['files']} files ({summary['bytes'] / (1024 * 1024):.1f} MB) would be "
+                                    f"sorted into {len(summary['destinations'])} folders.\n"
+                                    f"Actions: {actions}\n"
+                                    f"Conflicts: {summary['conflicts']}\n\n"
+                                    f"The plan was saved to {file_path}. Use File > Run Sort Plan to apply it.")
+
+        self.start_job("Sort plan", on_finished, run_job=plan_job)
+
+    def run_sort_plan(self):
+        """
+        Hook for File > Run Sort Plan: applies a plan saved with Save Sort Plan. Files that changed or disappeared since
+        the plan was saved are skipped, and the whole plan is undone as one batch.
+        """
+        if self.refuse_while_job_running():
+            return
+
+        file_path, _ = QFileDialog.getOpenFileName(
+            None,
+            "Run Sort Plan",
+            "",
+            "QwikSort Sort Plan (*.qsp);;All Files (*)"
+        )
+        if not file_path:
+            return  # User cancelled
+
+        workers = self.state.action_workers
+        journal_dir = self.state.journal_dir
+
+        def plan_job(progress):
+            execute_plan(SortPlan.load(file_path), workers=workers, progress=progress, journal_dir=journal_dir)
+
+        def on_finished():
+            self.end_job()
+            print(f"Ran sort plan {file_path}")
+
+        self.start_job("Sort plan", on_finished, run_job=plan_job)
+
+    def recover_jobs(self):
+        """
+        Offers to resume or roll back a sorting job that did not finish, e.g. because the app was closed or crashed.
+        Jobs are offered one at a time; the next is offered once a resumed job has ended.
+        """
+        if self.state.journal_dir is None or self.job_running():
+            return
+        jobs = find_unfinished(self.state.journal_dir)
+        if not jobs:
+            return
+        job = jobs[0]
+
+        msg_box = QMessageBox(self)
+        msg_box.setWindowTitle("Unfinished Sorting Job")
+        msg_box.setText(f"\"{job.description}\" started {job.created:%Y-%m-%d %H:%M} did not finish. "
+                        f"{len(job.get_completed())} files were already sorted.")
+        msg_box.setInformativeText("Resume finishes the job. Roll Back undoes the files it already sorted. "
+                                   "Keep leaves them where they are, and they can still be undone.")
+        resume_button = msg_box.addButton("Resume", QMessageBox.ButtonRole.AcceptRole)
+        roll_back_button = msg_box.addButton("Roll Back", QMessageBox.ButtonRole.DestructiveRole)
+        msg_box.addButton("Keep", QMessageBox.ButtonRole.RejectRole)
+        msg_box.exec()
+
+        if msg_box.clickedButton() == resume_button:
+            def on_finished():
+                self.end_job()
+                self.recover_jobs()
+
+            # Skip the same folders as the original job while matching the rest of its target folder
+            prune = None
+            if job.rulesets is not None:
+                prune = ScanFilter.from_rulesets(job.rulesets, exclude_destinations=job.exclude_destinations).prune
+            self.start_job(job.description, on_finished, run_job=lambda progress: resume_job(
+                job, workers=self.state.action_workers, progress=progress, journal_dir=self.state.journal_dir,
+                prune=prune))
+            return
+        with job_lock:
+            if msg_box.clickedButton() == roll_back_button:
+                job.roll_back()
+            else:
+                job.keep()
+        self.recover_jobs()
+
     def undo(self):
         """
         Undo the previous sorting operation using the Rollback module
         """
         print("Undo clicked")
-        undo_last()
+        if self.job_running():
+            # The job records its undo batch when it ends
+            return
+        # Waits for a group the watcher is sorting
+        with job_lock:
+            undo_last()
     
     def import_ruleset(self):
         print("Import Ruleset clicked")
+        if self.refuse_while_job_running():
+            return
 
         file_path, _ = QFileDialog.getOpenFileName(
             None, 
@@ -645,6 +1026,7 @@ class MainWindow(QMainWindow):
                 for folder_path, ruleset_data in data.items()
             }
 
+            self.restart_watcher()
             print(f"Rulesets imported from {file_path}")
 
         except Exception as e:
@@ -652,6 +1034,8 @@ class MainWindow(QMainWindow):
 
     def export_ruleset(self): 
         print("Export Ruleset clicked")
+        if self.refuse_while_job_running():
+            return
 
         file_path, _ = QFileDialog.getSaveFileName(
             None, 
@@ -697,23 +1081,33 @@ class MainWindow(QMainWindow):
                 for folder_path, ruleset_data in data.items()
             }
             
+            self.restart_watcher()
             print(f"Rulesets imported successfully from {file_path}")
         except Exception as e:
             print(f"Failed to import rulesets: {e}")
     
     def create_restore_point(self):
         print("Create Restore Point clicked")
-        folder = FolderInfo.from_path(self.state.target_directory, True)
+        # The scan index's connection and the files are in use by the job
+        if self.refuse_while_job_running():
+            return
+        folder = self.scan_target_directory()
         save_restore_point(folder)
 
     def rollback_to_restore_point(self):
         print("Rollback to Restore Point clicked")
-        rollback_to_restore_point()
+        if self.refuse_while_job_running():
+            return
+        with job_lock:
+            rollback_to_restore_point()
     
     def clear_ruleset(self):
+        if self.refuse_while_job_running():
+            return
         if self.state.selected_folder in self.state.rulesets:
             del self.state.rulesets[self.state.selected_folder]
             print(f"Cleared ruleset for {self.state.selected_folder}")
+            self.update_watcher_rulesets()
         else:
             print(f"No ruleset found for {self.state.selected_folder}")
         
@@ -729,9 +1123,12 @@ def main():
 
     app.setWindowIcon(QIcon("qwikicon.ico"))
     app_state = AppState()
+    app_state.action_workers = ActionExecutor.default_workers
+    app_state.journal_dir = get_journal_dir()
 
     window = MainWindow(app_state)
     window.show()
+    window.recover_jobs()
 
     # Check if a .qsr file was passed in args
     if len(sys.argv) > 1:
@@ -739,8 +1136,13 @@ def main():
         if file_arg.lower().endswith(".qsr") and os.path.isfile(file_arg):
             window.import_ruleset_from_file(file_arg)
 
-    sys.exit(app.exec())
+    exit_code = app.exec()
+    # Let the watcher finish its current group and write its log
+    window.stop_watcher()
+    sys.exit(exit_code)
 
 
 if __name__ == "__main__":
+    # Duplicate hashing runs in worker processes; in the frozen Windows build they must not start the GUI again
+    multiprocessing.freeze_support()
     main()